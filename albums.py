@@ -0,0 +1,95 @@
+import asyncio
+import logging
+
+from telegram import InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo
+
+from ordering import defer_update_done
+
+logger = logging.getLogger(__name__)
+
+MEDIA_GROUP_LIMIT = 10  # максимум элементов в одном sendMediaGroup
+
+
+def input_media(message, caption: str = None):
+    """InputMedia по file_id вложения сообщения (фото, видео, аудио или документ)."""
+    kwargs = {"caption": caption, "parse_mode": "HTML"} if caption else {}
+    if message.photo:
+        return InputMediaPhoto(message.photo[-1].file_id, **kwargs)
+    if message.video:
+        return InputMediaVideo(message.video.file_id, **kwargs)
+    if message.audio:
+        return InputMediaAudio(message.audio.file_id, **kwargs)
+    if message.document:
+        return InputMediaDocument(message.document.file_id, **kwargs)
+    return None
+
+
+def chunk_media(messages):
+    """
+    Делит сообщения альбома на пачки для sendMediaGroup: документы и аудио нельзя смешивать
+    с фото/видео и друг с другом, и в одной пачке не больше MEDIA_GROUP_LIMIT элементов.
+    """
+    visual = [m for m in messages if m.photo or m.video]
+    audio = [m for m in messages if m.audio]
+    documents = [m for m in messages if m.document]
+    for group in (visual, audio, documents):
+        for i in range(0, len(group), MEDIA_GROUP_LIMIT):
+            yield group[i:i + MEDIA_GROUP_LIMIT]
+
+
+class _PendingGroup:
+    __slots__ = ("messages", "context", "deadline", "task")
+
+    def __init__(self, context, deadline: float):
+        self.messages = []
+        self.context = context
+        self.deadline = deadline
+        self.task = None
+
+
+class MediaGroupCollector:
+    """
+    Собирает сообщения одного альбома (media_group_id) и отдаёт их одной пачкой.
+    Telegram присылает альбом отдельными обновлениями; пачка закрывается, когда
+    в течение window секунд не пришло новых сообщений этого альбома.
+    on_flush(messages, context) вызывается один раз на альбом.
+    """
+
+    def __init__(self, on_flush, window: float = 1.0):
+        self.on_flush = on_flush
+        self.window = window
+        self._groups = {}  # (chat_id, media_group_id) -> _PendingGroup
+
+    def add(self, message, context):
+        loop = asyncio.get_running_loop()
+        key = (message.chat_id, message.media_group_id)
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = _PendingGroup(context, loop.time() + self.window)
+            group.task = context.application.create_task(self._wait_and_flush(key, group))
+        else:
+            group.deadline = loop.time() + self.window
+            defer_update_done(group.task)  # сообщение будет переслано вместе с альбомом
+        group.messages.append(message)
+
+    async def _wait_and_flush(self, key, group: _PendingGroup):
+        loop = asyncio.get_running_loop()
+        while True:
+            delay = group.deadline - loop.time()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        del self._groups[key]
+        group.messages.sort(key=lambda m: m.message_id)
+        try:
+            await self.on_flush(group.messages, group.context)
+        except Exception as e:
+            logger.error(f"Ошибка при пересылке альбома {key[1]}: {e}")
+
+    def collected(self, chat_id: int) -> list:
+        """Сообщения альбомов чата, которые ещё собираются и не отправлены."""
+        return [m for (chat, _), group in self._groups.items() if chat == chat_id for m in group.messages]
+
+    def pending(self) -> int:
+        """Сколько альбомов сейчас собирается."""
+        return len(self._groups)
@@ -0,0 +1,186 @@
+import heapq
+import json
+import logging
+import math
+import re
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Источники ответов в индексе.
+CANNED = "canned"      # готовые ответы из CANNED_ANSWERS_FILE — можно показывать пользователям
+RESOLVED = "resolved"  # ответы операторов в прошлых обращениях — только подсказки операторам
+
+STEM_LENGTH = 5  # слова обрезаются до первых букв: "возврата", "возвратом" -> "возвр"
+_WORD = re.compile(r"\w+")
+STOP_WORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было вот
+от меня еще нет о из ему теперь когда даже ну ли если уже или ни быть был него до вас нибудь опять уж
+вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их чем была сам чтоб без
+чего раз тоже себе под будет ж тогда кто этот того потому этого какой здесь этом один мой тем чтобы нее
+сейчас были куда зачем всех можно при об хоть после над больше тот через эти нас про всего них какая
+много эту моя свою этой перед лучше чуть том такой им более всегда между это мне мой моя мои
+здравствуйте добрый день вечер утро спасибо пожалуйста подскажите скажите
+""".split())
+
+
+def tokenize(text: str) -> list:
+    """Слова текста для индекса: нижний регистр, без стоп-слов и чисел, обрезка до STEM_LENGTH букв."""
+    return [
+        word[:STEM_LENGTH]
+        for word in _WORD.findall((text or "").lower().replace("ё", "е"))
+        if len(word) > 1 and not word.isdigit() and word not in STOP_WORDS
+    ]
+
+
+class Answer:
+    """Документ индекса: doc_id ("c3" — готовый ответ, "t120" — обращение #120), заголовок и текст ответа."""
+
+    __slots__ = ("doc_id", "source", "title", "text", "screen", "length")
+
+    def __init__(self, doc_id: str, source: str, title: str, text: str, screen: str = None):
+        self.doc_id = doc_id
+        self.source = source
+        self.title = title
+        self.text = text
+        self.screen = screen  # экран меню (screens.SCREENS), который стоит показать вместе с ответом
+        self.length = 0
+
+
+class AnswerIndex:
+    """
+    Полнотекстовый поиск по готовым ответам и ответам операторов в прошлых обращениях.
+
+    Инвертированный индекс в памяти: слово -> {doc_id: число вхождений}; ранжирование BM25.
+    Поиск проходит только по спискам слов запроса. Слова, которые есть больше чем в common_fraction
+    документов ("товар", "возврат"), только уточняют оценку документов, найденных по более редким
+    словам, — иначе каждый запрос перебирал бы почти весь индекс.
+    Прошлых обращений хранится не больше max_resolved, самые старые вытесняются.
+    """
+
+    def __init__(self, max_resolved: int = 5000, k1: float = 1.2, b: float = 0.75, common_fraction: float = 0.1):
+        self.max_resolved = max_resolved
+        self.k1 = k1
+        self.b = b
+        self.common_fraction = common_fraction
+        self._postings = {}         # слово -> {doc_id: число вхождений}
+        self._documents = {}        # doc_id -> Answer
+        self._terms = {}            # doc_id -> слова документа (для удаления)
+        self._lengths = {}          # doc_id -> число слов
+        self._resolved = deque()    # doc_id прошлых обращений, от старых к новым
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def get(self, doc_id: str):
+        return self._documents.get(doc_id)
+
+    def counts(self) -> dict:
+        """Число документов по источникам."""
+        return {CANNED: len(self._documents) - len(self._resolved), RESOLVED: len(self._resolved)}
+
+    def add(self, answer: Answer, body: str):
+        """Добавляет (или заменяет) документ; body — индексируемый текст."""
+        if answer.doc_id in self._documents:
+            self.remove(answer.doc_id)
+        terms = tokenize(body)
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, count in counts.items():
+            self._postings.setdefault(term, {})[answer.doc_id] = count
+        answer.length = len(terms)
+        self._documents[answer.doc_id] = answer
+        self._terms[answer.doc_id] = counts
+        self._lengths[answer.doc_id] = answer.length
+        self._total_length += answer.length
+        if answer.source == RESOLVED:
+            self._resolved.append(answer.doc_id)
+            while len(self._resolved) > self.max_resolved:
+                self.remove(self._resolved[0])
+
+    def remove(self, doc_id: str):
+        answer = self._documents.pop(doc_id, None)
+        if answer is None:
+            return
+        for term in self._terms.pop(doc_id):
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+        del self._lengths[doc_id]
+        self._total_length -= answer.length
+        if answer.source == RESOLVED:
+            self._resolved.remove(doc_id)
+
+    def search(self, query: str, k: int = 3, source: str = None, min_score: float = 0.0, min_terms: int = 1):
+        """
+        До k лучших документов для запроса: [(оценка BM25, Answer)], по убыванию оценки.
+        min_terms — сколько разных слов запроса должно найтись в документе: одно общее слово
+        ("деньги", "оператор") ещё не значит, что документ отвечает на вопрос.
+        """
+        if not self._documents:
+            return []
+        total = len(self._documents)
+        lengths = self._lengths
+        # BM25: idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / средняя длина)) — константы вне цикла.
+        base = self.k1 * (1 - self.b)
+        per_length = self.k1 * self.b / (self._total_length / total or 1)
+        common = max(1, total * self.common_fraction)
+        postings_list = sorted(
+            filter(None, (self._postings.get(term) for term in set(tokenize(query)))), key=len
+        )
+        scores = {}
+        matched = {}
+        get = scores.get
+        for postings in postings_list:
+            weight = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5)) * (self.k1 + 1)
+            if scores and len(postings) > common:
+                for doc_id in scores:
+                    count = postings.get(doc_id)
+                    if count:
+                        scores[doc_id] += weight * count / (count + base + per_length * lengths[doc_id])
+                        matched[doc_id] = matched.get(doc_id, 0) + 1
+                continue
+            for doc_id, count in postings.items():
+                scores[doc_id] = get(doc_id, 0.0) + weight * count / (count + base + per_length * lengths[doc_id])
+                matched[doc_id] = matched.get(doc_id, 0) + 1
+        if min_terms > 1:
+            scores = {doc_id: s for doc_id, s in scores.items() if matched[doc_id] >= min_terms}
+        if source is not None:
+            scores = {doc_id: s for doc_id, s in scores.items() if self._documents[doc_id].source == source}
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(score, self._documents[doc_id]) for doc_id, score in best if score >= min_score]
+
+    # ---------------------------------------------
+    # SOURCES
+    # ---------------------------------------------
+    def load_canned(self, path: str, with_text: bool = True) -> int:
+        """
+        Загружает готовые ответы из JSON: [{"title", "text", "keywords": [...], "screen"}].
+        keywords и screen необязательны. with_text=False — индексировать только заголовок и keywords
+        (поиск для пользователей: в тексте ответа слишком много общих слов). Возвращает число загруженных ответов.
+        """
+        try:
+            with open(path, encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            logger.error(f"Ошибка чтения готовых ответов {path}: {e}")
+            return 0
+        for number, entry in enumerate(entries, start=1):
+            answer = Answer(f"c{number}", CANNED, entry["title"], entry["text"], entry.get("screen"))
+            body = " ".join([entry["title"], " ".join(entry.get("keywords", []))])
+            if with_text:
+                body = f"{body} {entry['text']}"
+            self.add(answer, body)
+        return len(entries)
+
+    def add_resolved(self, ticket_id: int, question: str, answer_text: str):
+        """Ответ оператора на обращение: ищется и по вопросу пользователя, и по самому ответу."""
+        if not question or not answer_text:
+            return
+        title = question if len(question) <= 60 else question[:60] + "…"
+        self.add(Answer(f"t{ticket_id}", RESOLVED, title, answer_text), f"{question} {answer_text}")
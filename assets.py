@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+_OG_IMAGE = re.compile(r'<meta[^>]+property=["\']og:image["\'][^>]+content=["\']([^"\']+)["\']', re.IGNORECASE)
+
+
+def page_image_url(page: str):
+    """Прямая ссылка на картинку со страницы просмотра (ibb.co и т.п.) — из <meta property="og:image">."""
+    match = _OG_IMAGE.search(page)
+    return match.group(1) if match else None
+
+
+class AssetCache:
+    """
+    Кэш file_id для статичных картинок меню.
+    Картинка загружается в Telegram по URL один раз; полученный file_id сохраняется в JSON-файл
+    и дальше отправляется вместо URL, так что Telegram не ходит на внешний хостинг при каждом нажатии.
+    Запись сбрасывается, если у картинки поменялся URL или содержимое (sha256 самой картинки) по этому URL.
+    URL может вести на страницу просмотра (https://ibb.co/...): тогда хэшируется картинка из её og:image,
+    а не HTML — он меняется при каждой загрузке.
+    """
+
+    def __init__(self, path: str, sources: dict):
+        self.path = path
+        self.sources = dict(sources)  # имя картинки -> URL
+        self.images = {}              # имя картинки -> прямая ссылка на картинку (для страниц просмотра)
+        self._digests = {}            # имя картинки -> sha256 картинки при последней проверке
+        self._entries = {}            # имя картинки -> {"url", "file_id", "sha256"}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"Ошибка чтения кэша картинок {self.path}: {e}")
+            return
+        for name, entry in stored.items():
+            # Запись действительна, только пока URL картинки не менялся.
+            if self.sources.get(name) == entry.get("url") and entry.get("file_id"):
+                self._entries[name] = entry
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Ошибка записи кэша картинок {self.path}: {e}")
+
+    def url(self, name: str) -> str:
+        """URL для загрузки картинки: прямая ссылка, если она уже известна, иначе исходный URL."""
+        return self.images.get(name) or self.sources[name]
+
+    def get(self, name: str) -> str:
+        """Возвращает file_id картинки, если он уже известен, иначе её URL."""
+        entry = self._entries.get(name)
+        return entry["file_id"] if entry else self.url(name)
+
+    def is_cached(self, name: str) -> bool:
+        return name in self._entries
+
+    def remember(self, name: str, message):
+        """
+        Сохраняет file_id из отправленного сообщения с картинкой вместе с sha256 картинки,
+        если revalidate уже её скачивал (иначе sha256 заполнит следующая проверка).
+        """
+        if name in self._entries or not message or not message.photo:
+            return
+        self._entries[name] = {
+            "url": self.sources[name],
+            "file_id": message.photo[-1].file_id,
+            "sha256": self._digests.get(name),
+        }
+        self._save()
+
+    def forget(self, name: str):
+        """Сбрасывает file_id, например если Telegram его больше не принимает."""
+        if self._entries.pop(name, None) is not None:
+            self._save()
+
+    @staticmethod
+    async def _download(session, url: str):
+        """Скачивает картинку: (прямая ссылка, байты). Страница просмотра заменяется картинкой из og:image."""
+        async with session.get(url) as response:
+            response.raise_for_status()
+            if not response.content_type.startswith("text/html"):
+                return url, await response.read()
+            image_url = page_image_url(await response.text())
+        if image_url is None:
+            raise ValueError("на странице нет og:image")
+        async with session.get(image_url) as response:
+            response.raise_for_status()
+            return image_url, await response.read()
+
+    async def revalidate(self):
+        """
+        Скачивает исходные картинки и сравнивает их sha256 с сохранёнными.
+        Если картинка по URL изменилась, file_id сбрасывается и картинка будет загружена заново.
+        """
+        import aiohttp
+
+        changed = False
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
+            for name, url in self.sources.items():
+                try:
+                    image_url, data = await self._download(session, url)
+                except Exception as e:
+                    logger.warning(f"Не удалось проверить картинку {name} ({url}): {e}")
+                    continue
+                digest = hashlib.sha256(data).hexdigest()
+                if image_url != url:
+                    self.images[name] = image_url
+                self._digests[name] = digest
+                entry = self._entries.get(name)
+                if entry is None:
+                    continue
+                if entry.get("sha256") is None:
+                    entry["sha256"] = digest
+                    changed = True
+                elif entry["sha256"] != digest:
+                    logger.info(f"Картинка {name} изменилась, file_id сброшен.")
+                    del self._entries[name]
+                    changed = True
+        if changed:
+            self._save()
@@ -0,0 +1,172 @@
+"""
+Локальная замена Telegram Bot API для нагрузочного теста.
+
+Отвечает на методы, которые использует bot1.py, правдоподобными объектами, считает вызовы
+по методам и раздаёт «файлы» для getFile/скачивания. Для каждого вызова можно задать
+искусственную задержку, а отправку по file_id — отклонять с заданной вероятностью,
+чтобы проверить путь с повторной загрузкой.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+BOT_USER = {"id": 424242, "is_bot": True, "first_name": "BenchBot", "username": "bench_bot"}
+
+
+class _ApiError(Exception):
+    pass
+
+
+MEDIA_METHODS = {
+    "sendPhoto": "photo",
+    "sendVideo": "video",
+    "sendDocument": "document",
+    "sendVoice": "voice",
+    "sendAudio": "audio",
+    "sendAnimation": "animation",
+    "sendVideoNote": "video_note",
+}
+
+
+class FakeBotApi:
+    def __init__(self, latency: float = 0.02, upload_latency_per_mb: float = 0.05,
+                 reject_file_id: float = 0.0, file_size: int = 2 * 1024 * 1024, seed: int = 1):
+        self.latency = latency
+        self.upload_latency_per_mb = upload_latency_per_mb
+        self.reject_file_id = reject_file_id
+        self.file_size = file_size
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.call_seconds = Counter()
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+        self._message_ids = itertools.count(10_000)
+        self._runner = None
+        self.port = None
+
+    # ---------------------------------------------
+    # OBJECTS
+    # ---------------------------------------------
+    def _message(self, chat_id, **fields):
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private" if int(chat_id) > 0 else "group"},
+            "from": BOT_USER,
+        }
+        message.update({k: v for k, v in fields.items() if v is not None})
+        return message
+
+    def _media(self, kind: str, message_id: int):
+        file = {"file_id": f"fake_{kind}_{message_id}", "file_unique_id": f"u{kind}{message_id}",
+                "file_size": self.file_size}
+        if kind == "photo":
+            return [dict(file, width=1280, height=960)]
+        if kind in ("video", "animation", "video_note"):
+            file.update(width=640, height=480, duration=10, length=240)
+            if kind == "video_note":
+                file.pop("width")
+                file.pop("height")
+            return file
+        if kind in ("voice", "audio"):
+            return dict(file, duration=10)
+        return dict(file, file_name=f"{message_id}.bin")
+
+    # ---------------------------------------------
+    # HANDLERS
+    # ---------------------------------------------
+    async def _api(self, request: web.Request):
+        method = request.match_info["method"]
+        started = time.perf_counter()
+        self.calls[method] += 1
+        form = await request.post()
+        params = {}
+        uploaded = 0
+        for key, value in form.items():
+            if isinstance(value, web.FileField):
+                uploaded += len(value.file.read())
+                params[key] = "attach"
+            else:
+                params[key] = value
+        self.bytes_uploaded += uploaded
+        await asyncio.sleep(self.latency + self.upload_latency_per_mb * uploaded / 1_048_576)
+        try:
+            result = self._result(method, params)
+        except _ApiError as e:
+            return web.json_response({"ok": False, "error_code": 400, "description": str(e)}, status=400)
+        finally:
+            self.call_seconds[method] += time.perf_counter() - started
+        return web.json_response({"ok": True, "result": result})
+
+    def _result(self, method: str, params: dict):
+        if method == "getMe":
+            return BOT_USER
+        if method in ("getUpdates",):
+            return []
+        if method in ("setWebhook", "deleteWebhook", "answerCallbackQuery", "deleteMessage"):
+            return True
+        if method == "getFile":
+            file_id = params["file_id"]
+            return {"file_id": file_id, "file_unique_id": f"u{file_id}", "file_size": self.file_size,
+                    "file_path": f"files/{file_id}"}
+        if method == "sendMessage":
+            return self._message(params["chat_id"], text=params.get("text"))
+        if method in ("editMessageText", "editMessageCaption", "editMessageReplyMarkup"):
+            return self._message(params.get("chat_id", 1), text=params.get("text"))
+        if method == "editMessageMedia":
+            media = json.loads(params["media"])
+            message = self._message(params.get("chat_id", 1), caption=media.get("caption"))
+            message[media["type"]] = self._media(media["type"], message["message_id"])
+            return message
+        if method == "sendMediaGroup":
+            items = json.loads(params["media"])
+            self._maybe_reject(any(not str(item["media"]).startswith("attach://") for item in items))
+            messages = []
+            for item in items:
+                message = self._message(params["chat_id"], caption=item.get("caption"), media_group_id="g")
+                message[item["type"]] = self._media(item["type"], message["message_id"])
+                messages.append(message)
+            return messages
+        if method in MEDIA_METHODS:
+            kind = MEDIA_METHODS[method]
+            value = str(params.get(kind))
+            self._maybe_reject(value != "attach" and not value.startswith("http"))
+            message = self._message(params["chat_id"], caption=params.get("caption"))
+            message[kind] = self._media(kind, message["message_id"])
+            return message
+        if method == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        raise _ApiError(f"Bad Request: method {method} is not emulated")
+
+    def _maybe_reject(self, by_file_id: bool):
+        if by_file_id and self.reject_file_id and self.random.random() < self.reject_file_id:
+            raise _ApiError("Bad Request: wrong file identifier/http url specified")
+
+    async def _file(self, request: web.Request):
+        self.calls["<download>"] += 1
+        self.bytes_downloaded += self.file_size
+        await asyncio.sleep(self.latency + self.upload_latency_per_mb * self.file_size / 1_048_576)
+        return web.Response(body=b"\0" * self.file_size)
+
+    # ---------------------------------------------
+    # SERVER
+    # ---------------------------------------------
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._api)
+        app.router.add_get("/file/bot{token}/{path:.*}", self._file)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{self.port}"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
@@ -0,0 +1,401 @@
+"""
+Нагрузочный тест bot1.py: настоящий Application с настоящими обработчиками против локального
+Bot API (bench/fake_api.py). Генерирует сессии пользователей (клики по меню, текстовые обращения,
+фото, видео, альбомы) и ответы оператора, затем печатает задержки обработки (p50/p99),
+число вызовов API на обращение, память и объём записанного на диск.
+
+Фейковый API работает в том же процессе, поэтому пик памяти включает и его буферы загрузок;
+для сравнения прогонов это не мешает, абсолютные числа завышены.
+
+Запуск из корня репозитория:
+    python -m bench.run --users 50 --mix default
+    python -m bench.run --users 20 --mix media --reject-file-id 0.3 --json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+from bench.fake_api import FakeBotApi
+
+OPERATOR_ID = 1138693316
+USER_ID_BASE = 5_000_000
+
+# Сколько действий каждого типа приходится на сессию пользователя (веса выбора).
+MIXES = {
+    "default": {"menu": 2, "text": 5, "photo": 2, "video": 1, "album": 1},
+    "menu": {"menu": 6, "text": 1},
+    "media": {"text": 1, "photo": 3, "video": 3, "album": 3},
+    "chatty": {"text": 8, "photo": 1},
+    "all": {"text": 2, "photo": 1, "video": 1, "album": 1, "document": 1, "voice": 1, "video_note": 1,
+            "audio": 1, "animation": 1},
+}
+SUBMISSION_KINDS = ("text", "photo", "video", "album", "document", "voice", "video_note", "audio", "animation")
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class TrafficGenerator:
+    """Строит JSON-обновления Telegram для сессий пользователей и ответов оператора."""
+
+    def __init__(self, seed: int = 1):
+        self.random = random.Random(seed)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._media_groups = itertools.count(1)
+
+    @staticmethod
+    def _user(user_id: int):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"u{user_id}"}
+
+    def _message(self, chat_id: int, from_id: int, **fields):
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": self._user(from_id),
+        }
+        message.update(fields)
+        return message
+
+    def _update(self, kind: str, **fields):
+        return kind, dict(update_id=next(self._update_ids), **fields)
+
+    def _file(self, prefix: str):
+        n = next(self._message_ids)
+        return {"file_id": f"{prefix}_{n}", "file_unique_id": f"{prefix}u{n}", "file_size": 1_500_000}
+
+    def command(self, user_id: int, text: str):
+        return self._update("command", message=self._message(
+            user_id, user_id, text=text, entities=[{"type": "bot_command", "offset": 0, "length": len(text)}]
+        ))
+
+    def click(self, kind: str, chat_id: int, from_id: int, data: str, photo: bool = False):
+        bot_message = self._message(chat_id, 424242, **(
+            {"photo": [dict(self._file("menu"), width=800, height=600)], "caption": "menu"} if photo
+            else {"text": "screen"}
+        ))
+        bot_message["from"] = {"id": 424242, "is_bot": True, "first_name": "BenchBot"}
+        return self._update(kind, callback_query={
+            "id": str(next(self._update_ids)),
+            "from": self._user(from_id),
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": bot_message,
+        })
+
+    def submission(self, kind: str, user_id: int):
+        if kind == "text":
+            return [self._update("text", message=self._message(
+                user_id, user_id, text="Товар пришёл с браком, прошу вернуть деньги. Заказ 12345."
+            ))]
+        if kind == "photo":
+            return [self._update("photo", message=self._message(
+                user_id, user_id, photo=[dict(self._file("photo"), width=1280, height=960)], caption="Фото брака"
+            ))]
+        if kind == "video":
+            return [self._update("video", message=self._message(
+                user_id, user_id, video=dict(self._file("video"), width=640, height=480, duration=12)
+            ))]
+        if kind in ("document", "voice", "video_note", "audio"):
+            fields = self._file(kind)
+            if kind != "document":
+                fields.update(duration=5)
+            if kind == "video_note":
+                fields.update(length=240)
+            return [self._update(kind, message=self._message(user_id, user_id, **{kind: fields}))]
+        if kind == "animation":
+            gif = dict(self._file("gif"), width=320, height=240, duration=3)
+            return [self._update(kind, message=self._message(user_id, user_id, animation=gif, document=gif))]
+        group = f"mg{next(self._media_groups)}"
+        return [
+            self._update("album", message=self._message(
+                user_id, user_id, media_group_id=group,
+                photo=[dict(self._file("photo"), width=1280, height=960)]
+            ))
+            for _ in range(self.random.randint(3, 6))
+        ]
+
+    def session(self, user_id: int, mix: dict, actions: int):
+        """Сессия пользователя: /start, клики по меню, «Не нашел ответа», обращения, «Завершить»."""
+        updates = [self.command(user_id, "/start")]
+        kinds = list(mix)
+        weights = [mix[k] for k in kinds]
+        chosen = self.random.choices(kinds, weights=weights, k=actions)
+        for _ in range(chosen.count("menu")):
+            updates.append(self.click("menu_click", user_id, user_id, "approve", photo=True))
+            updates.append(self.click("menu_click", user_id, user_id, "back", photo=True))
+        submissions = [k for k in chosen if k in SUBMISSION_KINDS]
+        if submissions:
+            updates.append(self.click("menu_click", user_id, user_id, "contact", photo=True))
+            for kind in submissions:
+                updates.extend(self.submission(kind, user_id))
+            updates.append(self.click("menu_click", user_id, user_id, "done"))
+        return updates, len(submissions)
+
+    def operator_reply(self, user_id: int):
+        return [
+            self.click("admin_click", OPERATOR_ID, OPERATOR_ID, f"admin_reply_{user_id}"),
+            self._update("admin_reply", message=self._message(
+                OPERATOR_ID, OPERATOR_ID, text="Здравствуйте! Оформите, пожалуйста, возврат, мы его одобрим."
+            )),
+        ]
+
+
+def configure_environment(workdir: str, api_url: str, args):
+    """Настройки bot1.py задаются через окружение, поэтому выставляем их до импорта."""
+    os.environ.update({
+        "BOT_TOKEN": "123456:BENCH",
+        "BOT_API_BASE_URL": f"{api_url}/bot",
+        "BOT_API_BASE_FILE_URL": f"{api_url}/file/bot",
+        "STATE_DB": os.path.join(workdir, "state.sqlite3"),
+        "SPOOL_DIR": os.path.join(workdir, "spool"),
+        "ASSET_CACHE_FILE": os.path.join(workdir, "asset_cache.json"),
+        "CONCURRENT_UPDATES": str(args.concurrency),
+        "ALBUM_WINDOW": str(args.album_window),
+        "OPERATOR_REPLY_SLA": "0",
+        "RATE_LIMIT_PER_CHAT": str(args.chat_rate),
+        "RATE_LIMIT_OVERALL": str(args.overall_rate),
+        "COALESCE_WINDOW": str(args.coalesce_window),
+        "SHUTDOWN_DRAIN_TIMEOUT": str(args.drain_timeout),
+        # Сессии бенчмарка приходят без пауз между действиями — антифлуд по умолчанию выключен.
+        "THROTTLE_RATE": str(args.throttle_rate),
+        "THROTTLE_BURST": str(args.throttle_burst),
+        # Текст сессий совпадает с готовыми ответами о браке и возврате денег: без --faq обращения создаются сразу.
+        "FAQ_MIN_SCORE": os.environ.get("FAQ_MIN_SCORE", "2.5") if args.faq else "0",
+    })
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+async def wait_idle(application, albums, inbox, posts, timeout: float):
+    """Ждёт, пока не опустеют очереди чатов, сборщик альбомов, посты режима склейки и фоновые отправки."""
+    deadline = time.monotonic() + timeout
+    idle_since = None
+    while time.monotonic() < deadline:
+        busy = application.pending_updates() or albums.pending() or inbox.pending() or posts.pending()
+        if busy:
+            idle_since = None
+        elif idle_since is None:
+            idle_since = time.monotonic()
+        elif time.monotonic() - idle_since > 0.3:
+            return True
+        await asyncio.sleep(0.02)
+    return False
+
+
+async def run(args):
+    api = FakeBotApi(latency=args.latency, reject_file_id=args.reject_file_id, file_size=args.file_size)
+    api_url = await api.start()
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    configure_environment(workdir, api_url, args)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    import logging
+    logging.disable(logging.WARNING if args.quiet else logging.NOTSET)
+    import bot1
+    from telegram import Update
+
+    # Трафик строится до запуска бота: ошибка в генераторе не оставит висеть Application.
+    generator = TrafficGenerator(seed=args.seed)
+    mix = MIXES[args.mix]
+    sessions = []
+    tickets = submissions = 0
+    for i in range(args.users):
+        user_id = USER_ID_BASE + i
+        updates, submitted = generator.session(user_id, mix, args.actions)
+        submissions += submitted
+        tickets += bool(submitted)  # все сообщения сессии попадают в одно обращение
+        if submitted and generator.random.random() < args.reply_rate:
+            updates += generator.operator_reply(user_id)
+        sessions.append(updates)
+
+    # Перемешиваем сессии между собой, сохраняя порядок внутри каждой, как в живом трафике.
+    streams = [iter(s) for s in sessions]
+    order = []
+    while streams:
+        stream = generator.random.choice(streams)
+        item = next(stream, None)
+        if item is None:
+            streams.remove(stream)
+        else:
+            order.append(item)
+
+    # Повторная доставка: часть обновлений приходит второй раз, как после таймаута webhook.
+    for _ in range(int(len(order) * args.redeliver)):
+        kind, data = generator.random.choice(order)
+        order.append(("redelivered", data))
+
+    tracemalloc.start()
+    application = bot1.build_application()
+
+    latencies = defaultdict(list)      # вид обновления -> время от постановки в очередь до конца обработки
+    enqueued_at = {}
+    kinds = {}
+    original = application._process_one
+
+    async def timed_process_one(update):
+        await original(update)
+        finished = time.perf_counter()
+        kind = kinds.pop(update.update_id, "redelivered")
+        latencies[kind].append(finished - enqueued_at.pop(update.update_id, finished))
+
+    application._process_one = timed_process_one
+
+    await application.initialize()
+    await application.start()
+
+    baseline_calls = sum(api.calls.values())
+    started = time.perf_counter()
+    for kind, data in order:
+        update = Update.de_json(data, application.bot)
+        if kind != "redelivered":
+            kinds[update.update_id] = kind
+            enqueued_at[update.update_id] = time.perf_counter()
+        await application.update_queue.put(update)
+        if args.rate:
+            await asyncio.sleep(1 / args.rate)
+    if args.stop_after:
+        # Остановка посреди нагрузки, как по SIGTERM при передеплое.
+        await asyncio.sleep(args.stop_after)
+        finished = False
+    else:
+        finished = await wait_idle(application, bot1.ALBUMS, bot1.INBOX, bot1.OPERATOR_POSTS, timeout=args.timeout)
+    elapsed = time.perf_counter() - started
+
+    in_flight_at_stop = application.tasks_in_flight()
+    stop_started = time.perf_counter()
+    await application.stop()
+    stop_elapsed = time.perf_counter() - stop_started
+    await application.shutdown()
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await api.stop()
+
+    api_calls = sum(api.calls.values()) - baseline_calls
+    all_latencies = [v for values in latencies.values() for v in values]
+    report = {
+        "users": args.users,
+        "mix": args.mix,
+        "updates": len(order),
+        "tickets": tickets,
+        "submissions": submissions,
+        "completed": finished,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_updates_per_s": round(len(order) / elapsed, 1) if elapsed else 0,
+        "latency_ms": {
+            kind: {
+                "count": len(values),
+                "p50": round(percentile(values, 0.5) * 1000, 1),
+                "p99": round(percentile(values, 0.99) * 1000, 1),
+                "mean": round(statistics.fmean(values) * 1000, 1),
+            }
+            for kind, values in sorted(latencies.items()) + [("ALL", all_latencies)] if values
+        },
+        "api_calls_total": api_calls,
+        "api_calls_per_ticket": round(api_calls / tickets, 2) if tickets else None,
+        "api_calls_by_method": dict(api.calls.most_common()),
+        "bytes_downloaded_from_api": api.bytes_downloaded,
+        "bytes_uploaded_to_api": api.bytes_uploaded,
+        "memory_peak_traced_mb": round(peak_traced / 1_048_576, 2),
+        "memory_max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "duplicates_skipped": bot1.UPDATES_SEEN.duplicates_total,
+        "relay_memory": bot1.RELAY_MEMORY.stats(),
+        "disk_bytes_spooled": bot1.SPOOL.bytes_spooled,
+        "disk_bytes_state_db": directory_size(workdir) - directory_size(os.path.join(workdir, "spool")),
+        "rate_limiter": application.bot.rate_limiter.stats(),
+        "http_pools": application.bot.request.stats(),
+        "throttled": dict(bot1.THROTTLE.throttled_total, muted_users=len(bot1.THROTTLE.muted())),
+        "faq": {outcome: n for (outcome,), n in bot1.FAQ_TOTAL.values.items()},
+        "answer_index": bot1.ANSWERS.counts(),
+        "startup_s": dict(bot1.LIFECYCLE.phases),
+        "stop": {"tasks_in_flight": in_flight_at_stop, "elapsed_s": round(stop_elapsed, 3)},
+    }
+    return report
+
+
+def print_report(report: dict):
+    print(f"users={report['users']} mix={report['mix']} updates={report['updates']} "
+          f"tickets={report['tickets']} submissions={report['submissions']} completed={report['completed']}")
+    print(f"elapsed {report['elapsed_s']} s, {report['throughput_updates_per_s']} updates/s")
+    print(f"{'kind':<14}{'count':>7}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for kind, row in report["latency_ms"].items():
+        print(f"{kind:<14}{row['count']:>7}{row['p50']:>10}{row['p99']:>10}{row['mean']:>10}")
+    print(f"API calls: {report['api_calls_total']} total, {report['api_calls_per_ticket']} per ticket")
+    print("  " + ", ".join(f"{m}={n}" for m, n in report["api_calls_by_method"].items()))
+    print(f"bytes via API: downloaded {report['bytes_downloaded_from_api']}, "
+          f"uploaded {report['bytes_uploaded_to_api']}")
+    print(f"memory: peak traced {report['memory_peak_traced_mb']} MB, max RSS {report['memory_max_rss_mb']} MB")
+    print(f"duplicate updates skipped: {report['duplicates_skipped']}")
+    print(f"relay memory: {report['relay_memory']}")
+    print(f"disk: spooled {report['disk_bytes_spooled']} B, state db {report['disk_bytes_state_db']} B")
+    print(f"rate limiter: {report['rate_limiter']}")
+    print(f"throttled: {report['throttled']}")
+    print(f"faq: {report['faq']}, answer index: {report['answer_index']}")
+    for name, pool in report["http_pools"].items():
+        print(f"http pool {name}: {pool}")
+    print(f"startup: {report['startup_s']}")
+    print(f"stop: {report['stop']['tasks_in_flight']} tasks in flight, drained in {report['stop']['elapsed_s']} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест bot1.py против локального Bot API")
+    parser.add_argument("--users", type=int, default=30)
+    parser.add_argument("--actions", type=int, default=4, help="действий на сессию пользователя")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="default")
+    parser.add_argument("--reply-rate", type=float, default=0.7, help="доля обращений с ответом оператора")
+    parser.add_argument("--rate", type=float, default=0, help="обновлений в секунду (0 — без паузы)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка ответа Bot API, с")
+    parser.add_argument("--file-size", type=int, default=2 * 1024 * 1024)
+    parser.add_argument("--reject-file-id", type=float, default=0.0,
+                        help="вероятность отказа в отправке по file_id (проверка повторной загрузки)")
+    parser.add_argument("--album-window", type=float, default=0.3)
+    parser.add_argument("--redeliver", type=float, default=0, help="доля обновлений, доставляемых повторно")
+    parser.add_argument("--coalesce-window", type=float, default=0, help="режим склейки сообщений, с")
+    parser.add_argument("--chat-rate", type=float, default=1000, help="лимит сообщений/с на чат")
+    parser.add_argument("--overall-rate", type=float, default=1000, help="общий лимит сообщений/с")
+    parser.add_argument("--stop-after", type=float, default=0,
+                        help="остановить бота через N с после начала трафика, не дожидаясь обработки")
+    parser.add_argument("--drain-timeout", type=float, default=20, help="SHUTDOWN_DRAIN_TIMEOUT, с")
+    parser.add_argument("--throttle-rate", type=float, default=0, help="THROTTLE_RATE, сообщений/с на пользователя")
+    parser.add_argument("--throttle-burst", type=float, default=10, help="THROTTLE_BURST")
+    parser.add_argument("--faq", action="store_true", help="показывать пользователям готовые ответы (FAQ_MIN_SCORE)")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="вывести отчёт в JSON")
+    parser.add_argument("--quiet", action="store_true", help="скрыть логи бота ниже WARNING")
+    args = parser.parse_args()
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,60 @@
+import asyncio
+import html
 import logging
+import os
+import re
+import time
+import httpx
 from telegram import (
-    InlineKeyboardButton,
-    InlineKeyboardMarkup,
+    InputMediaPhoto,
+    Message,
     Update
 )
+from telegram.error import BadRequest
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     ApplicationBuilder,
+    ApplicationHandlerStop,
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
     ConversationHandler,
     ContextTypes,
+    TypeHandler,
     filters
 )
 
+# Модули бота импортируются сразу: их синглтоны и декораторы (@timed) создаются при импорте, а сами
+# модули стоят меньше миллисекунды каждый. Время импорта — это httpx и telegram; тяжёлое, что нужно
+# не всегда (aiohttp для /metrics), импортируется внутри модулей при первом использовании.
+from albums import MediaGroupCollector, chunk_media, input_media
+from answers import CANNED, AnswerIndex
+from assets import AssetCache
+from dedupe import FileDeduplicator, UpdateDeduplicator
+from digest import OperatorInbox, PeriodicDigest
+from lifecycle import FastStartBot, Lifecycle
+from metrics import Registry, instrument
+from operators import OperatorPool, parse_operator_ids
+from ordering import ChatOrderedApplication, SerialTasks, released_update_slot
+from persistence import SQLitePersistence
+from screens import (
+    ASSET_URLS,
+    CONTINUE_KEYBOARD,
+    MAIN_MENU_SCREEN,
+    SCREENS,
+    TO_MAIN_MENU_KEYBOARD,
+    USER_REPLY_KEYBOARD,
+    admin_reply_button,
+    canned_keyboard,
+    faq_keyboard
+)
+from ratelimit import PRIORITY_HIGH, PRIORITY_LOW, PriorityRateLimiter
+from relay import ATTACHMENTS, MEDIA_KINDS, RelayJob, RelayPipeline, Transfer, acknowledge, message_media
+from spool import MemoryBudget, Spool
+from throttle import MUTE_START, RATE, RATE_FIRST, TicketQuota, UserThrottle
+from tickets import TicketStore
+from transport import PoolRequest, RoutedRequest, choose_http_version
+
 # ---------------------------------------------
 # SETTINGS
 # ---------------------------------------------
@@ -23,154 +64,582 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+BOT_TOKEN = os.environ.get("BOT_TOKEN")
+# Адрес Bot API; переопределяется, например, для нагрузочного теста с локальным сервером (bench/).
+BOT_API_BASE_URL = os.environ.get("BOT_API_BASE_URL", "https://api.telegram.org/bot")
+BOT_API_BASE_FILE_URL = os.environ.get("BOT_API_BASE_FILE_URL", "https://api.telegram.org/file/bot")
+# Пулы соединений с Bot API: быстрые методы и файлы (скачивание, загрузки) не мешают друг другу.
+# Таймауты — секунды на чтение и запись; соединения держатся открытыми BOT_API_KEEPALIVE секунд.
+BOT_API_POOL_SIZE = int(os.environ.get("BOT_API_POOL_SIZE", 32))
+BOT_API_TIMEOUT = float(os.environ.get("BOT_API_TIMEOUT", 10))
+BOT_API_FILE_POOL_SIZE = int(os.environ.get("BOT_API_FILE_POOL_SIZE", 8))
+BOT_API_FILE_TIMEOUT = float(os.environ.get("BOT_API_FILE_TIMEOUT", 120))
+BOT_API_KEEPALIVE = float(os.environ.get("BOT_API_KEEPALIVE", 60))
+BOT_API_HTTP_VERSION = choose_http_version(os.environ.get("BOT_API_HTTP_VERSION", ""))
+# Лимиты исходящих запросов: сообщений в секунду на один чат и на бота в целом.
+# RATE_LIMIT_CHAT_BURST — сколько сообщений в чат можно отправить подряд без ожидания.
+RATE_LIMIT_PER_CHAT = float(os.environ.get("RATE_LIMIT_PER_CHAT", 1))
+RATE_LIMIT_CHAT_BURST = float(os.environ.get("RATE_LIMIT_CHAT_BURST", 10))
+RATE_LIMIT_OVERALL = float(os.environ.get("RATE_LIMIT_OVERALL", 30))
+# Сколько обновлений (из разных чатов) обрабатывается одновременно.
+CONCURRENT_UPDATES = int(os.environ.get("CONCURRENT_UPDATES", 8))
 OPERATOR_CHAT_ID = 1138693316  # ID администратора (куда пересылаются сообщения)
+# Пул операторов: ID через запятую. По умолчанию — только OPERATOR_CHAT_ID.
+OPERATOR_CHAT_IDS = parse_operator_ids(os.environ.get("OPERATOR_CHAT_IDS", ""), OPERATOR_CHAT_ID)
+OPERATOR_STRATEGY = os.environ.get("OPERATOR_STRATEGY", "least_open")  # least_open | round_robin | sticky
+OPERATOR_REPLY_SLA = float(os.environ.get("OPERATOR_REPLY_SLA", 900))  # секунд до переназначения; 0 — выкл.
+
+# Режим склейки: сообщения пользователя за COALESCE_WINDOW секунд уходят оператору одним постом,
+# который дописывается ещё COALESCE_EDIT_WINDOW секунд. 0 — каждое сообщение отдельным постом.
+COALESCE_WINDOW = float(os.environ.get("COALESCE_WINDOW", 0))
+COALESCE_EDIT_WINDOW = float(os.environ.get("COALESCE_EDIT_WINDOW", 120))
+DIGEST_INTERVAL = float(os.environ.get("DIGEST_INTERVAL", 0))  # сводка открытых обращений раз в N секунд; 0 — выкл.
+INBOX = OperatorInbox(COALESCE_WINDOW, edit_window=COALESCE_EDIT_WINDOW)
+# Сообщения и вложения пользователей уходят операторам в фоне, по очереди для каждого пользователя:
+# обработчик не ждёт лимита чата оператора и не задерживает следующие нажатия пользователя.
+OPERATOR_POSTS = SerialTasks()
+
+# Состояния диалогов и user_data хранятся в SQLite и переживают передеплой.
+STATE_DB = os.environ.get("STATE_DB", "bot_state.sqlite3")
+PERSISTENCE_FLUSH_INTERVAL = float(os.environ.get("PERSISTENCE_FLUSH_INTERVAL", 5))
+TICKETS = TicketStore(STATE_DB)
+
+# Запуск и остановка: профиль бота берётся из STATE_DB, после запуска прогреваются PREWARM_CONNECTIONS
+# соединений. При остановке (SIGTERM) полученные обновления и пересылки дорабатывают
+# не дольше SHUTDOWN_DRAIN_TIMEOUT секунд — Render ждёт 30 секунд, прежде чем убить процесс.
+PREWARM_CONNECTIONS = int(os.environ.get("PREWARM_CONNECTIONS", 2))
+SHUTDOWN_DRAIN_TIMEOUT = float(os.environ.get("SHUTDOWN_DRAIN_TIMEOUT", 20))
+LIFECYCLE = Lifecycle(STATE_DB, prewarm_connections=PREWARM_CONNECTIONS)
+LIFECYCLE.mark("imports")
+
+# Повторно доставленные обновления и повторно присланные файлы не обрабатываются второй раз.
+UPDATES_SEEN = UpdateDeduplicator(STATE_DB)
+FILES_SEEN = FileDeduplicator(ttl=float(os.environ.get("FILE_DEDUPE_TTL", 3600)))
+
+# Файлы до RELAY_MEMORY_THRESHOLD при повторной загрузке держим в памяти, остальные — во временном каталоге.
+# Все пересылки вместе занимают не больше RELAY_MEMORY_BUDGET: при нехватке файл любого размера ждёт
+# своей очереди (PTB всё равно читает файл из SPOOL в память целиком перед отправкой).
+RELAY_MEMORY_THRESHOLD = int(os.environ.get("RELAY_MEMORY_THRESHOLD", 8 * 1024 * 1024))
+RELAY_MEMORY = MemoryBudget.from_env()
+ATTACHMENT_MAX_SIZE = int(os.environ.get("ATTACHMENT_MAX_SIZE", 0))  # байт; 0 — без ограничения
+SPOOL = Spool.from_env()
+
+# Антифлуд: не больше THROTTLE_RATE сообщений в секунду от пользователя (запас THROTTLE_BURST, альбом —
+# одно сообщение). После THROTTLE_MUTE_AFTER сообщений сверх лимита подряд пользователь заглушается
+# на THROTTLE_MUTE_SECONDS. THROTTLE_RATE=0 — без лимита (ручной /mute работает всегда).
+THROTTLE = UserThrottle(
+    rate=float(os.environ.get("THROTTLE_RATE", 0.5)),
+    burst=float(os.environ.get("THROTTLE_BURST", 10)),
+    mute_after=int(os.environ.get("THROTTLE_MUTE_AFTER", 20)),
+    mute_for=float(os.environ.get("THROTTLE_MUTE_SECONDS", 600))
+)
+# Вложений в одном обращении — не больше TICKET_MAX_ATTACHMENTS файлов и TICKET_MAX_BYTES байт; 0 — без лимита.
+TICKET_QUOTA = TicketQuota(
+    max_files=int(os.environ.get("TICKET_MAX_ATTACHMENTS", 50)),
+    max_bytes=int(os.environ.get("TICKET_MAX_BYTES", 200 * 1024 * 1024))
+)
+
+# Готовые ответы (CANNED_ANSWERS_FILE) и ответы операторов в прошлых обращениях — в одном поисковом индексе.
+# Оператор по кнопке "Ответить" видит SUGGESTIONS_K подсказок. Пользователю до создания обращения
+# показывается готовый ответ из FAQ (только заголовки и keywords), если совпало не меньше FAQ_MIN_TERMS
+# разных слов и оценка не ниже FAQ_MIN_SCORE; FAQ_MIN_SCORE=0 (по умолчанию) — не показывать.
+# Для canned_answers.json из репозитория разумно FAQ_MIN_SCORE=2.5: ниже — случайные совпадения вроде "товар не пришёл".
+CANNED_ANSWERS_FILE = os.environ.get("CANNED_ANSWERS_FILE", "canned_answers.json")
+SUGGESTIONS_K = int(os.environ.get("SUGGESTIONS_K", 3))
+FAQ_MIN_SCORE = float(os.environ.get("FAQ_MIN_SCORE", 0))
+FAQ_MIN_TERMS = int(os.environ.get("FAQ_MIN_TERMS", 2))
+ANSWERS = AnswerIndex(max_resolved=int(os.environ.get("RESOLVED_ANSWERS_MAX", 5000)))
+ANSWERS.load_canned(CANNED_ANSWERS_FILE)
+FAQ = AnswerIndex(max_resolved=0)
+FAQ.load_canned(CANNED_ANSWERS_FILE, with_text=False)
 
 # Состояния для ConversationHandler:
 ASK_QUESTION = 1     # Основное состояние для сообщений пользователей ("Не нашел ответа")
 ADMIN_REPLY = 11     # Мини-диалог: админ отвечает пользователю
 USER_REPLY = 12      # Мини-диалог: пользователь отвечает админу
 
-MAIN_MENU_PHOTO_URL = "https://ibb.co/MDyvMRTQ"
-MAIN_MENU_TEXT = (
-    "Ниже расположено меню с типовыми ситуациями. Пожалуйста ознакомьтесь, "
-    "нажав на соответствующую кнопку.\n\n"
-    "Если мы решили Ваш вопрос, просим поставить ★★★★★ или скорректировать оценку, "
-    "либо дополнить отзыв.\n"
-    "С Уважением, TITAN STYLE!"
-)
+# Картинки меню отправляются по закэшированному file_id, а не по URL.
+ASSETS = AssetCache(os.environ.get("ASSET_CACHE_FILE", "asset_cache.json"), ASSET_URLS)
 
-CONTACT_TEXT = (
-    "<b>Если вы не нашли ответа на свой вопрос:</b>\n"
-    "Опишите, пожалуйста, проблему текстом ниже и прикрепите фото или видео товара, если это необходимо "
-    "[<b>ОБЯЗАТЕЛЬНО вместе с текстом</b>].\n"
-    "(Также желательно указать время оформления заявки на возврат или заказа товара, а также номер Заказа.)\n\n"
-    "Вскоре с вами свяжется <b>специалист гарантийной службы</b>."
+# ---------------------------------------------
+# METRICS
+# ---------------------------------------------
+# В webhook-режиме /metrics отдаёт сам веб-сервер; в polling-режиме — отдельный сервер на METRICS_PORT.
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))  # 0 — отдельный сервер не запускается
+METRICS = Registry()
+HANDLER_CALLS = METRICS.counter("bot_handler_calls_total", "Вызовы обработчиков", ["handler"])
+HANDLER_SECONDS = METRICS.histogram("bot_handler_seconds", "Время выполнения обработчиков", ["handler"])
+HANDLER_ERRORS = METRICS.counter("bot_handler_errors_total", "Исключения в обработчиках", ["handler", "error"])
+API_SECONDS = METRICS.histogram("bot_api_request_seconds", "Время запросов к Bot API", ["method"])
+MEDIA_BYTES = METRICS.counter(
+    "bot_media_relayed_bytes_total", "Объём пересланных вложений (file_id, memory, spool — способ передачи)",
+    ["media_type", "mode"]
+)
+FAQ_TOTAL = METRICS.counter(
+    "bot_faq_total", "Готовые ответы пользователям (shown, resolved — помог, forwarded — ушёл оператору)",
+    ["outcome"]
 )
+CANNED_SENT = METRICS.counter("bot_canned_answers_sent_total", "Ответы операторов из подсказок", ["source"])
+timed = instrument(HANDLER_CALLS, HANDLER_SECONDS, HANDLER_ERRORS)
 
 # ---------------------------------------------
-# KEYBOARD FUNCTIONS
+# MENU ASSETS
 # ---------------------------------------------
-def get_main_menu_keyboard():
-    """Главное меню: кнопки расположены столбиком."""
-    keyboard = [
-        [InlineKeyboardButton("✅ Сможем помочь +", callback_data="approve")],
-        [InlineKeyboardButton("❌ НЕ Сможем помочь -", callback_data="reject")],
-        [InlineKeyboardButton("💬 Не нашел ответа", callback_data="contact")],
-        [InlineKeyboardButton("МЫ НА ОЗОН", url="https://www.ozon.ru/seller/titan-style-1468753/products/?miniapp=seller_1468753")],
-        [InlineKeyboardButton("МЫ НА ВБ", url="https://www.wildberries.ru/brands/310806956-titan-style/galstuki")]
-    ]
-    return InlineKeyboardMarkup(keyboard)
-
-def get_nav_keyboard():
-    """Навигация: кнопки 'Назад' и 'Главное меню'."""
-    keyboard = [
-        [
-            InlineKeyboardButton("🔙 Назад", callback_data="back"),
-            InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")
-        ]
-    ]
-    return InlineKeyboardMarkup(keyboard)
-
-def get_continue_keyboard():
-    """Клавиатура: 'Дополнить обращение' и 'Завершить'."""
-    keyboard = [
-        [
-            InlineKeyboardButton("Дополнить обращение", callback_data="add_more"),
-            InlineKeyboardButton("Завершить", callback_data="done")
-        ]
-    ]
-    return InlineKeyboardMarkup(keyboard)
+async def send_asset_photo(chat, name: str, **kwargs):
+    """
+    Отправляет картинку меню из ASSETS: по file_id, если он уже есть, иначе по URL
+    (и запоминает полученный file_id). Устаревший file_id сбрасывается и картинка отправляется по URL.
+    """
+    photo = ASSETS.get(name)
+    try:
+        message = await chat.send_photo(photo=photo, **kwargs)
+    except BadRequest as e:
+        if photo in (ASSETS.sources[name], ASSETS.url(name)):
+            raise  # не принят сам URL; file_id мог сбросить параллельный вызов, is_cached тут не годится
+        logger.warning(f"file_id картинки {name} не принят, отправляем по URL: {e}")
+        ASSETS.forget(name)
+        message = await chat.send_photo(photo=ASSETS.get(name), **kwargs)
+    ASSETS.remember(name, message)
+    return message
+
+# ---------------------------------------------
+# SCREEN NAVIGATION
+# ---------------------------------------------
+async def delete_message(message):
+    try:
+        await message.delete()
+    except Exception as e:
+        logger.error(f"Ошибка удаления сообщения: {e}")
+
+async def show_photo_screen(query, asset_name: str, caption: str = None, reply_markup=None):
+    """
+    Показывает экран с картинкой меню. Если в сообщении с кнопкой уже есть фото, оно
+    редактируется на месте (один вызов editMessageMedia). Иначе — или если редактирование
+    невозможно — сообщение удаляется и отправляется новое.
+    """
+    message = query.message
+    if message.photo:
+        try:
+            edited = await message.edit_media(
+                InputMediaPhoto(ASSETS.get(asset_name), caption=caption, parse_mode="HTML"),
+                reply_markup=reply_markup
+            )
+            if isinstance(edited, Message):
+                ASSETS.remember(asset_name, edited)
+            return
+        except BadRequest as e:
+            if "not modified" in str(e):
+                return
+            logger.warning(f"Не удалось отредактировать экран {asset_name}, отправляем заново: {e}")
+    await delete_message(message)
+    await send_asset_photo(
+        message.chat,
+        asset_name,
+        caption=caption,
+        parse_mode="HTML",
+        reply_markup=reply_markup
+    )
+
+async def show_text_screen(query, text: str, reply_markup=None):
+    """
+    Показывает текстовый экран: редактирует текст сообщения с кнопкой (editMessageText),
+    а если это сообщение с фото — удаляет его и отправляет новое (как ответ на нажатие — с PRIORITY_HIGH).
+    """
+    message = query.message
+    if message.text:
+        try:
+            await message.edit_text(text=text, parse_mode="HTML", reply_markup=reply_markup)
+            return
+        except BadRequest as e:
+            if "not modified" in str(e):
+                return
+            logger.warning(f"Не удалось отредактировать текст экрана, отправляем заново: {e}")
+    await delete_message(message)
+    await query.get_bot().send_message(
+        chat_id=message.chat_id, text=text, parse_mode="HTML", reply_markup=reply_markup,
+        rate_limit_args=PRIORITY_HIGH
+    )
 
-def admin_reply_button(user_id: int):
-    """Кнопка 'Ответить' для администратора, callback_data = "admin_reply_<user_id>"."""
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("Ответить", callback_data=f"admin_reply_{user_id}")]
-    ])
+async def show_screen(query, screen):
+    """Показывает экран из screens.SCREENS: с картинкой или текстовый."""
+    if screen.photo:
+        await show_photo_screen(query, screen.photo, caption=screen.text, reply_markup=screen.keyboard)
+    else:
+        await show_text_screen(query, screen.text, reply_markup=screen.keyboard)
+
+async def on_startup(application):
+    """
+    Фоновые задачи после запуска бота: прогрев соединений, проверка картинок меню,
+    индекс ответов, SLA операторов, сводки, сервер метрик.
+    """
+    LIFECYCLE.mark("initialized")
+    LIFECYCLE.start_background(
+        LIFECYCLE.prewarm(application.bot),
+        ASSETS.revalidate(),
+        load_resolved_answers()
+    )
+    OPERATORS.start(application.bot)
+    DIGEST.start(application.bot)
+    if METRICS_PORT:
+        await METRICS.start_server(METRICS_PORT)
 
-def user_reply_button():
-    """Кнопка 'Ответить админу' для пользователя."""
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("Ответить админу", callback_data="user_reply")]
-    ])
+async def on_stop(application):
+    """Остановка фоновых задач перед выключением бота."""
+    await LIFECYCLE.stop_background()
+    await OPERATORS.stop()
+    await DIGEST.stop()
+    await INBOX.flush_all()
+    UPDATES_SEEN.save()
+    await METRICS.stop_server()
 
 # ---------------------------------------------
-# HANDLERS
+# MEDIA RELAY
 # ---------------------------------------------
-async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Команда /start: отправляет фото главного меню с подписью и клавиатурой."""
-    await update.message.reply_photo(
-        photo=MAIN_MENU_PHOTO_URL,
-        caption=MAIN_MENU_TEXT,
-        parse_mode="HTML",
-        reply_markup=get_main_menu_keyboard()
+TRANSFER = Transfer(
+    SPOOL, RELAY_MEMORY, RELAY_MEMORY_THRESHOLD,
+    on_bytes=lambda kind, mode, amount: MEDIA_BYTES.inc(kind, mode, amount=amount)
+)
+
+def ticket_header(ticket_id: int, user) -> str:
+    """Шапка сообщения оператору: номер обращения и кто пишет (имя экранировано для HTML)."""
+    return (
+        f"<b>Обращение #{ticket_id} от:</b> {html.escape(user.first_name)} "
+        f"{html.escape(user.last_name or '')} (@{html.escape(user.username or 'нет')})\n"
+        f"<b>User ID:</b> {user.id}"
     )
 
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+_TAG = re.compile(r"<[^>]+>")
+
+def plain_text(text: str) -> str:
+    """HTML-текст поста без разметки — для повторной отправки, если Telegram не разобрал разметку."""
+    return html.unescape(_TAG.sub("", text))
+
+async def send_operator_post(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str, reply_markup=None) -> bool:
     """
-    Обработка основных кнопок меню:
-      - "approve": отправляем фото https://ibb.co/BHqVL4mM;
-      - "reject": отправляем фото https://ibb.co/zV00BTwN;
-      - "contact": отправляем инструкцию CONTACT_TEXT и переходим в состояние ASK_QUESTION;
-      - "back"/"main_menu": отправляем фото главного меню;
-      - "add_more": оставляем диалог открытым;
-      - "done": завершаем диалог и возвращаем фото главного меню;
-      - Если callback_data начинается с "admin_reply_" или равна "user_reply", передаём в мини-диалоги.
+    Отправляет оператору текстовый пост. Если Telegram не принял HTML-разметку, пост уходит
+    простым текстом. False — пост не отправлен, отправителю надо об этом сказать.
     """
-    query = update.callback_query
-    data = query.data
-    await query.answer()
     try:
-        await query.message.delete()
+        await context.bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML", reply_markup=reply_markup)
+        return True
+    except BadRequest as e:
+        logger.error(f"Оператор {chat_id} не принял пост, отправляем без разметки: {e}")
+        try:
+            await context.bot.send_message(chat_id=chat_id, text=plain_text(text), reply_markup=reply_markup)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка отправки поста оператору {chat_id}: {e}")
     except Exception as e:
-        logger.error(f"Ошибка удаления сообщения: {e}")
+        logger.error(f"Ошибка отправки поста оператору {chat_id}: {e}")
+    return False
 
-    if data == "approve":
-        await query.message.chat.send_photo(
-            photo="https://ibb.co/BHqVL4mM",
-            reply_markup=get_nav_keyboard()
-        )
-        return ASK_QUESTION
+def escaped_caption(message, limit: int = 700):
+    """Подпись отправителя, экранированная для HTML и обрезанная (подпись в Telegram — до 1024 символов)."""
+    if not message.caption:
+        return None
+    text = message.caption if len(message.caption) <= limit else message.caption[:limit] + "…"
+    return html.escape(text)
 
-    elif data == "reject":
-        await query.message.chat.send_photo(
-            photo="https://ibb.co/zV00BTwN",
-            reply_markup=get_nav_keyboard()
-        )
-        return ConversationHandler.END
+def quoted_caption(message, limit: int = 700) -> str:
+    """Подпись отправителя к вложению — после шапки в подписи получателю."""
+    caption = escaped_caption(message, limit)
+    return "\n\n" + caption if caption else ""
 
-    elif data == "contact":
-        await query.message.chat.send_message(
-            text=CONTACT_TEXT,
-            parse_mode="HTML",
-            reply_markup=get_nav_keyboard()
-        )
-        return ASK_QUESTION
+def seen_key(job):
+    """
+    Ключ отправителя в FILES_SEEN. Пользователь пишет одному оператору, а оператор — разным
+    пользователям, поэтому файлы оператора помним отдельно для каждого получателя.
+    """
+    if OPERATORS.is_operator(job.sender.id):
+        return job.sender.id, job.chat_id
+    return job.sender.id
 
-    elif data in ["back", "main_menu"]:
-        await query.message.chat.send_photo(
-            photo=MAIN_MENU_PHOTO_URL,
-            caption=MAIN_MENU_TEXT,
-            parse_mode="HTML",
-            reply_markup=get_main_menu_keyboard()
-        )
-        return ConversationHandler.END
+# Этапы конвейера пересылки вложений (relay.RelayPipeline). Строка в ответе — причина остановки.
+async def skip_duplicate(job):
+    """Тот же файл от того же отправителя уже пересылали — второй раз не скачиваем и не отправляем."""
+    if FILES_SEEN.seen(seen_key(job), job.media.file_unique_id):
+        logger.info(f"Файл {job.media.file_unique_id} от {job.sender.id} уже переслан, пропускаем")
+        return "duplicate"
+
+async def check_size(job):
+    if ATTACHMENT_MAX_SIZE and (job.media.file_size or 0) > ATTACHMENT_MAX_SIZE:
+        return "too_large"
+
+async def check_quota(job):
+    """
+    Лимит вложений текущего обращения (TICKET_QUOTA) — до записи в обращение и скачивания.
+    Файлы альбомов, которые ещё собираются в ALBUMS, считаются вместе с этим файлом: каждый
+    следующий файл альбома проверяется с учётом уже принятых.
+    """
+    waiting = ALBUMS.collected(job.message.chat_id)
+    size = sum(message_media(m)[1].file_size or 0 for m in waiting) + (job.media.file_size or 0)
+    if TICKET_QUOTA.check(TICKETS.active_ticket_id(job.sender.id), size, files=len(waiting) + 1):
+        return "quota"
+
+async def open_ticket(job):
+    """Записывает вложение в обращение пользователя и выбирает оператора."""
+    job.ticket_id = TICKETS.add_user_message(job.sender, job.kind.name, job.message.caption)
+    job.chat_id = OPERATORS.route(job.ticket_id, job.sender.id)
+    if INBOX.enabled:
+        await INBOX.flush_user(job.chat_id, job.sender.id)
+
+async def caption_new_ticket(job):
+    job.caption = (
+        f"{ticket_header(job.ticket_id, job.sender)}\n<i>Пользователь отправил {job.kind.label}.</i>"
+        + quoted_caption(job.message)
+    )
+    job.reply_markup = admin_reply_button(job.sender.id)
+
+async def caption_user_reply(job):
+    job.caption = f"<b>Ответ от пользователя:</b> {html.escape(job.sender.first_name)}" + quoted_caption(job.message)
+    job.reply_markup = admin_reply_button(job.sender.id)
+
+async def caption_operator_reply(job):
+    job.caption = "<b>Сообщение от администратора:</b>" + quoted_caption(job.message)
+    job.reply_markup = USER_REPLY_KEYBOARD
+
+async def send_attachment(job):
+    if not job.kind.caption and job.caption:
+        # У видеосообщений нет подписи — шапка уходит отдельным сообщением перед ним.
+        await job.context.bot.send_message(chat_id=job.chat_id, text=job.caption, parse_mode="HTML")
+    job.result = await TRANSFER.send(
+        job.context.bot, job.chat_id, job.kind, job.media, job.caption, reply_markup=job.reply_markup
+    )
+
+async def remember_file(job):
+    FILES_SEEN.remember(seen_key(job), job.media.file_unique_id)
+    if job.ticket_id is not None:  # ответы оператора в лимит обращения не входят
+        TICKET_QUOTA.charge(job.ticket_id, job.media.file_size or 0)
+
+async def record_operator_reply(job):
+    TICKETS.add_operator_message(job.chat_id, job.kind.name, job.message.caption, operator_id=job.message.chat_id)
 
-    elif data == "add_more":
-        await query.message.chat.send_message(
-            text="Опишите вашу проблему дополнительно или прикрепите новые файлы.",
+QUOTA_TEXT = "В этом обращении уже слишком много файлов. Пожалуйста, опишите проблему текстом."
+
+# Пользователь -> оператор: новое вложение в обращении (состояние ASK_QUESTION).
+NEW_TICKET_RELAY = RelayPipeline(
+    skip_duplicate, check_size, check_quota, open_ticket, caption_new_ticket, send_attachment, remember_file,
+    ack=acknowledge({
+        None: "Файл получен. Хотите что-то дополнить?",
+        "duplicate": "Этот файл уже получен. Хотите что-то дополнить?",
+        "too_large": "Файл слишком большой. Пожалуйста, отправьте файл поменьше или опишите проблему текстом.",
+        "quota": QUOTA_TEXT,
+        "error": "Ошибка при отправке {label_gen} администратору. Попробуйте ещё раз.",
+    }, reply_markup=CONTINUE_KEYBOARD)
+)
+
+# Пользователь -> оператор: ответ на сообщение администратора (состояние USER_REPLY).
+USER_REPLY_RELAY = RelayPipeline(
+    skip_duplicate, check_size, check_quota, open_ticket, caption_user_reply, send_attachment, remember_file,
+    ack=acknowledge({
+        None: "Ваш ответ ({label}) отправлен администратору.",
+        "duplicate": "Этот файл уже отправлен администратору.",
+        "too_large": "Файл слишком большой. Пожалуйста, отправьте файл поменьше.",
+        "quota": QUOTA_TEXT,
+        "error": "Ошибка при отправке {label_gen} администратору.",
+    })
+)
+
+# Оператор -> пользователь (состояние ADMIN_REPLY). Те же проверки, что и для файлов пользователя,
+# кроме лимита обращения.
+OPERATOR_REPLY_RELAY = RelayPipeline(
+    skip_duplicate, check_size, caption_operator_reply, send_attachment, remember_file, record_operator_reply,
+    ack=acknowledge({
+        None: "Ваш ответ ({label}) отправлен пользователю {chat_id}.",
+        "duplicate": "Этот файл уже отправлен пользователю {chat_id}.",
+        "too_large": "Файл слишком большой. Пожалуйста, отправьте файл поменьше.",
+        "error": "Ошибка при отправке {label_gen} пользователю.",
+    }, priority=PRIORITY_HIGH)
+)
+
+@timed
+async def relay_album(messages, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Пересылает альбом пользователя администратору: файлы — одним sendMediaGroup,
+    затем одно сообщение с кнопкой "Ответить". Пользователь получает одно подтверждение.
+    Файлы запоминаются в FILES_SEEN только после успешной пересылки — неудачный альбом можно отправить снова.
+    """
+    user = messages[0].from_user
+    captions = [m.caption for m in messages if m.caption]
+    ticket_id = TICKETS.add_user_message(user, "album", "\n".join(captions) or None)
+    TICKET_QUOTA.charge(
+        ticket_id, sum(message_media(m)[1].file_size or 0 for m in messages), files=len(messages)
+    )
+    operator_id = OPERATORS.route(ticket_id, user.id)
+    try:
+        if INBOX.enabled:
+            await INBOX.flush_user(operator_id, user.id)
+        for chunk in chunk_media(messages):
+            try:
+                await context.bot.send_media_group(
+                    chat_id=operator_id,
+                    media=[input_media(m, escaped_caption(m)) for m in chunk]
+                )
+                for m in chunk:
+                    kind, media = message_media(m)
+                    MEDIA_BYTES.inc(kind.name, "file_id", amount=media.file_size or 0)
+            except BadRequest as e:
+                logger.warning(f"Не удалось переслать альбом одной группой, пересылаем по одному: {e}")
+                for m in chunk:
+                    kind, media = message_media(m)
+                    await TRANSFER.send(context.bot, operator_id, kind, media, escaped_caption(m))
+        await context.bot.send_message(
+            chat_id=operator_id,
+            text=(
+                f"{ticket_header(ticket_id, user)}\n"
+                f"<i>Пользователь отправил альбом ({len(messages)} файлов).</i>"
+            ),
             parse_mode="HTML",
-            reply_markup=get_nav_keyboard()
+            reply_markup=admin_reply_button(user.id)
         )
-        return ASK_QUESTION
-
-    elif data == "done":
-        await query.message.chat.send_photo(
-            photo=MAIN_MENU_PHOTO_URL,
-            caption=MAIN_MENU_TEXT,
+    except Exception as e:
+        logger.error(f"Ошибка при пересылке альбома администратору: {e}")
+        await messages[-1].reply_text(
+            "Ошибка при отправке файлов администратору. Попробуйте ещё раз.",
             parse_mode="HTML",
-            reply_markup=get_main_menu_keyboard()
+            reply_markup=CONTINUE_KEYBOARD
         )
-        return ConversationHandler.END
+        return
+    for m in messages:
+        FILES_SEEN.remember(user.id, message_media(m)[1].file_unique_id)
+    await messages[-1].reply_text(
+        "Файлы получены. Хотите что-то дополнить?",
+        parse_mode="HTML",
+        reply_markup=CONTINUE_KEYBOARD
+    )
+
+# Сообщения одного альбома собираются в течение ALBUM_WINDOW секунд после последнего файла.
+ALBUMS = MediaGroupCollector(relay_album, window=float(os.environ.get("ALBUM_WINDOW", 1.0)))
+
+async def collect_album_item(job):
+    ALBUMS.add(job.message, job.context)
+
+# Пользователь -> оператор: файл альбома проходит те же проверки, что и одиночное вложение,
+# и ждёт остальных файлов в ALBUMS (пересылка — relay_album). Ответ об отказе — один на альбом.
+ALBUM_ITEM_RELAY = RelayPipeline(
+    skip_duplicate, check_size, check_quota, collect_album_item,
+    ack=acknowledge({
+        "duplicate": "Эти файлы уже получены. Хотите что-то дополнить?",
+        "too_large": "Часть файлов слишком большая и не отправлена. Пожалуйста, отправьте файлы поменьше "
+                     "или опишите проблему текстом.",
+        "quota": QUOTA_TEXT,
+        "error": "Ошибка при отправке файлов администратору. Попробуйте ещё раз.",
+    }, reply_markup=CONTINUE_KEYBOARD, once=lambda job: job.message.media_group_id)
+)
+
+# ---------------------------------------------
+# ANSWER INDEX
+# ---------------------------------------------
+async def load_resolved_answers(batch: int = 500):
+    """Индексирует ответы операторов в прошлых обращениях — пачками, не задерживая обработку обновлений."""
+    rows = TICKETS.answered(limit=ANSWERS.max_resolved)
+    rows.reverse()  # от старых к новым: при переполнении индекс вытесняет самые старые
+    for start in range(0, len(rows), batch):
+        for ticket_id, question, answer_text in rows[start:start + batch]:
+            ANSWERS.add_resolved(ticket_id, question, answer_text)
+        await asyncio.sleep(0)
+    logger.info(f"Индекс ответов загружен: {ANSWERS.counts()}")
+
+def learn_answer(ticket_id: int):
+    """Добавляет в индекс (или обновляет) последний ответ оператора на обращение."""
+    for _, question, answer_text in TICKETS.answered(ticket_id=ticket_id):
+        ANSWERS.add_resolved(ticket_id, question, answer_text)
+
+def suggest_answers(ticket_id: int):
+    """Подсказки оператору по текстам обращения: [(оценка, Answer)], без ответа на само это обращение."""
+    rows = TICKETS.answered(ticket_id=ticket_id) if ticket_id is not None else []
+    if not rows or not rows[0][1]:
+        return []
+    own = f"t{ticket_id}"
+    hits = ANSWERS.search(rows[0][1], k=SUGGESTIONS_K + 1)
+    return [(score, answer) for score, answer in hits if answer.doc_id != own][:SUGGESTIONS_K]
+
+def format_suggestions(hits, limit: int = 200) -> str:
+    lines = ["<b>Готовые ответы</b> (кнопка с номером отправит ответ пользователю):"]
+    for number, (_, answer) in enumerate(hits, start=1):
+        text = answer.text if len(answer.text) <= limit else answer.text[:limit] + "…"
+        source = "" if answer.source == CANNED else f"обращение #{answer.doc_id[1:]}: "
+        lines.append(f"{number}. {source}<b>{html.escape(answer.title)}</b> — {html.escape(text)}")
+    return "\n".join(lines)
+
+def faq_answer(text: str):
+    """Готовый ответ на вопрос пользователя, если он достаточно точно совпадает (FAQ_MIN_SCORE, FAQ_MIN_TERMS), иначе None."""
+    if not FAQ_MIN_SCORE:
+        return None
+    hits = FAQ.search(text, k=1, min_score=FAQ_MIN_SCORE, min_terms=FAQ_MIN_TERMS)
+    return hits[0][1] if hits else None
+
+# ---------------------------------------------
+# HANDLERS
+# ---------------------------------------------
+THROTTLE_NOTICES = {
+    RATE_FIRST: "Вы отправляете сообщения слишком часто. Пожалуйста, подождите немного.",
+    MUTE_START: "Слишком много сообщений подряд. Бот не будет принимать ваши сообщения {minutes} мин.",
+}
+# Короткий ответ на нажатие кнопки сверх лимита (подсказка вверху экрана, не окно).
+THROTTLE_QUERY_NOTICES = {
+    RATE: "Слишком часто, подождите немного.",
+}
+
+async def throttle_guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Группа -1: сообщения и нажатия кнопок пользователей проверяются THROTTLE до всех остальных
+    обработчиков. Лишние отбрасываются (ApplicationHandlerStop) ещё до скачивания файлов
+    и постов оператору; предупреждение отправляется один раз за серию и при заглушении.
+    Нажатие кнопки получает ответ всегда — иначе кнопка в клиенте Telegram остаётся в "загрузке".
+    """
+    user = update.effective_user
+    if user is None or OPERATORS.is_operator(user.id):
+        return
+    message = update.message
+    verdict = THROTTLE.check(user.id, message.media_group_id if message else None)
+    if verdict is None:
+        return
+    notice = THROTTLE_NOTICES.get(verdict)
+    if notice:
+        notice = notice.format(minutes=max(1, round(THROTTLE.mute_for / 60)))
+        if update.callback_query:
+            await update.callback_query.answer(notice, show_alert=True)
+        elif message:
+            await context.bot.send_message(
+                chat_id=message.chat_id,
+                text=notice,
+                reply_to_message_id=message.message_id,
+                rate_limit_args=PRIORITY_LOW
+            )
+    elif update.callback_query:
+        await update.callback_query.answer(THROTTLE_QUERY_NOTICES.get(verdict))
+    raise ApplicationHandlerStop
+
+@timed
+async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /start: отправляет фото главного меню с подписью и клавиатурой."""
+    await send_asset_photo(
+        update.message.chat,
+        MAIN_MENU_SCREEN.photo,
+        caption=MAIN_MENU_SCREEN.text,
+        parse_mode="HTML",
+        reply_markup=MAIN_MENU_SCREEN.keyboard
+    )
+
+@timed
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Обработка кнопок меню. Экраны описаны в screens.SCREENS (callback_data -> Screen):
+    экран показывается редактированием сообщения с кнопкой (см. show_screen), после чего
+    диалог переходит в ASK_QUESTION (если screen.opens_dialog) или завершается.
+    Если callback_data начинается с "admin_reply_" или равна "user_reply", передаём в мини-диалоги.
+    """
+    query = update.callback_query
+    data = query.data
+    await query.answer()
+
+    screen = SCREENS.get(data)
+    if screen is not None:
+        if data == "contact":
+            context.user_data.pop("faq_question", None)  # новое обращение — готовый ответ можно показать снова
+        await show_screen(query, screen)
+        return ASK_QUESTION if screen.opens_dialog else ConversationHandler.END
 
     elif data.startswith("admin_reply_"):
         return await admin_reply_start(update, context)
@@ -180,102 +649,131 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     return ConversationHandler.END
 
+async def post_user_text(context: ContextTypes.DEFAULT_TYPE, user, operator_id: int, text: str):
+    """
+    Фоновая пересылка текста пользователя (OPERATOR_POSTS). Пользователь уже получил
+    "Сообщение получено", поэтому если пост не ушёл, его просят отправить сообщение ещё раз.
+    """
+    if await send_operator_post(context, operator_id, text, reply_markup=admin_reply_button(user.id)):
+        return
+    await context.bot.send_message(
+        chat_id=user.id,
+        text="Не удалось передать ваше сообщение администратору. Пожалуйста, отправьте его ещё раз.",
+        reply_markup=CONTINUE_KEYBOARD
+    )
+
+def forward_user_text(context: ContextTypes.DEFAULT_TYPE, user, user_text: str):
+    """
+    Записывает текст пользователя в обращение и ставит пересылку оператору в OPERATOR_POSTS
+    (в режиме склейки — в INBOX).
+    """
+    ticket_id = TICKETS.add_user_message(user, "text", user_text)
+    operator_id = OPERATORS.route(ticket_id, user.id)
+    if INBOX.enabled:
+        INBOX.add(
+            context, operator_id, user.id, ticket_id, ticket_header(ticket_id, user), user_text,
+            reply_markup=admin_reply_button(user.id)
+        )
+    else:
+        OPERATOR_POSTS.submit(context.application, user.id, post_user_text(
+            context, user, operator_id,
+            f"{ticket_header(ticket_id, user)}\n\n<b>Сообщение:</b> {html.escape(user_text)}"
+        ))
+
+def forward_faq_question(context: ContextTypes.DEFAULT_TYPE, user) -> bool:
+    """Пересылает оператору вопрос, на который пользователю был показан готовый ответ (если он ещё ждёт)."""
+    question = context.user_data.pop("faq_question", None)
+    if question is None:
+        return False
+    FAQ_TOTAL.inc("forwarded")
+    forward_user_text(context, user, question)
+    return True
+
+@timed
 async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Обработка текстового сообщения в состоянии ASK_QUESTION.
-    Пересылаем сообщение администратору с кнопкой "Ответить" и предлагаем дополнить обращение.
+    Если обращения ещё нет и в FAQ есть подходящий готовый ответ, сначала показываем его
+    (вопрос ждёт в user_data["faq_question"] до кнопки под ответом или следующего сообщения).
+    Иначе пересылаем сообщение администратору с кнопкой "Ответить" и предлагаем дополнить обращение.
+    В режиме склейки сообщение дописывается в общий пост через INBOX.
     """
+    user = update.message.from_user
     user_text = update.message.text
-    message_text = (
-        f"<b>Обращение от:</b> {update.message.from_user.first_name} "
-        f"{update.message.from_user.last_name or ''} (@{update.message.from_user.username or 'нет'})\n"
-        f"<b>User ID:</b> {update.message.from_user.id}\n\n"
-        f"<b>Сообщение:</b> {user_text}"
-    )
-    await context.bot.send_message(
-        chat_id=OPERATOR_CHAT_ID,
-        text=message_text,
-        parse_mode="HTML",
-        reply_markup=admin_reply_button(update.message.from_user.id)
-    )
+    if "faq_question" not in context.user_data and TICKETS.active_ticket_id(user.id) is None:
+        answer = faq_answer(user_text)
+        if answer is not None:
+            context.user_data["faq_question"] = user_text
+            FAQ_TOTAL.inc("shown")
+            await update.message.reply_text(
+                f"<b>{html.escape(answer.title)}</b>\n{html.escape(answer.text)}\n\nЭто ответ на ваш вопрос?",
+                parse_mode="HTML",
+                reply_markup=faq_keyboard(answer.screen)
+            )
+            return ASK_QUESTION
+    forward_faq_question(context, user)
+    forward_user_text(context, user, user_text)
     await update.message.reply_text(
         "Сообщение получено. Хотите что-то дополнить?",
         parse_mode="HTML",
-        reply_markup=get_continue_keyboard()
+        reply_markup=CONTINUE_KEYBOARD
     )
     return ASK_QUESTION
 
+@timed
+async def faq_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Кнопки под готовым ответом: "faq_ok" — ответ помог, обращение не создаётся;
+    "faq_forward" — вопрос уходит оператору, как обычное сообщение.
+    """
+    query = update.callback_query
+    await query.answer()
+    if query.data == "faq_ok":
+        if context.user_data.pop("faq_question", None) is not None:
+            FAQ_TOTAL.inc("resolved")
+        try:
+            await query.edit_message_reply_markup(reply_markup=TO_MAIN_MENU_KEYBOARD)
+        except BadRequest as e:
+            logger.warning(f"Не удалось убрать кнопки под готовым ответом: {e}")
+        return ConversationHandler.END
+    if not forward_faq_question(context, query.from_user):
+        await show_screen(query, SCREENS["contact"])  # вопрос уже отправлен или потерян — просим написать снова
+        return ASK_QUESTION
+    await show_text_screen(query, "Сообщение получено. Хотите что-то дополнить?", reply_markup=CONTINUE_KEYBOARD)
+    return ASK_QUESTION
+
+@timed
 async def attachment_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    Обработка вложений (документы, фото, видео) в состоянии ASK_QUESTION.
-    Пересылаем сообщение администратору с кнопкой "Ответить" и предлагаем дополнить обращение.
-    """
-    user_info = (
-        f"<b>Обращение от:</b> {update.message.from_user.first_name} "
-        f"{update.message.from_user.last_name or ''} (@{update.message.from_user.username or 'нет'})\n"
-        f"<b>User ID:</b> {update.message.from_user.id}\n"
-    )
-    if update.message.document:
-        doc = update.message.document
-        file = await doc.get_file()
-        file_path = f"user_doc_{update.message.from_user.id}_{doc.file_unique_id}"
-        await file.download_to_drive(file_path)
-        caption = user_info + "<i>Пользователь отправил документ.</i>"
-        with open(file_path, "rb") as f:
-            await context.bot.send_document(
-                chat_id=OPERATOR_CHAT_ID,
-                document=f,
-                caption=caption,
-                parse_mode="HTML",
-                reply_markup=admin_reply_button(update.message.from_user.id)
-            )
-    elif update.message.photo:
-        photo = update.message.photo[-1]
-        file = await photo.get_file()
-        file_path = f"user_photo_{update.message.from_user.id}_{photo.file_unique_id}.jpg"
-        await file.download_to_drive(file_path)
-        caption = user_info + "<i>Пользователь отправил фото.</i>"
-        with open(file_path, "rb") as f:
-            await context.bot.send_photo(
-                chat_id=OPERATOR_CHAT_ID,
-                photo=f,
-                caption=caption,
-                parse_mode="HTML",
-                reply_markup=admin_reply_button(update.message.from_user.id)
-            )
-    elif update.message.video:
-        video = update.message.video
-        file = await video.get_file()
-        file_path = f"user_video_{update.message.from_user.id}_{video.file_unique_id}.mp4"
-        await file.download_to_drive(file_path)
-        caption = user_info + "<i>Пользователь отправил видео.</i>"
-        with open(file_path, "rb") as f:
-            await context.bot.send_video(
-                chat_id=OPERATOR_CHAT_ID,
-                video=f,
-                caption=caption,
-                parse_mode="HTML",
-                reply_markup=admin_reply_button(update.message.from_user.id)
-            )
-    await update.message.reply_text(
-        "Файл получен. Хотите что-то дополнить?",
-        parse_mode="HTML",
-        reply_markup=get_continue_keyboard()
+    Обработка вложений (фото, видео, документы, голосовые, видеосообщения, аудио, GIF) в состоянии ASK_QUESTION.
+    Пересылаем вложение администратору с кнопкой "Ответить" и предлагаем дополнить обращение (NEW_TICKET_RELAY).
+    Файлы альбома проходят проверки ALBUM_ITEM_RELAY, копятся в ALBUMS и пересылаются одной пачкой.
+    """
+    message = update.message
+    forward_faq_question(context, message.from_user)
+    if message.media_group_id:
+        await ALBUM_ITEM_RELAY.run(RelayJob(context, message))
+        return ASK_QUESTION
+    OPERATOR_POSTS.submit(
+        context.application, message.from_user.id, NEW_TICKET_RELAY.run(RelayJob(context, message))
     )
     return ASK_QUESTION
 
+@timed
 async def not_in_conversation_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Если сообщение приходит вне диалога, предлагаем вернуться в главное меню.
     """
-    keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(
-        "Чтобы отправить сообщение, пожалуйста, нажмите кнопку «💬 Не нашел ответа» в главном меню.",
-        reply_markup=reply_markup,
-        parse_mode="HTML"
+    await context.bot.send_message(
+        chat_id=update.message.chat_id,
+        text="Чтобы отправить сообщение, пожалуйста, нажмите кнопку «💬 Не нашел ответа» в главном меню.",
+        reply_to_message_id=update.message.message_id,
+        reply_markup=TO_MAIN_MENU_KEYBOARD,
+        parse_mode="HTML",
+        rate_limit_args=PRIORITY_HIGH  # в чате оператора — раньше накопившихся обращений
     )
 
+@timed
 async def cancel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /cancel — завершает текущий диалог."""
     await update.message.reply_text("Операция отменена.", parse_mode="HTML")
@@ -284,10 +782,11 @@ async def cancel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ---------------------------------------------
 # MINI DIALOG: ADMIN -> USER
 # ---------------------------------------------
+@timed
 async def admin_reply_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Старт мини-диалога: админ нажал кнопку "Ответить" (callback_data вида "admin_reply_<user_id>").
-    Извлекаем user_id и переводим админа в состояние ADMIN_REPLY.
+    Извлекаем user_id, показываем подсказки из ANSWERS и переводим админа в состояние ADMIN_REPLY.
     """
     query = update.callback_query
     await query.answer()
@@ -297,108 +796,95 @@ async def admin_reply_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.message.reply_text("Ошибка: не удалось извлечь ID пользователя.")
         return ConversationHandler.END
     context.user_data["reply_to_user_id"] = user_id
-    try:
-        await query.message.delete()
-    except Exception as e:
-        logger.error(f"Ошибка удаления сообщения: {e}")
-    await query.message.chat.send_message(
-        text=f"Введите текст ответа пользователю {user_id} или пришлите фото/документ/видео.",
-        parse_mode="HTML"
+    text = f"Введите текст ответа пользователю {user_id} или пришлите фото/документ/видео."
+    hits = suggest_answers(TICKETS.active_ticket_id(user_id))
+    if hits:
+        text = f"{text}\n\n{format_suggestions(hits)}"
+    # Текстовый пост обращения редактируется в подсказку (лимит чата оператора не тратится),
+    # пост с вложением удаляется и подсказка отправляется заново.
+    INBOX.close_post(query.message.chat_id, user_id)
+    await show_text_screen(
+        query, text,
+        reply_markup=canned_keyboard(user_id, tuple(answer.doc_id for _, answer in hits)) if hits else None
     )
     return ADMIN_REPLY
 
-async def admin_reply_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка текстового ответа администратора в состоянии ADMIN_REPLY."""
-    if "reply_to_user_id" not in context.user_data:
-        await update.message.reply_text("Неизвестен пользователь для ответа.", parse_mode="HTML")
-        return ConversationHandler.END
-    user_id = context.user_data["reply_to_user_id"]
-    answer_text = update.message.text
-    message = f"<b>Сообщение от администратора:</b>\n{answer_text}"
+async def reply_to_operator(context: ContextTypes.DEFAULT_TYPE, message, text: str):
+    """Ответ оператору на его действие: в очереди его чата идёт раньше пересылаемых обращений."""
+    await context.bot.send_message(
+        chat_id=message.chat_id,
+        text=text,
+        parse_mode="HTML",
+        reply_to_message_id=message.message_id,
+        rate_limit_args=PRIORITY_HIGH
+    )
+
+async def send_operator_answer(context: ContextTypes.DEFAULT_TYPE, message, user_id: int, answer_text: str):
+    """
+    Отправляет текстовый ответ оператора пользователю и записывает его в обращение;
+    подтверждение (или ошибка) — ответом на message в чате оператора. Ответ попадает в индекс подсказок.
+    """
     try:
         await context.bot.send_message(
             chat_id=user_id,
-            text=message,
+            text=f"<b>Сообщение от администратора:</b>\n{answer_text}",
             parse_mode="HTML",
-            reply_markup=user_reply_button()
-        )
-        await update.message.reply_text(
-            f"Ваш ответ отправлен пользователю {user_id}.",
-            parse_mode="HTML"
+            reply_markup=USER_REPLY_KEYBOARD
         )
+        ticket_id = TICKETS.add_operator_message(user_id, "text", answer_text, operator_id=message.chat_id)
+        await reply_to_operator(context, message, f"Ваш ответ отправлен пользователю {user_id}.")
     except Exception as e:
         logger.error(f"Ошибка при отправке сообщения пользователю: {e}")
-        await update.message.reply_text("Ошибка при отправке ответа пользователю.", parse_mode="HTML")
+        await reply_to_operator(context, message, "Ошибка при отправке ответа пользователю.")
+        return
+    if ticket_id is not None:
+        learn_answer(ticket_id)
+
+@timed
+async def admin_reply_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка текстового ответа администратора в состоянии ADMIN_REPLY."""
+    if "reply_to_user_id" not in context.user_data:
+        await update.message.reply_text("Неизвестен пользователь для ответа.", parse_mode="HTML")
+        return ConversationHandler.END
+    user_id = context.user_data["reply_to_user_id"]
+    await send_operator_answer(context, update.message, user_id, update.message.text)
     context.user_data.pop("reply_to_user_id", None)
     return ConversationHandler.END
 
+@timed
+async def admin_reply_canned(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Админ выбрал подсказку (callback_data вида "canned_<user_id>_<doc_id>") — её текст уходит пользователю."""
+    query = update.callback_query
+    _, user_id, doc_id = query.data.split("_", 2)
+    answer = ANSWERS.get(doc_id)
+    if answer is None:
+        await query.answer("Этого ответа больше нет в индексе, напишите ответ текстом.", show_alert=True)
+        return ADMIN_REPLY
+    await query.answer()
+    try:
+        await query.edit_message_reply_markup(reply_markup=None)
+    except BadRequest as e:
+        logger.warning(f"Не удалось убрать кнопки подсказок: {e}")
+    CANNED_SENT.inc(answer.source)
+    await send_operator_answer(context, query.message, int(user_id), answer.text)
+    context.user_data.pop("reply_to_user_id", None)
+    return ConversationHandler.END
+
+@timed
 async def admin_reply_attachment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка вложения от администратора в состоянии ADMIN_REPLY."""
     if "reply_to_user_id" not in context.user_data:
         await update.message.reply_text("Неизвестен пользователь для ответа.", parse_mode="HTML")
         return ConversationHandler.END
     user_id = context.user_data["reply_to_user_id"]
-
-    if update.message.photo:
-        photo = update.message.photo[-1]
-        file = await photo.get_file()
-        file_path = f"admin_reply_photo_{update.message.from_user.id}_{photo.file_unique_id}.jpg"
-        await file.download_to_drive(file_path)
-        caption = "<b>Сообщение от администратора:</b>"
-        try:
-            await context.bot.send_photo(
-                chat_id=user_id,
-                photo=open(file_path, "rb"),
-                caption=caption,
-                parse_mode="HTML",
-                reply_markup=user_reply_button()
-            )
-            await update.message.reply_text(f"Ваш ответ (фото) отправлен пользователю {user_id}.", parse_mode="HTML")
-        except Exception as e:
-            logger.error(f"Ошибка при отправке фото: {e}")
-            await update.message.reply_text("Ошибка при отправке фото пользователю.", parse_mode="HTML")
-    elif update.message.document:
-        doc = update.message.document
-        file = await doc.get_file()
-        file_path = f"admin_reply_doc_{update.message.from_user.id}_{doc.file_unique_id}"
-        await file.download_to_drive(file_path)
-        caption = "<b>Сообщение от администратора:</b>"
-        try:
-            await context.bot.send_document(
-                chat_id=user_id,
-                document=open(file_path, "rb"),
-                caption=caption,
-                parse_mode="HTML",
-                reply_markup=user_reply_button()
-            )
-            await update.message.reply_text(f"Ваш ответ (документ) отправлен пользователю {user_id}.", parse_mode="HTML")
-        except Exception as e:
-            logger.error(f"Ошибка при отправке документа: {e}")
-            await update.message.reply_text("Ошибка при отправке документа пользователю.", parse_mode="HTML")
-    elif update.message.video:
-        video = update.message.video
-        file = await video.get_file()
-        file_path = f"admin_reply_video_{update.message.from_user.id}_{video.file_unique_id}.mp4"
-        await file.download_to_drive(file_path)
-        caption = "<b>Сообщение от администратора:</b>"
-        try:
-            await context.bot.send_video(
-                chat_id=user_id,
-                video=open(file_path, "rb"),
-                caption=caption,
-                parse_mode="HTML",
-                reply_markup=user_reply_button()
-            )
-            await update.message.reply_text(f"Ваш ответ (видео) отправлен пользователю {user_id}.", parse_mode="HTML")
-        except Exception as e:
-            logger.error(f"Ошибка при отправке видео: {e}")
-            await update.message.reply_text("Ошибка при отправке видео пользователю.", parse_mode="HTML")
+    await OPERATOR_REPLY_RELAY.run(RelayJob(context, update.message, chat_id=user_id))
     context.user_data.pop("reply_to_user_id", None)
     return ConversationHandler.END
 
 # ---------------------------------------------
 # MINI DIALOG: USER -> ADMIN
 # ---------------------------------------------
+@timed
 async def user_reply_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Старт мини-диалога: пользователь нажал кнопку "Ответить админу"."""
     query = update.callback_query
@@ -414,129 +900,377 @@ async def user_reply_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return USER_REPLY
 
+async def send_user_reply(context: ContextTypes.DEFAULT_TYPE, message, ticket_id: int):
+    """Отправляет оператору текстовый ответ пользователя и подтверждает пользователю отправку."""
+    user = message.from_user
+    sent = await send_operator_post(
+        context,
+        OPERATORS.route(ticket_id, user.id),
+        (
+            f"<b>Ответ от пользователя:</b> {html.escape(user.first_name)}\n"
+            f"<b>User ID:</b> {user.id}\n\n"
+            f"{html.escape(message.text)}"
+        ),
+        reply_markup=admin_reply_button(user.id)
+    )
+    if sent:
+        await message.reply_text("Ваш ответ отправлен администратору.", parse_mode="HTML")
+    else:
+        await message.reply_text("Ошибка при отправке ответа админу.", parse_mode="HTML")
+
+@timed
 async def user_reply_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Пользователь прислал текст ответа в состоянии USER_REPLY."""
     if "reply_to_admin" not in context.user_data:
         await update.message.reply_text("Невозможно определить, кому вы отвечаете.", parse_mode="HTML")
         return ConversationHandler.END
+    user = update.message.from_user
     user_text = update.message.text
-    message = (
-        f"<b>Ответ от пользователя:</b> {update.message.from_user.first_name}\n"
-        f"<b>User ID:</b> {update.message.from_user.id}\n\n"
-        f"{user_text}"
-    )
-    try:
-        await context.bot.send_message(
-            chat_id=OPERATOR_CHAT_ID,
-            text=message,
-            parse_mode="HTML",
-            reply_markup=admin_reply_button(update.message.from_user.id)
-        )
-        await update.message.reply_text("Ваш ответ отправлен администратору.", parse_mode="HTML")
-    except Exception as e:
-        logger.error(f"Ошибка при отправке ответа админу: {e}")
-        await update.message.reply_text("Ошибка при отправке ответа админу.", parse_mode="HTML")
+    ticket_id = TICKETS.add_user_message(user, "text", user_text)
+    OPERATOR_POSTS.submit(context.application, user.id, send_user_reply(context, update.message, ticket_id))
     context.user_data.pop("reply_to_admin", None)
     return ConversationHandler.END
 
+@timed
 async def user_reply_attachment(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Пользователь прислал вложение в состоянии USER_REPLY."""
     if "reply_to_admin" not in context.user_data:
         await update.message.reply_text("Невозможно определить, кому вы отвечаете.", parse_mode="HTML")
         return ConversationHandler.END
-    admin_id = OPERATOR_CHAT_ID
-    if update.message.photo:
-        photo = update.message.photo[-1]
-        file = await photo.get_file()
-        file_path = f"user_reply_photo_{update.message.from_user.id}_{photo.file_unique_id}.jpg"
-        await file.download_to_drive(file_path)
-        caption = f"<b>Ответ от пользователя:</b> {update.message.from_user.first_name}"
-        try:
-            await context.bot.send_photo(
-                chat_id=admin_id,
-                photo=open(file_path, "rb"),
-                caption=caption,
-                parse_mode="HTML",
-                reply_markup=admin_reply_button(update.message.from_user.id)
-            )
-            await update.message.reply_text("Ваш ответ (фото) отправлен администратору.", parse_mode="HTML")
-        except Exception as e:
-            logger.error(f"Ошибка при отправке фото админу: {e}")
-            await update.message.reply_text("Ошибка при отправке фото администратору.", parse_mode="HTML")
-    elif update.message.document:
-        doc = update.message.document
-        file = await doc.get_file()
-        file_path = f"user_reply_doc_{update.message.from_user.id}_{doc.file_unique_id}"
-        await file.download_to_drive(file_path)
-        caption = f"<b>Ответ от пользователя:</b> {update.message.from_user.first_name}"
-        try:
-            await context.bot.send_document(
-                chat_id=admin_id,
-                document=open(file_path, "rb"),
-                caption=caption,
-                parse_mode="HTML",
-                reply_markup=admin_reply_button(update.message.from_user.id)
-            )
-            await update.message.reply_text("Ваш ответ (документ) отправлен администратору.", parse_mode="HTML")
-        except Exception as e:
-            logger.error(f"Ошибка при отправке документа админу: {e}")
-            await update.message.reply_text("Ошибка при отправке документа администратору.", parse_mode="HTML")
-    elif update.message.video:
-        video = update.message.video
-        file = await video.get_file()
-        file_path = f"user_reply_video_{update.message.from_user.id}_{video.file_unique_id}.mp4"
-        await file.download_to_drive(file_path)
-        caption = f"<b>Ответ от пользователя:</b> {update.message.from_user.first_name}"
-        try:
-            await context.bot.send_video(
-                chat_id=admin_id,
-                video=open(file_path, "rb"),
-                caption=caption,
-                parse_mode="HTML",
-                reply_markup=admin_reply_button(update.message.from_user.id)
-            )
-            await update.message.reply_text("Ваш ответ (видео) отправлен администратору.", parse_mode="HTML")
-        except Exception as e:
-            logger.error(f"Ошибка при отправке видео админу: {e}")
-            await update.message.reply_text("Ошибка при отправке видео администратору.", parse_mode="HTML")
+    OPERATOR_POSTS.submit(
+        context.application, update.message.from_user.id, USER_REPLY_RELAY.run(RelayJob(context, update.message))
+    )
     context.user_data.pop("reply_to_admin", None)
     return ConversationHandler.END
 
 # ---------------------------------------------
 # MAIN HANDLERS
 # ---------------------------------------------
+@timed
 async def not_in_conversation_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Если сообщение приходит вне диалога, предлагаем вернуться в главное меню."""
-    keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text(
-        "Чтобы отправить сообщение, пожалуйста, нажмите кнопку «💬 Не нашел ответа» в главном меню.",
-        reply_markup=reply_markup,
-        parse_mode="HTML"
+    await context.bot.send_message(
+        chat_id=update.message.chat_id,
+        text="Чтобы отправить сообщение, пожалуйста, нажмите кнопку «💬 Не нашел ответа» в главном меню.",
+        reply_to_message_id=update.message.message_id,
+        reply_markup=TO_MAIN_MENU_KEYBOARD,
+        parse_mode="HTML",
+        rate_limit_args=PRIORITY_HIGH  # в чате оператора — раньше накопившихся обращений
     )
 
+@timed
 async def cancel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /cancel — завершает текущий диалог."""
     await update.message.reply_text("Операция отменена.", parse_mode="HTML")
     return ConversationHandler.END
 
+# ---------------------------------------------
+# OPERATOR COMMANDS
+# ---------------------------------------------
+KIND_LABELS = dict(
+    {kind.name: f"[{kind.label}] " for kind in MEDIA_KINDS}, text="", album="[альбом] "
+)
+
+def format_age(seconds: float) -> str:
+    """Возраст в коротком виде: 45 с, 12 мин, 3 ч, 2 дн."""
+    if seconds < 60:
+        return f"{int(seconds)} с"
+    if seconds < 3600:
+        return f"{int(seconds // 60)} мин"
+    if seconds < 86400:
+        return f"{int(seconds // 3600)} ч"
+    return f"{int(seconds // 86400)} дн"
+
+def format_queue(queue):
+    """Строки очереди обращений для /tickets и сводки."""
+    now = time.time()
+    return [
+        f"#{ticket_id} — {html.escape(user_name)} (<code>{user_id}</code>), "
+        f"ждёт {format_age(now - waiting_since)} — /thread_{user_id}"
+        for ticket_id, user_id, user_name, waiting_since in queue
+    ]
+
+@timed
+async def tickets_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /tickets: обращения, ждущие ответа, — сначала самые давние."""
+    queue = TICKETS.open_queue()
+    if not queue:
+        await update.message.reply_text("Открытых обращений нет.", parse_mode="HTML")
+        return
+    lines = [f"<b>Ждут ответа ({TICKETS.count_open()}):</b>"] + format_queue(queue)
+    await update.message.reply_text("\n".join(lines), parse_mode="HTML")
+
+@timed
+async def thread_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /thread <user_id> (или /thread_<user_id>): переписка с пользователем."""
+    arg = context.args[0] if context.args else update.message.text.split("@")[0].split("_", 1)[-1]
+    try:
+        user_id = int(arg)
+    except ValueError:
+        await update.message.reply_text("Использование: /thread <user_id>", parse_mode="HTML")
+        return
+    rows = TICKETS.thread(user_id)
+    if not rows:
+        await update.message.reply_text(f"Обращений пользователя {user_id} нет.", parse_mode="HTML")
+        return
+    now = time.time()
+    lines = [f"<b>Переписка с пользователем {user_id}:</b>"]
+    for ticket_id, direction, kind, text, created_at in rows:
+        author = "👤" if direction == "user" else "🛠"
+        body = html.escape((text or "")[:200])
+        lines.append(f"#{ticket_id} {author} {format_age(now - created_at)} назад: {KIND_LABELS.get(kind, '')}{body}")
+    await update.message.reply_text(
+        "\n".join(lines),
+        parse_mode="HTML",
+        reply_markup=admin_reply_button(user_id)
+    )
+
+async def send_digest(bot):
+    """Периодическая сводка: каждому оператору — его обращения, ждущие ответа."""
+    for operator_id in OPERATOR_CHAT_IDS:
+        queue = TICKETS.open_queue(assignee=operator_id)
+        if not queue:
+            continue
+        lines = [f"<b>Сводка: ждут вашего ответа ({len(queue)}):</b>"] + format_queue(queue)
+        await bot.send_message(
+            chat_id=operator_id,
+            text="\n".join(lines),
+            parse_mode="HTML",
+            rate_limit_args=PRIORITY_LOW
+        )
+
+DIGEST = PeriodicDigest(DIGEST_INTERVAL, send_digest)
+
+async def notify_reassigned(bot, ticket, operator_id: int):
+    """Сообщает оператору, что ему передано обращение, оставшееся без ответа."""
+    ticket_id, user_id, user_name, previous, waiting_since = ticket
+    await bot.send_message(
+        chat_id=operator_id,
+        text=(
+            f"<b>Вам передано обращение #{ticket_id}</b> от {html.escape(user_name)} "
+            f"(<code>{user_id}</code>): без ответа уже {format_age(time.time() - waiting_since)}.\n"
+            f"Переписка: /thread_{user_id}"
+        ),
+        parse_mode="HTML",
+        reply_markup=admin_reply_button(user_id)
+    )
+
+OPERATORS = OperatorPool(
+    OPERATOR_CHAT_IDS,
+    OPERATOR_STRATEGY,
+    TICKETS,
+    sla=OPERATOR_REPLY_SLA,
+    on_reassign=notify_reassigned
+)
+
+@timed
+async def close_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /close <user_id>: закрывает текущее обращение пользователя."""
+    try:
+        user_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text("Использование: /close <user_id>", parse_mode="HTML")
+        return
+    ticket_id = TICKETS.close(user_id)
+    if ticket_id is None:
+        await update.message.reply_text(f"У пользователя {user_id} нет открытых обращений.", parse_mode="HTML")
+    else:
+        await update.message.reply_text(f"Обращение #{ticket_id} закрыто.", parse_mode="HTML")
+
+@timed
+async def mute_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /mute <user_id> [минут]: не принимать сообщения пользователя; без аргументов — список."""
+    if not context.args:
+        muted = THROTTLE.muted()
+        if not muted:
+            await update.message.reply_text("Заглушённых пользователей нет.", parse_mode="HTML")
+            return
+        lines = ["<b>Заглушены:</b>"] + [
+            f"<code>{user_id}</code> — ещё {format_age(left)}" for user_id, left in sorted(muted.items())
+        ]
+        await update.message.reply_text("\n".join(lines), parse_mode="HTML")
+        return
+    try:
+        user_id = int(context.args[0])
+        minutes = float(context.args[1]) if len(context.args) > 1 else 60
+    except ValueError:
+        await update.message.reply_text("Использование: /mute <user_id> [минут]", parse_mode="HTML")
+        return
+    THROTTLE.mute(user_id, minutes * 60)
+    await update.message.reply_text(
+        f"Пользователь {user_id} заглушён на {format_age(minutes * 60)}. Вернуть: /unmute {user_id}",
+        parse_mode="HTML"
+    )
+
+@timed
+async def unmute_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /unmute <user_id>: снова принимать сообщения пользователя."""
+    try:
+        user_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text("Использование: /unmute <user_id>", parse_mode="HTML")
+        return
+    if THROTTLE.unmute(user_id):
+        await update.message.reply_text(f"Пользователь {user_id} снова может писать.", parse_mode="HTML")
+    else:
+        await update.message.reply_text(f"Пользователь {user_id} не заглушён.", parse_mode="HTML")
+
 # ---------------------------------------------
 # MAIN
 # ---------------------------------------------
-def main():
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+def register_runtime_metrics(application):
+    """Метрики, которые считаются только при запросе /metrics: очереди, диалоги, спул, обращения."""
+    METRICS.computed(
+        "bot_open_conversations", "Открытые диалоги по состояниям",
+        lambda: application.persistence.open_conversations(), ["conversation", "state"]
+    )
+    METRICS.computed("bot_pending_updates", "Обновления в очередях чатов", application.pending_updates)
+    METRICS.computed("bot_tasks_in_flight", "Выполняющиеся задачи обработки и пересылки", application.tasks_in_flight)
+    METRICS.computed(
+        "bot_startup_seconds", "Время от старта процесса до фазы запуска", lambda: dict(LIFECYCLE.phases), ["phase"]
+    )
+    METRICS.computed("bot_pending_albums", "Альбомы, ожидающие отправки", ALBUMS.pending)
+    METRICS.computed(
+        "bot_inbox_total", "Режим склейки: сообщения пользователей, посты и дописывания операторам",
+        lambda: {"messages": INBOX.messages_total, "posts": INBOX.posts_total, "edits": INBOX.edits_total},
+        ["kind"], kind="counter"
+    )
+    METRICS.computed(
+        "bot_duplicates_skipped_total", "Пропущенные повторы: обновления и файлы",
+        lambda: {"update": UPDATES_SEEN.duplicates_total, "file": FILES_SEEN.duplicates_total},
+        ["kind"], kind="counter"
+    )
+    METRICS.computed("bot_open_tickets", "Обращения, ждущие ответа оператора", TICKETS.count_open)
+    METRICS.computed(
+        "bot_tickets_reassigned_total", "Переназначения обращений по SLA",
+        lambda: OPERATORS.reassigned_total, kind="counter"
+    )
+    METRICS.computed(
+        "bot_throttled_total", "Отброшенные сообщения пользователей (rate — сверх лимита, muted — заглушён)",
+        lambda: dict(THROTTLE.throttled_total), ["reason"], kind="counter"
+    )
+    METRICS.computed("bot_muted_users", "Заглушённые пользователи", lambda: len(THROTTLE.muted()))
+    METRICS.computed(
+        "bot_answer_index_documents", "Документы в индексе ответов (canned — готовые, resolved — из обращений)",
+        ANSWERS.counts, ["source"]
+    )
+    METRICS.computed(
+        "bot_ticket_quota_rejected_total", "Вложения сверх лимита обращения",
+        lambda: dict(TICKET_QUOTA.rejected_total), ["limit"], kind="counter"
+    )
+    request = application.bot.request
+    METRICS.computed("bot_http_pool_size", "Размер пула соединений с Bot API",
+                     lambda: {pool.name: pool.size for pool in request.pools}, ["pool"])
+    METRICS.computed("bot_http_pool_in_flight", "Запросы к Bot API в работе",
+                     lambda: {pool.name: pool.in_flight for pool in request.pools}, ["pool"])
+    METRICS.computed("bot_http_pool_in_flight_max", "Наибольшее число одновременных запросов",
+                     lambda: {pool.name: pool.in_flight_max for pool in request.pools}, ["pool"])
+    METRICS.computed(
+        "bot_http_pool_requests_total", "Запросы к Bot API по пулам",
+        lambda: {pool.name: pool.requests_total for pool in request.pools}, ["pool"], kind="counter"
+    )
+    METRICS.computed(
+        "bot_http_pool_saturated_total", "Запросы, ждавшие свободного соединения",
+        lambda: {pool.name: pool.saturated_total for pool in request.pools}, ["pool"], kind="counter"
+    )
+    METRICS.computed(
+        "bot_http_pool_timeouts_total", "Запросы, не дождавшиеся соединения (pool timeout)",
+        lambda: {pool.name: pool.pool_timeouts_total for pool in request.pools}, ["pool"], kind="counter"
+    )
+    limiter = application.bot.rate_limiter
+    METRICS.computed("bot_rate_limiter_queue_depth", "Запросы, ждущие лимита", lambda: limiter.queue_depth)
+    METRICS.computed(
+        "bot_rate_limiter_wait_seconds_total", "Суммарное ожидание лимита",
+        lambda: limiter.wait_seconds_total, kind="counter"
+    )
+    METRICS.computed(
+        "bot_rate_limiter_retry_after_total", "Ответы RetryAfter от Telegram",
+        lambda: limiter.retry_after_total, kind="counter"
+    )
+    METRICS.computed(
+        "bot_rate_limiter_network_retries_total", "Повторы запросов к операторам после сетевых ошибок",
+        lambda: limiter.network_retries_total, kind="counter"
+    )
+    METRICS.computed(
+        "bot_spool_bytes_total", "Байты, записанные в спул и вытесненные из него",
+        lambda: {"spooled": SPOOL.bytes_spooled, "evicted": SPOOL.bytes_evicted}, ["direction"], kind="counter"
+    )
+    METRICS.computed("bot_spool_files", "Файлы в спуле", lambda: SPOOL.stats()["files_active"])
+    METRICS.computed("bot_relay_memory_bytes", "Память под пересылаемые файлы", lambda: RELAY_MEMORY.in_use)
+    METRICS.computed(
+        "bot_relay_memory_waits_total", "Пересылки, ждавшие места в лимите памяти",
+        lambda: RELAY_MEMORY.waits_total, kind="counter"
+    )
+
+def build_application():
+    """Собирает Application со всеми обработчиками. Используется и в polling, и в webhook-режиме."""
+    SPOOL.purge_legacy()
+    bot = FastStartBot(
+        token=BOT_TOKEN,
+        base_url=BOT_API_BASE_URL,
+        base_file_url=BOT_API_BASE_FILE_URL,
+        request=RoutedRequest(
+            fast=PoolRequest(
+                "fast", BOT_API_POOL_SIZE,
+                httpx.Timeout(BOT_API_TIMEOUT, connect=5.0, pool=5.0),
+                keepalive_expiry=BOT_API_KEEPALIVE,
+                http_version=BOT_API_HTTP_VERSION
+            ),
+            # Большие тела по HTTP/2 идут медленнее (управление потоком в одном соединении), поэтому HTTP/1.1.
+            files=PoolRequest(
+                "files", BOT_API_FILE_POOL_SIZE,
+                httpx.Timeout(BOT_API_FILE_TIMEOUT, connect=10.0, pool=BOT_API_FILE_TIMEOUT),
+                keepalive_expiry=BOT_API_KEEPALIVE
+            )
+        ),
+        get_updates_request=HTTPXRequest(connection_pool_size=1),
+        rate_limiter=PriorityRateLimiter(
+            protected_chat_ids=OPERATOR_CHAT_IDS,
+            overall_rate=RATE_LIMIT_OVERALL,
+            chat_rate=RATE_LIMIT_PER_CHAT,
+            chat_burst=RATE_LIMIT_CHAT_BURST,
+            wait_context=released_update_slot,
+            api_latency=API_SECONDS
+        ),
+        lifecycle=LIFECYCLE
+    )
+    application = (
+        ApplicationBuilder()
+        .bot(bot)
+        .application_class(
+            ChatOrderedApplication,
+            kwargs={
+                "max_concurrency": CONCURRENT_UPDATES,
+                "dedupe": UPDATES_SEEN,
+                "drain_timeout": SHUTDOWN_DRAIN_TIMEOUT,
+                "on_first_update": LIFECYCLE.first_update
+            }
+        )
+        .persistence(SQLitePersistence(STATE_DB, update_interval=PERSISTENCE_FLUSH_INTERVAL))
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .build()
+    )
 
     conv_main = ConversationHandler(
-        entry_points=[CallbackQueryHandler(button_handler, pattern="^(contact)$")],
+        entry_points=[
+            CallbackQueryHandler(button_handler, pattern=frozenset({"contact"}).__contains__),
+            CallbackQueryHandler(faq_handler, pattern=frozenset({"faq_ok", "faq_forward"}).__contains__)
+        ],
         states={
             ASK_QUESTION: [
-                MessageHandler(filters.Document.ALL | filters.VIDEO | filters.PHOTO, attachment_handler),
+                MessageHandler(ATTACHMENTS, attachment_handler),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler),
-                CallbackQueryHandler(button_handler, pattern="^(add_more|done|back|main_menu)$")
+                CallbackQueryHandler(faq_handler, pattern=frozenset({"faq_ok", "faq_forward"}).__contains__),
+                CallbackQueryHandler(
+                    button_handler, pattern=frozenset({"add_more", "done", "back", "main_menu"}).__contains__
+                )
             ]
         },
         fallbacks=[CommandHandler("cancel", cancel_handler)],
-        allow_reentry=True
+        allow_reentry=True,
+        name="conv_main",
+        persistent=True
     )
 
     conv_reply = ConversationHandler(
@@ -547,24 +1281,41 @@ def main():
         states={
             ADMIN_REPLY: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, admin_reply_text),
-                MessageHandler(filters.Document.ALL | filters.VIDEO | filters.PHOTO, admin_reply_attachment)
+                MessageHandler(ATTACHMENTS, admin_reply_attachment),
+                CallbackQueryHandler(admin_reply_canned, pattern=r"^canned_\d+_[ct]\d+$")
             ],
             USER_REPLY: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, user_reply_text),
-                MessageHandler(filters.Document.ALL | filters.VIDEO | filters.PHOTO, user_reply_attachment)
+                MessageHandler(ATTACHMENTS, user_reply_attachment)
             ]
         },
         fallbacks=[],
-        allow_reentry=True
+        allow_reentry=True,
+        name="conv_reply",
+        persistent=True
     )
 
     application.add_handler(CommandHandler("start", start_handler))
+    operator_chat = filters.Chat(OPERATOR_CHAT_IDS)
+    application.add_handler(CommandHandler("tickets", tickets_command, filters=operator_chat))
+    application.add_handler(CommandHandler("thread", thread_command, filters=operator_chat))
+    application.add_handler(MessageHandler(operator_chat & filters.Regex(r"^/thread_\d+"), thread_command))
+    application.add_handler(CommandHandler("close", close_command, filters=operator_chat))
+    application.add_handler(CommandHandler("mute", mute_command, filters=operator_chat))
+    application.add_handler(CommandHandler("unmute", unmute_command, filters=operator_chat))
+    application.add_handler(TypeHandler(Update, throttle_guard), group=-1)
     application.add_handler(conv_main)
     application.add_handler(conv_reply)
-    application.add_handler(CallbackQueryHandler(button_handler, pattern="^(approve|reject|back|main_menu)$"))
+    application.add_handler(CallbackQueryHandler(
+        button_handler, pattern=frozenset({"approve", "reject", "back", "main_menu"}).__contains__
+    ))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, not_in_conversation_handler))
-    application.add_handler(MessageHandler(filters.Document.ALL | filters.VIDEO | filters.PHOTO, not_in_conversation_handler))
+    application.add_handler(MessageHandler(ATTACHMENTS, not_in_conversation_handler))
+    register_runtime_metrics(application)
+    return application
 
+def main():
+    application = build_application()
     application.run_polling()
 
 if __name__ == '__main__':
@@ -0,0 +1,107 @@
+import hashlib
+import hmac
+import logging
+import os
+
+from aiohttp import web
+from telegram import Update
+
+from bot1 import BOT_TOKEN, LIFECYCLE, METRICS, build_application
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------------------------
+# SETTINGS
+# ---------------------------------------------
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "").rstrip("/")  # https://refunds-bot.onrender.com
+WEBHOOK_PATH = "/webhook"
+PORT = int(os.environ.get("PORT", 8080))  # Render передаёт порт в переменной PORT
+
+# Секрет, который Telegram присылает в заголовке X-Telegram-Bot-Api-Secret-Token.
+# Если не задан явно, выводится из токена бота, чтобы не требовать ещё одну переменную в Dashboard.
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or hashlib.sha256(
+    (BOT_TOKEN or "").encode()
+).hexdigest()
+
+# ---------------------------------------------
+# ROUTES
+# ---------------------------------------------
+async def webhook_handler(request: web.Request):
+    """
+    Принимает обновление от Telegram. Проверяет секрет, кладёт обновление в очередь
+    Application и сразу отвечает 200 — обработка идёт в фоне.
+    """
+    secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(secret, WEBHOOK_SECRET):
+        return web.Response(status=403)
+    application = request.app["application"]
+    try:
+        data = await request.json()
+    except ValueError:
+        return web.Response(status=400)
+    update = Update.de_json(data, application.bot)
+    await application.update_queue.put(update)
+    return web.Response()
+
+async def health_handler(request: web.Request):
+    """Health check для Render (и для пингов, чтобы free-инстанс не засыпал)."""
+    return web.Response(text="ok")
+
+# ---------------------------------------------
+# LIFECYCLE
+# ---------------------------------------------
+async def set_webhook(application):
+    try:
+        await application.bot.set_webhook(
+            url=f"{WEBHOOK_HOST}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES
+        )
+    except Exception as e:
+        logger.error(f"Ошибка установки webhook {WEBHOOK_HOST}{WEBHOOK_PATH}: {e}")
+        return
+    logger.info(f"Webhook установлен: {WEBHOOK_HOST}{WEBHOOK_PATH}")
+
+async def on_startup(app: web.Application):
+    """
+    Запуск Application до того, как сервер начнёт принимать запросы. Сеть здесь не нужна:
+    профиль бота берётся из кэша, а webhook переустанавливается в фоне — после сна инстанса
+    он уже указывает на нас, и Telegram повторяет доставку, пока сервер не ответит.
+    """
+    application = app["application"]
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    application.create_task(set_webhook(application))
+    LIFECYCLE.mark("started")
+
+async def on_cleanup(app: web.Application):
+    """Остановка по SIGTERM: сервер уже не принимает запросы, stop() дорабатывает полученные обновления."""
+    application = app["application"]
+    await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+def make_web_app(application):
+    """aiohttp-приложение: webhook, health check, /metrics и запуск/остановка Application."""
+    app = web.Application()
+    app["application"] = application
+    app.router.add_post(WEBHOOK_PATH, webhook_handler)
+    app.router.add_get("/", health_handler)
+    app.router.add_get("/healthz", health_handler)
+    app.router.add_get("/metrics", METRICS.handle)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+def main():
+    if not BOT_TOKEN or not WEBHOOK_HOST:
+        raise SystemExit("Не заданы переменные окружения BOT_TOKEN и WEBHOOK_HOST.")
+    web.run_app(make_web_app(build_application()), port=PORT)
+
+if __name__ == '__main__':
+    main()
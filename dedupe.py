@@ -0,0 +1,166 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from persistence import open_db
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS update_watermark (
+    id         INTEGER PRIMARY KEY CHECK (id = 0),
+    update_id  INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+# Если обновлений не было дольше недели, Telegram начинает нумерацию update_id заново со случайного
+# значения — тогда сохранённая отметка устарела и новые обновления с меньшим ID отбрасывать нельзя.
+WATERMARK_EXPIRY = 6 * 24 * 3600
+
+# Telegram нумерует обновления подряд, но обновления, не входящие в allowed_updates, до бота не доходят
+# и оставляют пропуски. Пропуск, который не заполнился за это время, отметку больше не держит.
+GAP_TIMEOUT = 30.0
+
+
+class UpdateDeduplicator:
+    """
+    Отсекает повторно доставленные обновления (после падения, таймаута webhook или передеплоя).
+
+    - LRU последних capacity update_id ловит повторы, пока бот работает.
+    - Отметка (high-water mark) — наибольший update_id, до которого включительно все обновления
+      обработаны, — сохраняется в SQLite не чаще раза в save_interval секунд и при остановке.
+      После перезапуска всё, что не выше отметки прошлого запуска (restored), пропускается без обработки.
+
+    Отметка сдвигается только по обработанным update_id, идущим подряд: она не обгоняет ни обновления,
+    которые ещё обрабатываются, ни ещё не пришедшие (webhook доставляет не по порядку). Если бот упадёт,
+    такие обновления после перезапуска будут обработаны, а не потеряны. Пропуск в нумерации, который
+    не заполнился за gap_timeout секунд, считается закрытым.
+    Отметка текущего запуска только сохраняется и обновления не отсекает: webhook доставляет их
+    параллельно и не по порядку, и update_id ниже уже обработанного может прийти впервые.
+    """
+
+    def __init__(self, path: str, capacity: int = 10000, save_interval: float = 1.0,
+                 gap_timeout: float = GAP_TIMEOUT):
+        self.path = path
+        self.capacity = capacity
+        self.save_interval = save_interval
+        self.gap_timeout = gap_timeout
+        self._conn = None
+        self._lock = threading.Lock()
+        self._recent = OrderedDict()  # update_id -> None, порядок — от старых к новым
+        self._in_flight = set()
+        self._done = set()  # обработанные update_id выше отметки, до которых ещё есть необработанные
+        self._gap = None    # (update_id, с какого времени его ждём) — первый пропуск над отметкой
+        self.restored = 0  # отметка прошлого запуска: отсекает повторную доставку после перезапуска
+        self._restored_at = 0.0
+        self.watermark = 0
+        self._watermark_at = 0.0
+        self._saved = 0
+        self._saved_at = 0.0
+        self.duplicates_total = 0
+        self._load()
+
+    def _load(self):
+        self._conn = open_db(self.path)
+        self._conn.executescript(SCHEMA)
+        row = self._conn.execute("SELECT update_id, updated_at FROM update_watermark WHERE id = 0").fetchone()
+        if row and time.time() - row[1] < WATERMARK_EXPIRY:
+            self.restored = self.watermark = self._saved = row[0]
+            self._restored_at = self._watermark_at = row[1]
+
+    def seen(self, update_id: int) -> bool:
+        """True, если обновление уже обработано или обрабатывается; иначе запоминает его."""
+        if update_id <= self.restored:
+            if time.time() - self._restored_at < WATERMARK_EXPIRY:
+                self.duplicates_total += 1
+                return True
+            self.restored = self.watermark = 0  # нумерация началась заново
+            self._done.clear()
+        if update_id in self._recent:
+            self._recent.move_to_end(update_id)
+            self.duplicates_total += 1
+            return True
+        self._recent[update_id] = None
+        if len(self._recent) > self.capacity:
+            self._recent.popitem(last=False)
+        self._in_flight.add(update_id)
+        return False
+
+    def done(self, update_id: int):
+        """Обновление обработано: сдвигает отметку и при необходимости сохраняет её."""
+        self._in_flight.discard(update_id)
+        if update_id > self.watermark:
+            self._done.add(update_id)
+        watermark = self._advance()
+        if watermark > self.watermark:
+            self.watermark = watermark
+            self._watermark_at = time.time()
+        if self.watermark != self._saved and time.monotonic() - self._saved_at >= self.save_interval:
+            self.save()
+
+    def _advance(self) -> int:
+        """Наибольший update_id, до которого включительно обработаны все обновления."""
+        if not self._done:
+            return self.watermark
+        pending = self._done | {i for i in self._in_flight if i > self.watermark}
+        watermark = self.watermark or min(pending) - 1  # первый запуск: отсчёт от первого обновления
+        while True:
+            while watermark + 1 in self._done:
+                watermark += 1
+                self._done.discard(watermark)
+            if not self._done or watermark + 1 in self._in_flight:
+                self._gap = None
+                return watermark
+            # Обновление watermark + 1 ещё не приходило, а следующие уже обработаны.
+            now = time.monotonic()
+            if self._gap is None or self._gap[0] != watermark + 1:
+                self._gap = (watermark + 1, now)
+            if now - self._gap[1] < self.gap_timeout:
+                return watermark
+            watermark = min(self._done | {i for i in self._in_flight if i > watermark}) - 1
+
+    def save(self):
+        """Записывает отметку в базу (одна строка, без fsync основного файла в режиме WAL)."""
+        if self.watermark == self._saved:
+            return
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO update_watermark (id, update_id, updated_at) VALUES (0, ?, ?)",
+                    (self.watermark, self._watermark_at)
+                )
+        except Exception as e:
+            logger.error(f"Ошибка сохранения отметки обновлений в {self.path}: {e}")
+            return
+        self._saved = self.watermark
+        self._saved_at = time.monotonic()
+
+
+class FileDeduplicator:
+    """
+    Помнит недавно пересланные вложения по (user_id, file_unique_id): тот же файл от того же
+    пользователя в течение ttl секунд повторно не скачивается и не пересылается оператору.
+    remember() вызывается после успешной пересылки, чтобы неудачную попытку можно было повторить.
+    """
+
+    def __init__(self, capacity: int = 5000, ttl: float = 3600):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._seen = OrderedDict()  # (user_id, file_unique_id) -> время
+        self.duplicates_total = 0
+
+    def seen(self, user_id: int, file_unique_id: str) -> bool:
+        seen_at = self._seen.get((user_id, file_unique_id))
+        if seen_at is not None and time.monotonic() - seen_at < self.ttl:
+            self.duplicates_total += 1
+            return True
+        return False
+
+    def remember(self, user_id: int, file_unique_id: str):
+        key = (user_id, file_unique_id)
+        self._seen[key] = time.monotonic()
+        self._seen.move_to_end(key)
+        if len(self._seen) > self.capacity:
+            self._seen.popitem(last=False)
@@ -0,0 +1,217 @@
+import asyncio
+import html
+import logging
+import time
+
+from telegram.error import BadRequest
+
+from ordering import defer_update_done
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096  # максимальная длина текста сообщения Telegram
+
+
+class _Thread:
+    """Пост оператору по одному пользователю: что уже в посте и что ждёт отправки."""
+
+    __slots__ = ("context", "ticket_id", "header", "reply_markup", "lines", "pending",
+                 "message_id", "posted_at", "deadline", "task", "sending")
+
+    def __init__(self, context):
+        self.context = context
+        self.ticket_id = None
+        self.header = ""
+        self.reply_markup = None
+        self.lines = []        # строки, которые уже есть в посте message_id
+        self.pending = []      # строки, которые ещё не отправлены
+        self.message_id = None
+        self.posted_at = 0.0
+        self.deadline = 0.0
+        self.task = None
+        self.sending = False
+
+
+class OperatorInbox:
+    """
+    Режим склейки: подряд идущие сообщения пользователя за window секунд уходят оператору
+    одним постом. Если пост отправлен не раньше edit_window секунд назад, следующие сообщения
+    дописываются в него редактированием, а не новым постом, — кнопка "Ответить" остаётся одна.
+
+    Вместо N вызовов sendMessage за серию коротких сообщений — один sendMessage
+    и по одному editMessageText на каждую следующую серию.
+    """
+
+    def __init__(self, window: float, edit_window: float = 120.0, max_length: int = MESSAGE_LIMIT):
+        self.window = window
+        self.edit_window = edit_window
+        self.max_length = max_length
+        self._threads = {}  # (operator_id, user_id) -> _Thread
+        self.messages_total = 0
+        self.posts_total = 0
+        self.edits_total = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def _render(self, thread: _Thread, lines) -> str:
+        return thread.header + "\n\n<b>Сообщения:</b>\n" + "\n".join(lines)
+
+    def _prune(self):
+        """Забывает посты, которые уже нельзя дописывать, чтобы словарь не рос бесконечно."""
+        horizon = time.monotonic() - self.edit_window
+        for key in [k for k, t in self._threads.items() if t.task is None and t.posted_at < horizon]:
+            del self._threads[key]
+
+    def add(self, context, operator_id: int, user_id: int, ticket_id: int, header: str, text: str,
+            reply_markup=None):
+        """Добавляет сообщение пользователя в пост оператору; отправка — через window секунд тишины."""
+        key = (operator_id, user_id)
+        thread = self._threads.get(key)
+        if thread is None:
+            self._prune()
+            thread = self._threads[key] = _Thread(context)
+        if thread.ticket_id != ticket_id:
+            thread.message_id = None  # новое обращение — новый пост
+        thread.ticket_id = ticket_id
+        thread.header = header
+        thread.reply_markup = reply_markup
+        room = self.max_length - len(self._render(thread, [])) - 8
+        line = "• " + html.escape(text)
+        thread.pending.append(line if len(line) <= room else line[:room] + "…")
+        self.messages_total += 1
+        loop = asyncio.get_running_loop()
+        thread.deadline = loop.time() + self.window
+        if thread.task is None:
+            thread.task = context.application.create_task(self._wait_and_flush(key, thread))
+        else:
+            defer_update_done(thread.task)  # сообщение уйдёт оператору из уже запущенной задачи
+
+    async def _wait_and_flush(self, key, thread: _Thread):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                delay = thread.deadline - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                if not thread.pending:
+                    break
+                # Пока идёт отправка, пользователь может дописать ещё — тогда цикл подождёт ещё window.
+                thread.sending = True
+                try:
+                    await self._flush(key, thread)
+                except Exception as e:
+                    logger.error(f"Ошибка отправки склеенных сообщений оператору {key[0]}: {e}")
+                finally:
+                    thread.sending = False
+        finally:
+            if thread.task is asyncio.current_task():
+                thread.task = None
+
+    async def _flush(self, key, thread: _Thread):
+        operator_id = key[0]
+        lines, thread.pending = thread.pending, []
+        if not lines:
+            return
+        bot = thread.context.bot
+        if thread.message_id and time.monotonic() - thread.posted_at < self.edit_window:
+            text = self._render(thread, thread.lines + lines)
+            if len(text) <= self.max_length:
+                try:
+                    await bot.edit_message_text(
+                        chat_id=operator_id,
+                        message_id=thread.message_id,
+                        text=text,
+                        parse_mode="HTML",
+                        reply_markup=thread.reply_markup
+                    )
+                    thread.lines += lines
+                    self.edits_total += 1
+                    return
+                except BadRequest as e:
+                    logger.warning(f"Не удалось дописать пост оператору {operator_id}, отправляем новый: {e}")
+        # Новый пост; если строки не помещаются в одно сообщение — несколько постов.
+        batch = []
+        for line in lines + [None]:
+            if line is not None and len(self._render(thread, batch + [line])) <= self.max_length:
+                batch.append(line)
+                continue
+            message = await bot.send_message(
+                chat_id=operator_id,
+                text=self._render(thread, batch),
+                parse_mode="HTML",
+                reply_markup=thread.reply_markup
+            )
+            self.posts_total += 1
+            thread.lines, thread.message_id, thread.posted_at = batch, message.message_id, time.monotonic()
+            batch = [line]
+
+    async def flush_user(self, operator_id: int, user_id: int):
+        """
+        Отправляет накопленное сразу и «закрывает» пост: следующее сообщение придёт новым постом.
+        Вызывается перед пересылкой вложения, чтобы порядок сообщений у оператора не нарушался.
+        """
+        key = (operator_id, user_id)
+        thread = self._threads.get(key)
+        if thread is None:
+            return
+        task = thread.task
+        thread.deadline = 0
+        if task is not None and thread.sending:
+            await task
+        elif task is not None:
+            task.cancel()
+            thread.task = None
+            try:
+                await self._flush(key, thread)
+            except Exception as e:
+                logger.error(f"Ошибка отправки склеенных сообщений оператору {operator_id}: {e}")
+        thread.message_id = None
+
+    def close_post(self, operator_id: int, user_id: int):
+        """Пост пользователя больше не дописывается: оператор заменил его ответом, следующее — новым постом."""
+        thread = self._threads.get((operator_id, user_id))
+        if thread is not None:
+            thread.message_id = None
+
+    async def flush_all(self):
+        """Отправляет всё накопленное (при остановке бота)."""
+        for operator_id, user_id in list(self._threads):
+            await self.flush_user(operator_id, user_id)
+        self._threads.clear()
+
+    def pending(self) -> int:
+        """Сколько постов ждут отправки."""
+        return sum(1 for thread in self._threads.values() if thread.task is not None)
+
+
+class PeriodicDigest:
+    """Раз в interval секунд вызывает send(bot) — сводку открытых обращений для операторов."""
+
+    def __init__(self, interval: float, send):
+        self.interval = interval
+        self.send = send
+        self._task = None
+
+    async def _run(self, bot):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.send(bot)
+            except Exception as e:
+                logger.error(f"Ошибка отправки сводки обращений: {e}")
+
+    def start(self, bot):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from telegram import User
+from telegram.error import InvalidToken
+from telegram.ext import ExtBot
+
+from persistence import open_db
+
+logger = logging.getLogger(__name__)
+
+_IMPORTED = time.monotonic()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bot_profile (
+    token_hash TEXT PRIMARY KEY,
+    data       TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def process_age() -> float:
+    """Сколько секунд назад запущен процесс: по /proc/self/stat, вне Linux — с импорта этого модуля."""
+    try:
+        with open("/proc/self/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")  # поле 22 — starttime в тиках с загрузки
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - started
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.monotonic() - _IMPORTED
+
+
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class Lifecycle:
+    """
+    Запуск бота после сна free-инстанса Render.
+
+    - Фазы запуска (импорты, initialize, запуск, первое обработанное обновление) замеряются
+      от старта процесса и попадают в лог и метрику bot_startup_seconds.
+    - Профиль бота (getMe) хранится в SQLite: initialize при холодном старте не ждёт сеть.
+    - prewarm() уже после запуска открывает prewarm_connections соединений к Bot API теми же getMe:
+      токен проверяется, профиль обновляется, а первый ответ пользователю не ждёт TCP и TLS.
+    - Фоновые задачи запуска (start_background) не блокируют post_init; stop_background при остановке
+      отменяет недоделанные и дожидается их.
+    """
+
+    def __init__(self, path: str, prewarm_connections: int = 2):
+        self.path = path
+        self.prewarm_connections = prewarm_connections
+        self.phases = {}  # фаза -> секунд со старта процесса
+        self._conn = open_db(path)
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._tasks = set()
+
+    def mark(self, phase: str):
+        """Запоминает момент фазы запуска (только первый раз)."""
+        if phase in self.phases:
+            return
+        self.phases[phase] = round(process_age(), 3)
+        logger.info(f"Запуск: {phase} через {self.phases[phase]:.3f} с после старта процесса")
+
+    def first_update(self):
+        self.mark("first_update")
+
+    # ---------------------------------------------
+    # PROFILE CACHE
+    # ---------------------------------------------
+    def load_profile(self, token: str):
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT data FROM bot_profile WHERE token_hash = ?", (_token_hash(token),)
+                ).fetchone()
+        except Exception as e:
+            logger.error(f"Ошибка чтения профиля бота из {self.path}: {e}")
+            return None
+        return json.loads(row[0]) if row else None
+
+    def save_profile(self, token: str, data: dict):
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO bot_profile (token_hash, data, updated_at) VALUES (?, ?, ?)",
+                    (_token_hash(token), json.dumps(data, ensure_ascii=False), time.time())
+                )
+        except Exception as e:
+            logger.error(f"Ошибка сохранения профиля бота в {self.path}: {e}")
+
+    # ---------------------------------------------
+    # BACKGROUND TASKS
+    # ---------------------------------------------
+    def start_background(self, *coroutines):
+        """
+        Запускает задачи через asyncio.create_task: в post_init Application ещё не запущен,
+        и его create_task только предупреждает. Ошибки задач пишутся в лог.
+        """
+        for coroutine in coroutines:
+            task = asyncio.create_task(coroutine)
+            self._tasks.add(task)
+            task.add_done_callback(self._background_done)
+
+    def _background_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Ошибка фоновой задачи запуска: {task.exception()!r}")
+
+    async def stop_background(self):
+        """Отменяет недоделанные фоновые задачи запуска и дожидается их завершения."""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # ---------------------------------------------
+    # PREWARM
+    # ---------------------------------------------
+    async def prewarm(self, bot):
+        """Параллельные getMe: каждый занимает своё соединение пула, и оно остаётся открытым."""
+        started = time.monotonic()
+        results = await asyncio.gather(
+            *(bot.get_me() for _ in range(max(1, self.prewarm_connections))), return_exceptions=True
+        )
+        errors = [r for r in results if isinstance(r, Exception)]
+        for error in errors:
+            if isinstance(error, InvalidToken):
+                logger.error(f"Telegram отклонил токен бота: {error}")
+                return
+        if len(errors) == len(results):
+            logger.error(f"Не удалось прогреть соединения с Bot API: {errors[0]}")
+            return
+        logger.info(f"Соединения с Bot API прогреты за {time.monotonic() - started:.3f} с")
+        self.mark("prewarmed")
+
+
+class FastStartBot(ExtBot):
+    """
+    ExtBot, который при initialize берёт профиль из кэша Lifecycle вместо запроса getMe.
+    Любой следующий get_me() идёт в сеть и обновляет кэш; при первом запуске кэша нет — обычный getMe.
+    """
+
+    __slots__ = ("_lifecycle",)
+
+    def __init__(self, *args, lifecycle: Lifecycle = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lifecycle = lifecycle
+
+    async def get_me(self, *args, **kwargs) -> User:
+        if self._bot_user is None and self._lifecycle is not None:
+            data = self._lifecycle.load_profile(self.token)
+            if data:
+                self._bot_user = User.de_json(data, self)
+                return self._bot_user
+        user = await super().get_me(*args, **kwargs)
+        if self._lifecycle is not None:
+            self._lifecycle.save_profile(self.token, user.to_dict())
+        return user
@@ -0,0 +1,180 @@
+import functools
+import logging
+import time
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограмм задержек, секунды.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    """Монотонный счётчик с метками. inc() — одна операция со словарём."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}  # значения меток -> число
+
+    def inc(self, *labelvalues, amount: float = 1):
+        self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        for labelvalues, value in self.values.items():
+            yield self.name, _labels(self.labelnames, labelvalues), value
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами: observe() — bisect и два сложения."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}  # значения меток -> [счётчики по корзинам..., +Inf], сумма
+
+    def observe(self, value: float, *labelvalues):
+        entry = self.values.get(labelvalues)
+        if entry is None:
+            entry = self.values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def samples(self):
+        names = self.labelnames + ("le",)
+        for labelvalues, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", _labels(names, labelvalues + (bound,)), cumulative
+            yield f"{self.name}_sum", _labels(self.labelnames, labelvalues), total
+            yield f"{self.name}_count", _labels(self.labelnames, labelvalues), cumulative
+
+
+class Computed:
+    """
+    Значение, которое вычисляется только при запросе /metrics: fn() возвращает число
+    или словарь {значения меток: число}. На горячем пути ничего не стоит.
+    kind="counter" — для монотонных счётчиков, которые ведёт сам объект (спул, ограничитель запросов).
+    """
+
+    def __init__(self, name: str, help_text: str, fn, labelnames=(), kind: str = "gauge"):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+
+    def samples(self):
+        value = self.fn()
+        if not isinstance(value, dict):
+            value = {(): value}
+        for labelvalues, v in value.items():
+            if not isinstance(labelvalues, tuple):
+                labelvalues = (labelvalues,)
+            yield self.name, _labels(self.labelnames, labelvalues), v
+
+
+class Registry:
+    """
+    Набор метрик бота в текстовом формате Prometheus.
+
+    Запись — обычные операции со словарями в том же потоке событий, без блокировок и фоновых задач;
+    всё, что можно посчитать по запросу (очереди, открытые диалоги, статистика спула), — Computed.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self._runner = None
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames=()):
+        return self._add(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def computed(self, name: str, help_text: str, fn, labelnames=(), kind: str = "gauge"):
+        return self._add(Computed(name, help_text, fn, labelnames, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.error(f"Ошибка вычисления метрики {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {value}" for name, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+    # ---------------------------------------------
+    # HTTP
+    # ---------------------------------------------
+    # aiohttp импортируется только здесь: в polling-режиме без сервера метрик он не нужен,
+    # а его импорт — заметная часть холодного старта.
+    async def handle(self, request):
+        from aiohttp import web
+        return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+    async def start_server(self, port: int, host: str = "0.0.0.0"):
+        """Отдельный HTTP-сервер с /metrics в том же цикле событий (для polling-режима)."""
+        if self._runner is not None:
+            return
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Метрики доступны на :{port}/metrics")
+
+    async def stop_server(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def instrument(calls: Counter, latency: Histogram, errors: Counter):
+    """
+    Декоратор обработчика: число вызовов, время выполнения и ошибки по типу исключения.
+    Метка handler — имя функции.
+    """
+    def decorator(handler):
+        name = handler.__name__
+
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            calls.inc(name)
+            started = time.perf_counter()
+            try:
+                return await handler(*args, **kwargs)
+            except Exception as e:
+                errors.inc(name, type(e).__name__)
+                raise
+            finally:
+                latency.observe(time.perf_counter() - started, name)
+        return wrapper
+    return decorator
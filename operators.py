@@ -0,0 +1,115 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+LEAST_OPEN = "least_open"    # оператору с наименьшим числом незакрытых обращений
+ROUND_ROBIN = "round_robin"  # по кругу
+STICKY = "sticky"            # тому, кто вёл прошлые обращения пользователя (иначе least_open)
+STRATEGIES = (LEAST_OPEN, ROUND_ROBIN, STICKY)
+
+
+def parse_operator_ids(value: str, default: int):
+    """Список ID операторов из строки вида "111,222"; пустая строка — только default."""
+    ids = [int(part) for part in value.replace(" ", "").split(",") if part]
+    return ids or [default]
+
+
+class OperatorPool:
+    """
+    Пул операторов: решает, в какой чат отправить обращение.
+
+    Исполнитель хранится в самом обращении (TicketStore), поэтому все сообщения одного обращения
+    попадают к одному оператору. Если оператор не ответил за sla секунд, обращение
+    переназначается другому и вызывается on_reassign(bot, ticket, new_operator_id).
+    """
+
+    def __init__(self, operator_ids, strategy: str, tickets, sla: float = 0, on_reassign=None):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Неизвестная стратегия распределения: {strategy}")
+        self.operator_ids = list(operator_ids)
+        self.strategy = strategy
+        self.tickets = tickets
+        self.sla = sla
+        self.on_reassign = on_reassign
+        self._next = 0
+        self._watch_task = None
+        self.reassigned_total = 0
+
+    def is_operator(self, chat_id: int) -> bool:
+        return chat_id in self.operator_ids
+
+    def _least_open(self, exclude=None) -> int:
+        counts = self.tickets.active_counts()
+        candidates = [op for op in self.operator_ids if op != exclude] or self.operator_ids
+        return min(candidates, key=lambda op: counts.get(op, 0))
+
+    def _round_robin(self, exclude=None) -> int:
+        for _ in range(len(self.operator_ids)):
+            operator_id = self.operator_ids[self._next % len(self.operator_ids)]
+            self._next += 1
+            if operator_id != exclude:
+                return operator_id
+        return self.operator_ids[0]
+
+    def pick(self, user_id: int, exclude=None) -> int:
+        """Выбирает оператора для нового обращения по стратегии пула."""
+        if len(self.operator_ids) == 1:
+            return self.operator_ids[0]
+        if self.strategy == ROUND_ROBIN:
+            return self._round_robin(exclude)
+        if self.strategy == STICKY:
+            previous = self.tickets.last_assignee(user_id)
+            if previous in self.operator_ids and previous != exclude:
+                return previous
+        return self._least_open(exclude)
+
+    def route(self, ticket_id: int, user_id: int) -> int:
+        """Чат оператора для сообщения по обращению; назначает исполнителя, если его ещё нет."""
+        operator_id = self.tickets.assignee(ticket_id)
+        if operator_id in self.operator_ids:
+            return operator_id
+        operator_id = self.pick(user_id)
+        self.tickets.assign(ticket_id, operator_id)
+        return operator_id
+
+    # ---------------------------------------------
+    # SLA
+    # ---------------------------------------------
+    async def check_sla(self, bot):
+        """Переназначает обращения, оставшиеся без ответа дольше sla секунд."""
+        for ticket in self.tickets.overdue(self.sla):
+            ticket_id, user_id, _, assignee, _ = ticket
+            new_operator = self.pick(user_id, exclude=assignee)
+            self.tickets.assign(ticket_id, new_operator)
+            if new_operator == assignee:
+                continue  # переназначать некому, просто продлеваем срок
+            self.reassigned_total += 1
+            logger.info(f"Обращение #{ticket_id} переназначено: {assignee} -> {new_operator}")
+            if self.on_reassign:
+                try:
+                    await self.on_reassign(bot, ticket, new_operator)
+                except Exception as e:
+                    logger.error(f"Ошибка уведомления о переназначении #{ticket_id}: {e}")
+
+    async def _watch(self, bot):
+        interval = max(10.0, min(60.0, self.sla / 4))
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.check_sla(bot)
+            except Exception as e:
+                logger.error(f"Ошибка проверки SLA операторов: {e}")
+
+    def start(self, bot):
+        if self.sla > 0 and len(self.operator_ids) > 1 and self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch(bot))
+
+    async def stop(self):
+        if self._watch_task:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
@@ -0,0 +1,281 @@
+import asyncio
+import contextvars
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import partial
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(update: object):
+    """Ключ очереди для обновления: ID чата, иначе ID пользователя, иначе None."""
+    if isinstance(update, Update):
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return update.effective_user.id
+    return None
+
+
+class _UpdateSlot:
+    """Слот max_concurrency, занятый задачей, которая обрабатывает обновление."""
+
+    __slots__ = ("semaphore", "task", "held")
+
+    def __init__(self, semaphore: asyncio.BoundedSemaphore):
+        self.semaphore = semaphore
+        self.task = asyncio.current_task()
+        self.held = False
+
+    async def acquire(self):
+        await self.semaphore.acquire()
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.semaphore.release()
+
+
+_SLOT = contextvars.ContextVar("update_slot", default=None)
+
+
+@asynccontextmanager
+async def released_update_slot():
+    """
+    Отпускает слот обработки обновления на время долгого ожидания (например, лимита чата оператора)
+    и занимает его снова после: пока обработчик ждёт, другие чаты обрабатываются.
+    Вне обработки обновления (фоновые задачи, альбомы) ничего не делает.
+    """
+    slot = _SLOT.get()
+    if slot is None or not slot.held or slot.task is not asyncio.current_task():
+        yield
+        return
+    slot.release()
+    try:
+        yield
+    finally:
+        await slot.acquire()
+
+
+class _PendingUpdate:
+    """
+    Обновление, которое ещё нельзя отметить обработанным в dedupe: не завершился обработчик
+    или фоновые задачи, запущенные им. Отменённая задача (остановка бота) отметку не ставит —
+    после перезапуска обновление будет обработано заново.
+    """
+
+    __slots__ = ("dedupe", "update_id", "waiting", "cancelled")
+
+    def __init__(self, dedupe, update_id: int):
+        self.dedupe = dedupe
+        self.update_id = update_id
+        self.waiting = 1  # сам обработчик
+        self.cancelled = False
+
+    def hold(self):
+        self.waiting += 1
+
+    def release(self, task: asyncio.Task = None):
+        if task is not None and task.cancelled():
+            self.cancelled = True
+        self.waiting -= 1
+        if self.waiting == 0 and not self.cancelled:
+            self.dedupe.done(self.update_id)
+
+
+_PENDING = contextvars.ContextVar("pending_update", default=None)
+
+
+def defer_update_done(task: asyncio.Task):
+    """
+    Не отмечает текущее обновление обработанным, пока не завершится task.
+    Задачи application.create_task, запущенные при обработке, учитываются сами; вызывать нужно,
+    когда обновление отдаёт свои данные уже запущенной задаче (альбом, склейка сообщений).
+    Вне обработки обновления ничего не делает.
+    """
+    pending = _PENDING.get()
+    if pending is not None:
+        pending.hold()
+        task.add_done_callback(pending.release)
+
+
+class ChatOrderedApplication(Application):
+    """
+    Application, который обрабатывает обновления разных чатов параллельно,
+    а обновления одного чата — строго по очереди.
+
+    Сам Application остаётся последовательным (concurrent_updates не задаётся): process_update
+    только ставит обновление в очередь его чата и сразу возвращается. Очередь чата разбирает
+    отдельная задача, поэтому состояния ConversationHandler внутри одного чата не перемешиваются.
+    Одновременно обрабатывается не больше max_concurrency обновлений; обработчик, который ждёт
+    внутри released_update_slot(), слот на это время отдаёт.
+
+    dedupe (dedupe.UpdateDeduplicator) — повторно доставленные обновления отбрасываются
+    ещё до постановки в очередь. Обработанным обновление считается, когда завершились и обработчик,
+    и задачи create_task, запущенные при его обработке (пересылки оператору, альбомы).
+
+    При остановке stop() сначала до drain_timeout секунд ждёт, пока обработаются уже полученные
+    обновления и фоновые задачи (альбомы, склейка, пересылки); что не успело — отменяется, а файлы
+    спула удаляются в их finally. on_first_update() вызывается один раз после первого обновления.
+    """
+
+    def __init__(self, max_concurrency: int, dedupe=None, drain_timeout: float = 20.0,
+                 on_first_update=None, **kwargs):
+        super().__init__(**kwargs)
+        self.max_concurrency = max_concurrency
+        self.dedupe = dedupe
+        self.drain_timeout = drain_timeout
+        self.on_first_update = on_first_update
+        self._update_semaphore = asyncio.BoundedSemaphore(max_concurrency)
+        self._chat_queues = {}  # ключ чата -> deque обновлений, ожидающих обработки
+        self._tasks = set()     # задачи create_task, которые ещё выполняются
+        self._accepting = True
+
+    async def process_update(self, update: object) -> None:
+        if not self._accepting:
+            logger.warning(f"Бот останавливается, обновление {getattr(update, 'update_id', '')} не обработано")
+            return
+        if self.dedupe is not None and isinstance(update, Update) and self.dedupe.seen(update.update_id):
+            logger.info(f"Повторное обновление {update.update_id} пропущено")
+            return
+        key = chat_key(update)
+        if key is None:
+            self.create_task(self._process_one(update), update=update)
+            return
+        queue = self._chat_queues.get(key)
+        if queue is not None:
+            queue.append(update)
+            return
+        queue = self._chat_queues[key] = deque([update])
+        self.create_task(self._drain_chat(key, queue), update=update)
+
+    async def _process_one(self, update: object) -> None:
+        slot = _UpdateSlot(self._update_semaphore)
+        token = _SLOT.set(slot)
+        pending = None
+        if self.dedupe is not None and isinstance(update, Update):
+            pending = _PendingUpdate(self.dedupe, update.update_id)
+        pending_token = _PENDING.set(pending)
+        try:
+            await slot.acquire()
+            await super().process_update(update)
+        except asyncio.CancelledError:
+            if pending is not None:
+                pending.cancelled = True
+            raise
+        finally:
+            slot.release()
+            _SLOT.reset(token)
+            _PENDING.reset(pending_token)
+            if pending is not None:
+                pending.release()
+            if self.on_first_update is not None:
+                callback, self.on_first_update = self.on_first_update, None
+                callback()
+
+    async def _drain_chat(self, key, queue: deque) -> None:
+        """Обрабатывает обновления одного чата по порядку, пока очередь не опустеет."""
+        try:
+            while queue:
+                update = queue[0]
+                try:
+                    await self._process_one(update)
+                except Exception as e:
+                    logger.error(f"Ошибка обработки обновления чата {key}: {e}")
+                queue.popleft()
+        finally:
+            del self._chat_queues[key]
+
+    def create_task(self, coroutine, update: object = None):
+        task = super().create_task(coroutine, update=update)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        defer_update_done(task)
+        return task
+
+    async def drain(self, timeout: float) -> int:
+        """
+        Ждёт обработки очереди обновлений и завершения задач не дольше timeout секунд.
+        Оставшиеся задачи отменяет; возвращает их число.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._tasks or not self.update_queue.empty():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            if self._tasks:
+                await asyncio.wait(set(self._tasks), timeout=remaining)
+            else:
+                await asyncio.sleep(0.01)  # обновление ещё не забрали из update_queue
+        self._accepting = False
+        leftover = list(self._tasks)
+        for task in leftover:
+            task.cancel()
+        if leftover:
+            await asyncio.gather(*leftover, return_exceptions=True)
+            logger.warning(f"Остановка: {len(leftover)} задач не завершились за {timeout} с и отменены")
+        return len(leftover)
+
+    async def stop(self) -> None:
+        if self.running:
+            await self.drain(self.drain_timeout)
+        await super().stop()
+        self._accepting = True
+
+    def tasks_in_flight(self) -> int:
+        """Сколько задач (обработка обновлений, альбомы, склейка) сейчас выполняется."""
+        return len(self._tasks)
+
+    def pending_updates(self) -> int:
+        """Сколько обновлений ждёт или проходит обработку во всех очередях чатов."""
+        return sum(len(queue) for queue in self._chat_queues.values())
+
+
+class SerialTasks:
+    """
+    Фоновые задачи, которые для одного ключа выполняются строго по очереди, а для разных — параллельно.
+
+    Обработчик ставит отправку оператору в очередь пользователя и сразу освобождается: следующие
+    нажатия этого пользователя не ждут лимита чата оператора. Задачи создаются через
+    application.create_task, поэтому остановка бота (ChatOrderedApplication.drain) их дожидается.
+    Исключение задачи логируется и не мешает следующим.
+    """
+
+    def __init__(self):
+        self._tails = {}  # ключ -> последняя поставленная задача
+        self._pending = 0
+
+    def submit(self, application, key, coroutine):
+        previous = self._tails.get(key)
+        self._pending += 1
+        task = application.create_task(self._run(key, previous, coroutine))
+        self._tails[key] = task
+        task.add_done_callback(partial(self._done, key))
+        return task
+
+    async def _run(self, key, previous, coroutine):
+        try:
+            if previous is not None:
+                await asyncio.wait({previous})
+            await coroutine
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка фоновой отправки для {key}: {e}")
+        finally:
+            coroutine.close()  # если задачу отменили до запуска — без предупреждения "never awaited"
+
+    def _done(self, key, task):
+        self._pending -= 1
+        if self._tails.get(key) is task:
+            del self._tails[key]
+
+    def pending(self) -> int:
+        """Сколько задач ещё не выполнено."""
+        return self._pending
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    name  TEXT NOT NULL,
+    key   TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (name, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data    TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chat_data (
+    chat_id INTEGER PRIMARY KEY,
+    data    TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bot_data (
+    id   INTEGER PRIMARY KEY CHECK (id = 0),
+    data TEXT NOT NULL
+);
+"""
+
+
+def open_db(path: str) -> sqlite3.Connection:
+    """Открывает SQLite в режиме WAL: чтение не блокирует запись, коммит не ждёт fsync основного файла."""
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Хранение состояний ConversationHandler и user_data/chat_data/bot_data в SQLite (WAL).
+
+    Всё состояние держится в памяти: при старте таблицы читаются целиком одним запросом каждая,
+    дальше get_* отдают данные из кэша. update_* только помечают записи «грязными», а запись
+    на диск идёт пачкой — одной транзакцией в отдельном потоке. Application вызывает update_*
+    раз в update_interval секунд, так что обработка обновлений диска не касается вовсе.
+    Данные сериализуются в JSON, поэтому в user_data стоит класть только простые значения.
+    """
+
+    def __init__(self, path: str, update_interval: float = 10, store_data: PersistenceInput = None):
+        super().__init__(
+            store_data=store_data or PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self._conversations = {}  # name -> {key (tuple): state}
+        self._user_data = {}
+        self._chat_data = {}
+        self._bot_data = {}
+        # Отложенные изменения: таблица -> {ключ: JSON или None (удалить)}
+        self._dirty = {"conversations": {}, "user_data": {}, "chat_data": {}, "bot_data": {}}
+        self._write_task = None
+        self._write_lock = asyncio.Lock()  # записи идут по очереди, flush дожидается текущей
+        self._load()
+
+    # ---------------------------------------------
+    # LOAD / WRITE
+    # ---------------------------------------------
+    def _load(self):
+        self._conn = open_db(self.path)
+        self._conn.executescript(SCHEMA)
+        for name, key, state in self._conn.execute("SELECT name, key, state FROM conversations"):
+            self._conversations.setdefault(name, {})[tuple(json.loads(key))] = json.loads(state)
+        for user_id, data in self._conn.execute("SELECT user_id, data FROM user_data"):
+            self._user_data[user_id] = json.loads(data)
+        for chat_id, data in self._conn.execute("SELECT chat_id, data FROM chat_data"):
+            self._chat_data[chat_id] = json.loads(data)
+        row = self._conn.execute("SELECT data FROM bot_data WHERE id = 0").fetchone()
+        if row:
+            self._bot_data = json.loads(row[0])
+        logger.info(
+            f"Состояние восстановлено из {self.path}: "
+            f"{sum(len(c) for c in self._conversations.values())} диалогов, "
+            f"{len(self._user_data)} пользователей."
+        )
+
+    def _mark(self, table: str, key, value):
+        self._dirty[table][key] = None if value is None else json.dumps(value, ensure_ascii=False)
+        if self._write_task is None:
+            # Все update_* одного цикла Application.update_persistence попадут в одну транзакцию.
+            self._write_task = asyncio.get_running_loop().create_task(self._write_soon())
+
+    async def _write_soon(self):
+        await asyncio.sleep(0)
+        self._write_task = None
+        await self._write_dirty()
+
+    async def _write_dirty(self):
+        dirty = self._dirty
+        if not any(dirty.values()):
+            return
+        self._dirty = {"conversations": {}, "user_data": {}, "chat_data": {}, "bot_data": {}}
+        try:
+            async with self._write_lock:
+                await asyncio.to_thread(self._write, dirty)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи состояния в {self.path}: {e}")
+            # Не теряем изменения: вернём их в очередь, если их не перезаписали более новые.
+            for table, rows in dirty.items():
+                for key, value in rows.items():
+                    self._dirty[table].setdefault(key, value)
+
+    def _write(self, dirty: dict):
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN")
+            try:
+                for (name, key), state in dirty["conversations"].items():
+                    if state is None:
+                        conn.execute("DELETE FROM conversations WHERE name = ? AND key = ?", (name, key))
+                    else:
+                        conn.execute(
+                            "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                            (name, key, state)
+                        )
+                for table, column in (("user_data", "user_id"), ("chat_data", "chat_id"), ("bot_data", "id")):
+                    for key, data in dirty[table].items():
+                        if data is None:
+                            conn.execute(f"DELETE FROM {table} WHERE {column} = ?", (key,))
+                        else:
+                            conn.execute(
+                                f"INSERT OR REPLACE INTO {table} ({column}, data) VALUES (?, ?)", (key, data)
+                            )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    # ---------------------------------------------
+    # BasePersistence
+    # ---------------------------------------------
+    async def get_user_data(self):
+        return {user_id: dict(data) for user_id, data in self._user_data.items()}
+
+    async def get_chat_data(self):
+        return {chat_id: dict(data) for chat_id, data in self._chat_data.items()}
+
+    async def get_bot_data(self):
+        return dict(self._bot_data)
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str):
+        return dict(self._conversations.get(name, {}))
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        conversations = self._conversations.setdefault(name, {})
+        if new_state is None:
+            if conversations.pop(key, None) is None:
+                return
+        elif conversations.get(key) == new_state:
+            return
+        else:
+            conversations[key] = new_state
+        self._mark("conversations", (name, json.dumps(list(key))), new_state)
+
+    async def update_user_data(self, user_id: int, data) -> None:
+        if self._user_data.get(user_id) == data:
+            return
+        self._user_data[user_id] = dict(data)
+        self._mark("user_data", user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data) -> None:
+        if self._chat_data.get(chat_id) == data:
+            return
+        self._chat_data[chat_id] = dict(data)
+        self._mark("chat_data", chat_id, data)
+
+    async def update_bot_data(self, data) -> None:
+        if self._bot_data == data:
+            return
+        self._bot_data = dict(data)
+        self._mark("bot_data", 0, data)
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        if self._chat_data.pop(chat_id, None) is not None:
+            self._mark("chat_data", chat_id, None)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        if self._user_data.pop(user_id, None) is not None:
+            self._mark("user_data", user_id, None)
+
+    async def refresh_user_data(self, user_id: int, user_data) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """Вызывается Application при остановке: дописывает всё накопленное и закрывает базу."""
+        await self._write_dirty()
+        async with self._write_lock:
+            with self._lock:
+                self._conn.close()
+
+    def open_conversations(self) -> dict:
+        """Число открытых диалогов по состояниям: {(name, state): count}."""
+        counts = {}
+        for name, conversations in self._conversations.items():
+            for state in conversations.values():
+                counts[(name, state)] = counts.get((name, state), 0) + 1
+        return counts
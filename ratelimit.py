@@ -0,0 +1,267 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import time
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты запросов (меньше — раньше). Передаются через rate_limit_args=..., например
+# context.bot.send_message(..., rate_limit_args=PRIORITY_LOW). 0 использовать нельзя:
+# ExtBot отбрасывает «ложные» rate_limit_args.
+PRIORITY_HIGH = 1    # нажатия кнопок: answerCallbackQuery, редактирование и удаление сообщений
+PRIORITY_NORMAL = 2  # обычные сообщения
+PRIORITY_LOW = 3     # тяжёлые и фоновые отправки (альбомы, сводки)
+
+HIGH_PRIORITY_ENDPOINTS = frozenset({
+    "answerCallbackQuery", "editMessageText", "editMessageCaption",
+    "editMessageMedia", "editMessageReplyMarkup", "deleteMessage",
+})
+LOW_PRIORITY_ENDPOINTS = frozenset({"sendMediaGroup"})
+# Ответы на нажатия, редактирование и удаление не новые сообщения: лимит чата (1 сообщение/с) на них
+# не тратится, действует только общий лимит бота.
+CHAT_FREE_ENDPOINTS = HIGH_PRIORITY_ENDPOINTS
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity в запасе."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0  # выставляется по RetryAfter
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен (0 — уже доступен)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.paused_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class PriorityRateLimiter(BaseRateLimiter):
+    """
+    Ограничитель исходящих запросов к Bot API для ExtBot.
+
+    - Отдельный token bucket на каждый чат и один общий. Чат может отправить chat_burst сообщений
+      подряд, дальше — chat_rate в секунду; очередь в чат упорядочена по приоритету, внутри
+      приоритета — по времени: ответ оператору на его нажатие обгоняет накопившиеся обращения.
+    - Ожидание лимита чата идёт внутри wait_context() (ordering.released_update_slot): обработчик,
+      который ждёт очереди в чат оператора, не занимает слот обработки обновлений.
+    - Общий лимит раздаётся по приоритету: нажатия кнопок обгоняют пересылку альбомов.
+    - RetryAfter обрабатывается автоматически: чат (или весь бот) ставится на паузу, запрос повторяется.
+    - Запросы в чаты из protected_chat_ids (операторы) при сетевых ошибках повторяются
+      с нарастающей задержкой, пока бот не начнёт останавливаться, — обращения не теряются.
+    - api_latency (metrics.Histogram) получает время каждого HTTP-запроса по методу Bot API.
+    """
+
+    def __init__(
+        self,
+        protected_chat_ids=(),
+        overall_rate: float = 30,
+        chat_rate: float = 1,
+        chat_burst: float = 10,
+        group_rate: float = 20 / 60,
+        max_retries: int = 3,
+        api_latency=None,
+        wait_context=None,
+    ):
+        self.protected_chat_ids = set(protected_chat_ids)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.api_latency = api_latency
+        self.wait_context = wait_context or contextlib.nullcontext
+        self._overall = TokenBucket(overall_rate, overall_rate)
+        self._chat_buckets = {}  # chat_id -> TokenBucket
+        self._chat_waiters = {}  # chat_id -> куча (приоритет, порядковый номер) ожидающих лимита чата
+        self._chat_conditions = {}  # chat_id -> asyncio.Condition, будит ожидающих при смене первого в очереди
+        self._waiters = []       # куча (приоритет, порядковый номер, future) ожидающих общий лимит
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+        self._closing = False
+        # Метрики
+        self.queue_depth = 0      # сколько запросов сейчас ждут лимита
+        self.requests_total = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.retry_after_total = 0
+        self.network_retries_total = 0
+
+    async def initialize(self) -> None:
+        # ExtBot.initialize вызывается и из Application, и из Updater, а лимитер инициализирует каждый раз.
+        if self._dispatcher is not None:
+            return
+        self._closing = False
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self) -> None:
+        self._closing = True
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        # Кто ещё ждёт — отпускаем без лимита, чтобы никто не завис навсегда.
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    async def _dispatch(self):
+        """Раздаёт токены общего лимита ожидающим запросам в порядке приоритета."""
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self._overall.delay(time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._overall.take()
+            future.set_result(None)
+
+    async def _acquire_overall(self, priority: int):
+        if self._dispatcher is None:
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._wakeup.set()
+        await future
+
+    async def _acquire_chat(self, chat_id: int, priority: int):
+        bucket = self._chat_bucket(chat_id)
+        waiters = self._chat_waiters.setdefault(chat_id, [])
+        if not waiters and bucket.delay(time.monotonic()) <= 0:
+            bucket.take()
+            return
+        condition = self._chat_conditions.setdefault(chat_id, asyncio.Condition())
+        entry = (priority, next(self._seq))
+        async with self.wait_context(), condition:
+            heapq.heappush(waiters, entry)
+            condition.notify_all()  # новый первый в очереди — спящий прежний первый должен уступить
+            try:
+                while True:
+                    if waiters[0] is not entry:
+                        await condition.wait()
+                        continue
+                    delay = bucket.delay(time.monotonic())
+                    if delay <= 0:
+                        bucket.take()
+                        return
+                    try:
+                        await asyncio.wait_for(condition.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                waiters.remove(entry)
+                heapq.heapify(waiters)
+                condition.notify_all()
+
+    async def _acquire(self, chat_id, endpoint: str, priority: int):
+        start = time.monotonic()
+        self.queue_depth += 1
+        try:
+            if chat_id is not None and endpoint not in CHAT_FREE_ENDPOINTS:
+                await self._acquire_chat(chat_id, priority)
+            await self._acquire_overall(priority)
+        finally:
+            self.queue_depth -= 1
+        waited = time.monotonic() - start
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    @staticmethod
+    def _priority(endpoint: str, rate_limit_args) -> int:
+        if isinstance(rate_limit_args, int):
+            return rate_limit_args
+        if endpoint in HIGH_PRIORITY_ENDPOINTS:
+            return PRIORITY_HIGH
+        if endpoint in LOW_PRIORITY_ENDPOINTS:
+            return PRIORITY_LOW
+        return PRIORITY_NORMAL
+
+    async def _call(self, endpoint: str, callback, args, kwargs):
+        if self.api_latency is None:
+            return await callback(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            self.api_latency.observe(time.perf_counter() - started, endpoint)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        try:
+            chat_id = int(chat_id) if chat_id is not None else None
+        except (TypeError, ValueError):
+            chat_id = None  # @username каналов не ограничиваем по чату
+        priority = self._priority(endpoint, rate_limit_args)
+        protected = chat_id in self.protected_chat_ids
+        retries = 0
+        backoff = 1.0
+        while True:
+            await self._acquire(chat_id, endpoint, priority)
+            self.requests_total += 1
+            try:
+                return await self._call(endpoint, callback, args, kwargs)
+            except RetryAfter as e:
+                self.retry_after_total += 1
+                retry_after = float(e.retry_after) + 0.1
+                logger.warning(f"Flood limit на {endpoint} (чат {chat_id}), повтор через {retry_after:.1f} с")
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).pause(retry_after)
+                else:
+                    self._overall.pause(retry_after)
+                if retries >= self.max_retries and not protected:
+                    raise
+            except NetworkError as e:
+                # BadRequest — тоже NetworkError в PTB, но повторять его бессмысленно.
+                if not protected or self._closing or isinstance(e, BadRequest):
+                    raise
+                self.network_retries_total += 1
+                logger.warning(f"Сетевая ошибка на {endpoint} для оператора {chat_id}, повтор через {backoff:.0f} с: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+            retries += 1
+
+    def stats(self) -> dict:
+        """Счётчики для логов и метрик."""
+        return {
+            "queue_depth": self.queue_depth,
+            "requests_total": self.requests_total,
+            "wait_seconds_total": round(self.wait_seconds_total, 3),
+            "wait_seconds_max": round(self.wait_seconds_max, 3),
+            "retry_after_total": self.retry_after_total,
+            "network_retries_total": self.network_retries_total,
+        }
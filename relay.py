@@ -0,0 +1,205 @@
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+from telegram import InputFile
+from telegram._utils.files import is_local_file
+from telegram.error import BadRequest
+from telegram.ext import filters
+
+logger = logging.getLogger(__name__)
+
+# Bot API отдаёт через getFile только файлы до 20 МБ; крупнее можно переслать лишь по file_id.
+BOT_API_DOWNLOAD_LIMIT = 20 * 1024 * 1024
+
+
+# ---------------------------------------------
+# MEDIA KINDS
+# ---------------------------------------------
+@dataclass(frozen=True)
+class MediaKind:
+    """
+    Тип вложения: name совпадает с полем Message и методом send_<name>.
+    label / label_gen — название для сообщений ("отправил фото", "ошибка при отправке документа").
+    caption — принимает ли send_<name> подпись (у видеосообщений её нет).
+    """
+    name: str
+    label: str
+    label_gen: str
+    caption: bool = True
+
+    def attachment(self, message):
+        media = getattr(message, self.name)
+        return media[-1] if self.name == "photo" else media
+
+
+# Порядок важен: у GIF-сообщения заполнено и поле animation, и поле document.
+MEDIA_KINDS = (
+    MediaKind("photo", "фото", "фото"),
+    MediaKind("video", "видео", "видео"),
+    MediaKind("animation", "GIF", "GIF"),
+    MediaKind("document", "документ", "документа"),
+    MediaKind("voice", "голосовое сообщение", "голосового сообщения"),
+    MediaKind("video_note", "видеосообщение", "видеосообщения", caption=False),
+    MediaKind("audio", "аудио", "аудио"),
+)
+
+# Фильтр сообщений с любым поддерживаемым вложением.
+ATTACHMENTS = (
+    filters.PHOTO | filters.VIDEO | filters.ANIMATION | filters.Document.ALL
+    | filters.VOICE | filters.VIDEO_NOTE | filters.AUDIO
+)
+
+
+def message_media(message):
+    """Возвращает (MediaKind, вложение) сообщения или (None, None), если вложения нет."""
+    for kind in MEDIA_KINDS:
+        if getattr(message, kind.name):
+            return kind, kind.attachment(message)
+    return None, None
+
+
+# ---------------------------------------------
+# TRANSFER
+# ---------------------------------------------
+class Transfer:
+    """
+    Доставка файла получателю. Сначала по file_id — байты файла не проходят через бота.
+    Если Telegram не принимает file_id, файл скачивается заново: небольшие файлы — одним буфером
+    в память, крупные — во временный каталог spool. И те и другие занимают общий лимит memory
+    и при его нехватке ждут очереди: PTB всё равно читает файл из spool в память перед отправкой.
+    on_bytes(kind_name, mode, amount) получает объём переданного (mode: file_id, memory, spool).
+    """
+
+    def __init__(self, spool, memory, memory_threshold: int, on_bytes=None):
+        self.spool = spool
+        self.memory = memory
+        self.memory_threshold = memory_threshold
+        self.on_bytes = on_bytes or (lambda kind, mode, amount: None)
+
+    @staticmethod
+    async def download_bytes(file) -> bytes:
+        """
+        Скачивает файл одним объектом bytes, который сразу уходит в InputFile.
+        download_as_bytearray копирует данные в bytearray, а InputFile — обратно в bytes:
+        на каждый файл в памяти оказывалось три копии вместо одной.
+        Путь и URL выбираются так же, как в File.download_to_memory: локальный сервер Bot API
+        отдаёт путь на диске, а обычный URL нужно экранировать.
+        """
+        if is_local_file(file.file_path):
+            return Path(file.file_path).read_bytes()
+        return await file.get_bot().request.retrieve(file._get_encoded_url())
+
+    async def send(self, bot, chat_id: int, kind: MediaKind, media, caption: str = None, reply_markup=None):
+        send = getattr(bot, f"send_{kind.name}")
+        kwargs = {"chat_id": chat_id, "reply_markup": reply_markup}
+        if kind.caption:
+            kwargs.update(caption=caption, parse_mode="HTML")
+        try:
+            result = await send(**kwargs, **{kind.name: media.file_id})
+            self.on_bytes(kind.name, "file_id", media.file_size or 0)
+            return result
+        except BadRequest as e:
+            if media.file_size and media.file_size > BOT_API_DOWNLOAD_LIMIT:
+                raise  # скачать такой файл через Bot API всё равно не получится
+            logger.warning(f"Не удалось переслать {kind.name} по file_id, загружаем заново: {e}")
+        file = await media.get_file()
+        filename = getattr(media, "file_name", None) or media.file_unique_id
+        size = file.file_size or media.file_size or self.memory_threshold
+        if size <= self.memory_threshold:
+            async with self.memory.hold(size):
+                data = await self.download_bytes(file)
+                self.on_bytes(kind.name, "memory", len(data))
+                return await send(**kwargs, **{kind.name: InputFile(data, filename=filename)})
+        async with self.memory.hold(size), self.spool.download(file) as f:
+            result = await send(**kwargs, **{kind.name: InputFile(f, filename=filename)})
+        self.on_bytes(kind.name, "spool", file.file_size or 0)
+        logger.info(f"Spool: {self.spool.stats()}")
+        return result
+
+
+# ---------------------------------------------
+# PIPELINE
+# ---------------------------------------------
+class RelayJob:
+    """Пересылка одного вложения: что, от кого, кому и что ответить отправителю."""
+
+    __slots__ = ("context", "message", "sender", "kind", "media", "chat_id", "ticket_id",
+                 "caption", "reply_markup", "result", "status", "error")
+
+    def __init__(self, context, message, chat_id: int = None):
+        self.context = context
+        self.message = message
+        self.sender = message.from_user
+        self.kind, self.media = message_media(message)
+        self.chat_id = chat_id          # получатель; этап маршрутизации может его выставить
+        self.ticket_id = None
+        self.caption = None
+        self.reply_markup = None
+        self.result = None              # отправленное сообщение
+        self.status = None              # None — конвейер не останавливали; иначе причина остановки
+        self.error = None
+
+
+class RelayPipeline:
+    """
+    Конвейер пересылки вложения. Этапы — async-функции stage(job), выполняются по порядку;
+    этап, вернувший строку, останавливает конвейер, и строка становится job.status
+    ("duplicate", "too_large" и т. п.). Исключение этапа останавливает конвейер со статусом "error".
+    ack(job) вызывается всегда — ответ отправителю по итогу.
+
+    Все направления (пользователь -> оператор, оператор -> пользователь, ответ пользователя)
+    собраны из одних и тех же этапов, поэтому изменения доставки сразу касаются всех.
+    """
+
+    def __init__(self, *stages, ack=None):
+        self.stages = stages
+        self.ack = ack
+
+    async def run(self, job: RelayJob) -> RelayJob:
+        try:
+            for stage in self.stages:
+                status = await stage(job)
+                if status:
+                    job.status = status
+                    break
+        except Exception as e:
+            logger.error(f"Ошибка пересылки {job.kind.name if job.kind else 'вложения'} в чат {job.chat_id}: {e}")
+            job.status, job.error = "error", e
+        if self.ack:
+            await self.ack(job)
+        return job
+
+
+def acknowledge(texts: dict, reply_markup=None, priority: int = None, once=None, capacity: int = 1000):
+    """
+    Этап ack: ответ отправителю по статусу конвейера. texts — {статус: шаблон}, None — успех;
+    в шаблоне доступны {label}, {label_gen} и {chat_id}. Статус без шаблона — без ответа.
+    priority — приоритет ответа в ratelimit.PriorityRateLimiter (None — по умолчанию).
+    once(job) — ключ, по которому отвечают один раз (например, media_group_id: один ответ на альбом);
+    помнятся последние capacity ключей.
+    """
+    answered = OrderedDict()
+
+    async def ack(job: RelayJob):
+        template = texts.get(job.status)
+        if template is None:
+            return
+        if once is not None:
+            key = once(job)
+            if key in answered:
+                return
+            answered[key] = None
+            if len(answered) > capacity:
+                answered.popitem(last=False)
+        text = template.format(label=job.kind.label, label_gen=job.kind.label_gen, chat_id=job.chat_id)
+        await job.context.bot.send_message(
+            chat_id=job.message.chat_id,
+            text=text,
+            parse_mode="HTML",
+            reply_to_message_id=job.message.message_id,
+            reply_markup=reply_markup,
+            rate_limit_args=priority
+        )
+    return ack
@@ -0,0 +1,136 @@
+from dataclasses import dataclass
+from functools import lru_cache
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+# ---------------------------------------------
+# IMAGES
+# ---------------------------------------------
+# Картинки экранов: имя в AssetCache -> исходный URL. Ссылки на страницы просмотра ibb.co AssetCache
+# при проверке заменяет прямыми ссылками на картинки i.ibb.co (из og:image) — их и стоит указывать здесь.
+ASSET_URLS = {
+    "main_menu": "https://ibb.co/MDyvMRTQ",
+    "approve": "https://ibb.co/BHqVL4mM",
+    "reject": "https://ibb.co/zV00BTwN",
+}
+
+# ---------------------------------------------
+# TEXTS
+# ---------------------------------------------
+MAIN_MENU_TEXT = (
+    "Ниже расположено меню с типовыми ситуациями. Пожалуйста ознакомьтесь, "
+    "нажав на соответствующую кнопку.\n\n"
+    "Если мы решили Ваш вопрос, просим поставить ★★★★★ или скорректировать оценку, "
+    "либо дополнить отзыв.\n"
+    "С Уважением, TITAN STYLE!"
+)
+
+CONTACT_TEXT = (
+    "<b>Если вы не нашли ответа на свой вопрос:</b>\n"
+    "Опишите, пожалуйста, проблему текстом ниже и прикрепите фото или видео товара, если это необходимо "
+    "[<b>ОБЯЗАТЕЛЬНО вместе с текстом</b>].\n"
+    "(Также желательно указать время оформления заявки на возврат или заказа товара, а также номер Заказа.)\n\n"
+    "Вскоре с вами свяжется <b>специалист гарантийной службы</b>."
+)
+
+ADD_MORE_TEXT = "Опишите вашу проблему дополнительно или прикрепите новые файлы."
+
+# ---------------------------------------------
+# KEYBOARDS
+# ---------------------------------------------
+# Клавиатуры неизменяемы (объекты PTB заморожены), поэтому строятся один раз при импорте.
+
+# Главное меню: кнопки расположены столбиком.
+MAIN_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Сможем помочь +", callback_data="approve")],
+    [InlineKeyboardButton("❌ НЕ Сможем помочь -", callback_data="reject")],
+    [InlineKeyboardButton("💬 Не нашел ответа", callback_data="contact")],
+    [InlineKeyboardButton("МЫ НА ОЗОН", url="https://www.ozon.ru/seller/titan-style-1468753/products/?miniapp=seller_1468753")],
+    [InlineKeyboardButton("МЫ НА ВБ", url="https://www.wildberries.ru/brands/310806956-titan-style/galstuki")]
+])
+
+# Навигация: кнопки 'Назад' и 'Главное меню'.
+NAV_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🔙 Назад", callback_data="back"),
+        InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")
+    ]
+])
+
+# 'Дополнить обращение' и 'Завершить' — после каждого сообщения пользователя.
+CONTINUE_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Дополнить обращение", callback_data="add_more"),
+        InlineKeyboardButton("Завершить", callback_data="done")
+    ]
+])
+
+# Кнопка 'Ответить админу' для пользователя.
+USER_REPLY_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("Ответить админу", callback_data="user_reply")]
+])
+
+# Единственная кнопка 'Главное меню' — для сообщений вне диалога.
+TO_MAIN_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]
+])
+
+
+@lru_cache(maxsize=1024)
+def admin_reply_button(user_id: int):
+    """Кнопка 'Ответить' для администратора, callback_data = "admin_reply_<user_id>"."""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("Ответить", callback_data=f"admin_reply_{user_id}")]
+    ])
+
+
+@lru_cache(maxsize=16)
+def faq_keyboard(screen: str = None):
+    """
+    Кнопки под готовым ответом пользователю: "faq_ok" и "faq_forward";
+    screen — экран меню с подробностями (ключ SCREENS), его кнопка идёт первой.
+    """
+    rows = [[
+        InlineKeyboardButton("✅ Да, спасибо", callback_data="faq_ok"),
+        InlineKeyboardButton("💬 Написать оператору", callback_data="faq_forward")
+    ]]
+    if screen:
+        rows.insert(0, [InlineKeyboardButton("📋 Подробнее", callback_data=screen)])
+    return InlineKeyboardMarkup(rows)
+
+
+def canned_keyboard(user_id: int, doc_ids: tuple):
+    """Кнопки подсказок оператору по номерам, callback_data = "canned_<user_id>_<doc_id>"."""
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton(f"📨 {number}", callback_data=f"canned_{user_id}_{doc_id}")
+        for number, doc_id in enumerate(doc_ids, start=1)
+    ]])
+
+# ---------------------------------------------
+# SCREENS
+# ---------------------------------------------
+@dataclass(frozen=True)
+class Screen:
+    """
+    Экран меню: текст (для экрана с картинкой — подпись), картинка из ASSET_URLS
+    и клавиатура. opens_dialog — после показа экрана пользователь может писать обращение
+    (состояние ASK_QUESTION); иначе диалог завершается.
+    """
+    text: str = None
+    photo: str = None
+    keyboard: InlineKeyboardMarkup = None
+    opens_dialog: bool = False
+
+
+MAIN_MENU_SCREEN = Screen(text=MAIN_MENU_TEXT, photo="main_menu", keyboard=MAIN_MENU_KEYBOARD)
+
+# callback_data кнопки -> экран. Новый экран FAQ = новая запись здесь и кнопка в клавиатуре.
+SCREENS = {
+    "approve": Screen(photo="approve", keyboard=NAV_KEYBOARD, opens_dialog=True),
+    "reject": Screen(photo="reject", keyboard=NAV_KEYBOARD),
+    "contact": Screen(text=CONTACT_TEXT, keyboard=NAV_KEYBOARD, opens_dialog=True),
+    "back": MAIN_MENU_SCREEN,
+    "main_menu": MAIN_MENU_SCREEN,
+    "add_more": Screen(text=ADD_MORE_TEXT, keyboard=NAV_KEYBOARD, opens_dialog=True),
+    "done": MAIN_MENU_SCREEN,
+}
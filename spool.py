@@ -0,0 +1,176 @@
+import asyncio
+import glob
+import logging
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+# Шаблоны файлов, которые старые версии бота оставляли в рабочем каталоге.
+LEGACY_PATTERNS = (
+    "user_doc_*", "user_photo_*", "user_video_*",
+    "admin_reply_photo_*", "admin_reply_doc_*", "admin_reply_video_*",
+    "user_reply_photo_*", "user_reply_doc_*", "user_reply_video_*",
+)
+
+
+class Spool:
+    """
+    Временный каталог для пересылаемых вложений.
+    Размер каталога ограничен max_bytes, файлы старше max_age секунд удаляются.
+    Каждый файл живёт только внутри контекста spool.download(...): после выхода
+    дескриптор закрывается, а файл удаляется, даже если отправка упала с ошибкой.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_age: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.bytes_spooled = 0   # сколько байт всего записано в каталог
+        self.bytes_evicted = 0   # сколько байт удалено вытеснением (по возрасту или размеру)
+        self._active = set()     # файлы, которые сейчас отправляются — их не вытесняем
+
+    @classmethod
+    def from_env(cls):
+        """Создаёт Spool по переменным окружения SPOOL_DIR, SPOOL_MAX_BYTES, SPOOL_MAX_AGE."""
+        return cls(
+            directory=os.environ.get("SPOOL_DIR", "spool"),
+            max_bytes=int(os.environ.get("SPOOL_MAX_BYTES", 200 * 1024 * 1024)),
+            max_age=float(os.environ.get("SPOOL_MAX_AGE", 3600)),
+        )
+
+    def _entries(self):
+        """Файлы каталога (путь, размер, mtime), от старых к новым."""
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.is_file():
+                        st = entry.stat()
+                        entries.append((entry.path, st.st_size, st.st_mtime))
+        except FileNotFoundError:
+            return []
+        entries.sort(key=lambda e: e[2])
+        return entries
+
+    def evict(self, reserve: int = 0):
+        """
+        Удаляет просроченные файлы и самые старые файлы, пока в каталоге
+        не освободится место ещё для reserve байт.
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        entries = [e for e in entries if e[0] not in self._active]
+        deadline = time.time() - self.max_age
+        for path, size, mtime in entries:
+            if mtime >= deadline and total + reserve <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.error(f"Ошибка удаления файла из spool {path}: {e}")
+                continue
+            total -= size
+            self.bytes_evicted += size
+
+    @asynccontextmanager
+    async def download(self, file, suffix: str = ""):
+        """
+        Скачивает telegram.File во временный файл и отдаёт открытый на чтение дескриптор.
+        По выходу из контекста дескриптор закрывается, файл удаляется.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.evict(reserve=file.file_size or 0)
+        path = os.path.join(self.directory, f"{uuid.uuid4().hex}{suffix}")
+        self._active.add(path)
+        try:
+            await file.download_to_drive(path)
+            self.bytes_spooled += os.path.getsize(path)
+            with open(path, "rb") as f:
+                yield f
+        finally:
+            self._active.discard(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Ошибка удаления файла из spool {path}: {e}")
+
+    def purge_legacy(self, directory: str = "."):
+        """Удаляет файлы, оставленные в рабочем каталоге старыми версиями бота."""
+        for pattern in LEGACY_PATTERNS:
+            for path in glob.glob(os.path.join(directory, pattern)):
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                    self.bytes_evicted += size
+                except OSError as e:
+                    logger.error(f"Ошибка удаления старого файла {path}: {e}")
+
+    def stats(self) -> dict:
+        """Счётчики для логов и метрик."""
+        return {
+            "bytes_spooled": self.bytes_spooled,
+            "bytes_evicted": self.bytes_evicted,
+            "files_active": len(self._active),
+        }
+
+
+class MemoryBudget:
+    """
+    Общий лимит памяти под пересылаемые файлы: сумма размеров файлов, которые сейчас
+    скачиваются или отправляются, не превышает limit байт.
+
+    hold() ждёт, пока освободится место; файл крупнее всего лимита ждёт, пока не останется
+    других пересылок, и идёт один.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self.peak = 0
+        self.waits_total = 0    # сколько раз hold() пришлось ждать
+        self._released = None
+
+    @classmethod
+    def from_env(cls):
+        """Создаёт MemoryBudget по переменной окружения RELAY_MEMORY_BUDGET."""
+        return cls(int(os.environ.get("RELAY_MEMORY_BUDGET", 48 * 1024 * 1024)))
+
+    def _fits(self, size: int) -> bool:
+        return self.in_use + size <= self.limit or self.in_use == 0
+
+    def _take(self, size: int):
+        self.in_use += size
+        self.peak = max(self.peak, self.in_use)
+
+    def release(self, size: int):
+        self.in_use -= size
+        if self._released is not None:
+            self._released.set()
+
+    @asynccontextmanager
+    async def hold(self, size: int):
+        if not self._fits(size):
+            self.waits_total += 1
+            if self._released is None:
+                self._released = asyncio.Event()
+            while not self._fits(size):
+                self._released.clear()
+                await self._released.wait()
+        self._take(size)
+        try:
+            yield
+        finally:
+            self.release(size)
+
+    def stats(self) -> dict:
+        """Счётчики для логов и метрик."""
+        return {
+            "bytes_in_use": self.in_use,
+            "bytes_peak": self.peak,
+            "waits_total": self.waits_total,
+        }
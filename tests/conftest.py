@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# Модули бота лежат в корне репозитория рядом с bot1.py.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# bot1 при импорте открывает базу состояния — пусть она будет во временном каталоге, а не в репозитории.
+_STATE_DIR = tempfile.mkdtemp()
+os.environ.setdefault("STATE_DB", os.path.join(_STATE_DIR, "state.sqlite3"))
+os.environ.setdefault("ASSET_CACHE_FILE", os.path.join(_STATE_DIR, "asset_cache.json"))
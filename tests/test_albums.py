@@ -0,0 +1,112 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram import InputMediaDocument, InputMediaPhoto
+
+from albums import MEDIA_GROUP_LIMIT, MediaGroupCollector, chunk_media, input_media
+from ordering import _PENDING, _PendingUpdate, defer_update_done
+from relay import acknowledge
+
+
+def message(message_id, kind="photo", caption=None, chat_id=1, media_group_id="g"):
+    media = SimpleNamespace(file_id=f"{kind}{message_id}")
+    fields = dict.fromkeys(("photo", "video", "audio", "document"))
+    fields[kind] = [media] if kind == "photo" else media
+    return SimpleNamespace(message_id=message_id, chat_id=chat_id, media_group_id=media_group_id,
+                           caption=caption, **fields)
+
+
+def test_input_media_keeps_caption():
+    media = input_media(message(1, caption="брак на &lt;шве&gt;"), "брак на &lt;шве&gt;")
+    assert isinstance(media, InputMediaPhoto)
+    assert media.media == "photo1"
+    assert media.caption == "брак на &lt;шве&gt;"
+    assert media.parse_mode == "HTML"
+
+
+def test_input_media_without_caption():
+    media = input_media(message(1, kind="document"))
+    assert isinstance(media, InputMediaDocument)
+    assert media.caption is None
+
+
+def test_chunk_media_separates_documents_and_limits_size():
+    messages = [message(i) for i in range(MEDIA_GROUP_LIMIT + 2)] + [message(100, kind="document")]
+    chunks = list(chunk_media(messages))
+    assert [len(chunk) for chunk in chunks] == [MEDIA_GROUP_LIMIT, 2, 1]
+    assert chunks[-1][0].document is not None
+
+
+def test_collector_flushes_album_once_in_order():
+    flushed = []
+
+    async def on_flush(messages, context):
+        flushed.append([m.message_id for m in messages])
+
+    async def scenario():
+        collector = MediaGroupCollector(on_flush, window=0.02)
+        context = SimpleNamespace(
+            application=SimpleNamespace(create_task=lambda c: asyncio.get_running_loop().create_task(c))
+        )
+        for message_id in (3, 1, 2):
+            collector.add(message(message_id), context)
+        collector.add(message(9, media_group_id="other"), context)
+        assert collector.pending() == 2
+        await asyncio.sleep(0.1)
+        assert collector.pending() == 0
+
+    asyncio.run(scenario())
+    assert sorted(flushed) == [[1, 2, 3], [9]]
+
+
+def test_acknowledge_once_per_album():
+    sent = []
+
+    async def send_message(**kwargs):
+        sent.append(kwargs)
+
+    bot = SimpleNamespace(send_message=send_message)
+    ack = acknowledge({"quota": "много файлов"}, once=lambda job: job.message.media_group_id)
+
+    def job(message_id, status, group="g"):
+        return SimpleNamespace(context=SimpleNamespace(bot=bot), message=message(message_id, media_group_id=group),
+                               kind=SimpleNamespace(label="фото", label_gen="фото"), chat_id=None, status=status)
+
+    async def main():
+        await ack(job(1, None))
+        for message_id in (2, 3, 4):
+            await ack(job(message_id, "quota"))
+        await ack(job(5, "quota", group="h"))
+
+    asyncio.run(main())
+    assert [kwargs["reply_to_message_id"] for kwargs in sent] == [2, 5]
+
+
+def test_collector_marks_album_updates_done_after_flush():
+    done = []
+
+    class Dedupe:
+        def done(self, update_id):
+            done.append(update_id)
+
+    async def on_flush(messages, context):
+        assert done == []
+
+    async def scenario():
+        collector = MediaGroupCollector(on_flush, window=0.02)
+
+        def create_task(coroutine):
+            task = asyncio.get_running_loop().create_task(coroutine)
+            defer_update_done(task)  # так делает ChatOrderedApplication.create_task
+            return task
+        context = SimpleNamespace(application=SimpleNamespace(create_task=create_task))
+        for update_id in (1, 2):
+            pending = _PendingUpdate(Dedupe(), update_id)
+            _PENDING.set(pending)
+            collector.add(message(update_id), context)
+            pending.release()
+        assert done == []
+        await asyncio.sleep(0.1)
+
+    asyncio.run(scenario())
+    assert sorted(done) == [1, 2]
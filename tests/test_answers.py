@@ -0,0 +1,80 @@
+import os
+
+from answers import CANNED, RESOLVED, Answer, AnswerIndex, tokenize
+
+CANNED_ANSWERS_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "canned_answers.json")
+
+# Настройки FAQ для пользователей, рекомендованные в bot1.py для canned_answers.json.
+FAQ_MIN_SCORE = 2.5
+FAQ_MIN_TERMS = 2
+
+
+def faq_index():
+    index = AnswerIndex(max_resolved=0)
+    index.load_canned(CANNED_ANSWERS_FILE, with_text=False)
+    return index
+
+
+def faq_titles(index, text):
+    return [answer.title for _, answer in index.search(text, k=1, min_score=FAQ_MIN_SCORE, min_terms=FAQ_MIN_TERMS)]
+
+
+def test_tokenize_stems_and_drops_stop_words():
+    assert tokenize("Здравствуйте! Когда вернут деньги за заказ 12345?") == ["вернут"[:5], "деньг", "заказ"]
+    assert tokenize("Ёлка") == tokenize("елка")
+
+
+def test_faq_ignores_unrelated_questions():
+    index = faq_index()
+    assert faq_titles(index, "хочу поговорить с оператором") == []
+    assert faq_titles(index, "верните деньги за заказ, товар не пришёл") == []
+
+
+def test_faq_answers_matching_questions():
+    index = faq_index()
+    assert faq_titles(index, "Когда вернут деньги за возврат?") == ["Когда вернут деньги"]
+    assert faq_titles(index, "Как оформить возврат?") == ["Как оформить возврат"]
+    assert faq_titles(index, "Не подошёл размер") == ["Не подошёл размер или передумал"]
+
+
+def test_faq_does_not_index_answer_text():
+    full, faq = AnswerIndex(), AnswerIndex()
+    full.load_canned(CANNED_ANSWERS_FILE)
+    faq.load_canned(CANNED_ANSWERS_FILE, with_text=False)
+    assert len(full) == len(faq) > 0
+    assert sum(full.get(doc_id).length for doc_id in ("c1", "c2")) > sum(faq.get(doc_id).length for doc_id in ("c1", "c2"))
+
+
+def test_min_terms_requires_distinct_words():
+    index = AnswerIndex()
+    index.add(Answer("c1", CANNED, "Деньги", "деньги деньги деньги"), "деньги деньги деньги")
+    index.add(Answer("c2", CANNED, "Возврат денег", "возврат денег"), "возврат денег")
+    assert [a.doc_id for _, a in index.search("вернуть деньги", min_terms=2)] == []
+    assert [a.doc_id for _, a in index.search("возврат денег", min_terms=2)] == ["c2"]
+
+
+def test_search_ranks_and_filters_by_source():
+    index = AnswerIndex()
+    index.add(Answer("c1", CANNED, "Брак", "Пришлите фото брака."), "брак дефект фото")
+    index.add_resolved(7, "Куртка с дефектом, порван рукав", "Оформили возврат за брак.")
+    index.add_resolved(8, "Где мой заказ?", "Заказ в пути.")
+    hits = index.search("брак", k=3)
+    assert [a.doc_id for _, a in hits] == ["c1", "t7"]
+    assert hits[0][0] > hits[1][0]
+    # "брак" есть в двух документах из трёх — общее слово только уточняет оценку найденных по редким словам.
+    assert [a.doc_id for _, a in index.search("порван рукав, брак", k=3)] == ["t7"]
+    assert [a.doc_id for _, a in index.search("брак", source=RESOLVED)] == ["t7"]
+    assert index.counts() == {CANNED: 1, RESOLVED: 2}
+
+
+def test_resolved_answers_are_evicted_oldest_first():
+    index = AnswerIndex(max_resolved=2)
+    for ticket_id in (1, 2, 3):
+        index.add_resolved(ticket_id, f"вопрос номер {ticket_id} про посылку", "ответ")
+    assert index.get("t1") is None
+    assert index.counts() == {CANNED: 0, RESOLVED: 2}
+    index.add_resolved(2, "посылка потерялась", "нашли посылку")
+    assert index.get("t2").text == "нашли посылку"
+    assert index.counts()[RESOLVED] == 2
+    index.remove("t3")
+    assert [a.doc_id for _, a in index.search("посылка")] == ["t2"]
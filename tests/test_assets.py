@@ -0,0 +1,88 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from telegram.error import BadRequest
+
+import bot1
+from assets import AssetCache, page_image_url
+
+
+def photo_message(file_id):
+    return SimpleNamespace(photo=[SimpleNamespace(file_id=f"{file_id}_small"), SimpleNamespace(file_id=file_id)])
+
+
+async def serve(state, check):
+    """Страница просмотра как на ibb.co: HTML меняется при каждой загрузке, картинка — только по state."""
+    async def page(request):
+        state["views"] += 1
+        html = (f'<html><head><meta property="og:image" content="{request.url.origin()}/image.png">'
+                f'<script>token="{state["views"]}"</script></head></html>')
+        return web.Response(text=html, content_type="text/html")
+
+    async def image(request):
+        return web.Response(body=state["image"], content_type="image/png")
+
+    app = web.Application()
+    app.router.add_get("/view", page)
+    app.router.add_get("/image.png", image)
+    async with TestServer(app) as server:
+        await check(str(server.make_url("/view")))
+
+
+def test_page_image_url():
+    page = '<meta property="og:image" content="https://i.ibb.co/abc/menu.png" />'
+    assert page_image_url(page) == "https://i.ibb.co/abc/menu.png"
+    assert page_image_url("<html></html>") is None
+
+
+def test_revalidate_hashes_image_not_page(tmp_path):
+    path = str(tmp_path / "assets.json")
+    state = {"views": 0, "image": b"png-1"}
+
+    async def check(url):
+        cache = AssetCache(path, {"main_menu": url})
+        await cache.revalidate()
+        assert cache.url("main_menu").endswith("/image.png")
+        cache.remember("main_menu", photo_message("file-1"))
+        assert json.load(open(path))["main_menu"]["sha256"] is not None
+
+        # Холодный старт: HTML страницы другой, картинка та же — file_id остаётся.
+        restarted = AssetCache(path, {"main_menu": url})
+        await restarted.revalidate()
+        assert restarted.get("main_menu") == "file-1"
+
+        state["image"] = b"png-2"
+        changed = AssetCache(path, {"main_menu": url})
+        await changed.revalidate()
+        assert not changed.is_cached("main_menu")
+        assert changed.get("main_menu").endswith("/image.png")
+
+    asyncio.run(serve(state, check))
+    assert state["views"] == 3
+
+
+def test_send_asset_photo_retries_when_file_id_dropped_concurrently(tmp_path, monkeypatch):
+    # Два нажатия одновременно: Telegram не принял старый file_id ни у одного. Первый вызов сбрасывает
+    # file_id, второй уже не видит его в кэше — но всё равно должен отправить картинку по URL, а не упасть.
+    cache = AssetCache(str(tmp_path / "assets.json"), {"main_menu": "https://i.ibb.co/abc/menu.png"})
+    cache.remember("main_menu", photo_message("stale"))
+    monkeypatch.setattr(bot1, "ASSETS", cache)
+    sent = []
+
+    async def send_photo(photo, **kwargs):
+        await asyncio.sleep(0)
+        if photo == "stale":
+            raise BadRequest("Wrong file identifier")
+        sent.append(photo)
+        return photo_message("fresh")
+
+    async def scenario():
+        chat = SimpleNamespace(send_photo=send_photo)
+        await asyncio.gather(bot1.send_asset_photo(chat, "main_menu"), bot1.send_asset_photo(chat, "main_menu"))
+
+    asyncio.run(scenario())
+    assert sent == ["https://i.ibb.co/abc/menu.png"] * 2
+    assert cache.get("main_menu") == "fresh"
@@ -0,0 +1,104 @@
+from dedupe import FileDeduplicator, UpdateDeduplicator
+
+
+def make(tmp_path, **kwargs):
+    return UpdateDeduplicator(str(tmp_path / "state.sqlite3"), **kwargs)
+
+
+def test_repeated_update_is_duplicate(tmp_path):
+    dedupe = make(tmp_path)
+    assert not dedupe.seen(100)
+    assert dedupe.seen(100)
+    dedupe.done(100)
+    assert dedupe.seen(100)
+    assert dedupe.duplicates_total == 2
+
+
+def test_out_of_order_delivery_is_processed(tmp_path):
+    dedupe = make(tmp_path)
+    assert not dedupe.seen(101)
+    dedupe.done(101)
+    assert not dedupe.seen(100)
+    dedupe.done(100)
+    assert not dedupe.seen(99)
+    assert dedupe.duplicates_total == 0
+
+
+def test_watermark_restored_after_restart(tmp_path):
+    dedupe = make(tmp_path)
+    for update_id in (100, 101):
+        dedupe.seen(update_id)
+        dedupe.done(update_id)
+    dedupe.save()
+
+    restarted = make(tmp_path)
+    assert restarted.restored == 101
+    assert restarted.seen(100)
+    assert restarted.seen(101)
+    assert not restarted.seen(102)
+
+
+def test_watermark_does_not_pass_updates_in_flight(tmp_path):
+    dedupe = make(tmp_path)
+    dedupe.seen(100)
+    dedupe.seen(101)
+    dedupe.done(101)
+    dedupe.save()
+    assert dedupe.watermark == 99
+
+    restarted = make(tmp_path)
+    assert not restarted.seen(100)
+    assert restarted.seen(99)
+
+
+def test_watermark_waits_for_update_not_yet_delivered(tmp_path):
+    dedupe = make(tmp_path)
+    for update_id in (100, 102, 103):
+        dedupe.seen(update_id)
+        dedupe.done(update_id)
+    assert dedupe.watermark == 100  # 101 ещё не приходило — после перезапуска его нельзя отбросить
+
+    dedupe.seen(101)
+    dedupe.done(101)
+    assert dedupe.watermark == 103
+
+
+def test_watermark_skips_gap_after_timeout(tmp_path):
+    dedupe = make(tmp_path, gap_timeout=0)
+    for update_id in (100, 102, 103):
+        dedupe.seen(update_id)
+        dedupe.done(update_id)
+    assert dedupe.watermark == 103
+
+
+def test_watermark_does_not_skip_gap_into_updates_in_flight(tmp_path):
+    dedupe = make(tmp_path, gap_timeout=0)
+    for update_id in (100, 102, 103):
+        dedupe.seen(update_id)
+    dedupe.done(100)
+    dedupe.done(103)
+    assert dedupe.watermark == 101  # пропуск 101 закрыт, 102 ещё обрабатывается
+    dedupe.done(102)
+    assert dedupe.watermark == 103
+
+
+def test_lru_capacity(tmp_path):
+    dedupe = make(tmp_path, capacity=2)
+    for update_id in (1, 2, 3):
+        dedupe.seen(update_id)
+    assert not dedupe.seen(1)
+    assert dedupe.seen(3)
+
+
+def test_file_remembered_after_relay():
+    files = FileDeduplicator(ttl=60)
+    assert not files.seen(1, "abc")
+    files.remember(1, "abc")
+    assert files.seen(1, "abc")
+    assert not files.seen(2, "abc")
+
+
+def test_file_ttl_expired():
+    files = FileDeduplicator(ttl=0)
+    files.remember(1, "abc")
+    assert not files.seen(1, "abc")
@@ -0,0 +1,33 @@
+import asyncio
+
+from lifecycle import Lifecycle
+
+
+def test_background_tasks_finish_or_are_cancelled_on_stop(tmp_path, caplog):
+    lifecycle = Lifecycle(str(tmp_path / "state.sqlite3"))
+    log = []
+
+    async def quick():
+        log.append("quick")
+
+    async def slow():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            log.append("cancelled")
+            raise
+
+    async def broken():
+        raise RuntimeError("нет сети")
+
+    async def scenario():
+        lifecycle.start_background(quick(), slow(), broken())
+        await asyncio.sleep(0.01)
+        pending = len(lifecycle._tasks)
+        await lifecycle.stop_background()
+        return pending
+
+    assert asyncio.run(scenario()) == 1
+    assert log == ["quick", "cancelled"]
+    assert not lifecycle._tasks
+    assert "нет сети" in caplog.text
@@ -0,0 +1,69 @@
+import asyncio
+import re
+from types import SimpleNamespace
+
+from telegram.error import BadRequest
+
+import bot1
+
+TAGS = re.compile(r"</?(b|i)>")
+
+
+class FakeBot:
+    """Bot API, который, как Telegram, отклоняет HTML с неэкранированными < и &."""
+
+    def __init__(self, fail_html=False, fail_all=False):
+        self.fail_html = fail_html
+        self.fail_all = fail_all
+        self.sent = []
+
+    async def send_message(self, chat_id, text, parse_mode=None, reply_markup=None, **kwargs):
+        if self.fail_all and chat_id != USER.id:
+            raise BadRequest("Chat not found")
+        if parse_mode == "HTML" and (self.fail_html or re.search(r"<|&(?![a-z]+;|#\d+;)", TAGS.sub("", text))):
+            raise BadRequest("Can't parse entities: unsupported start tag")
+        self.sent.append(SimpleNamespace(chat_id=chat_id, text=text, parse_mode=parse_mode))
+
+
+USER = SimpleNamespace(id=501, first_name="<Аня & Co>", last_name=None, username="a<b")
+
+
+def forward(bot, text):
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        context = SimpleNamespace(bot=bot, application=SimpleNamespace(create_task=loop.create_task))
+        bot1.forward_user_text(context, USER, text)
+        while bot1.OPERATOR_POSTS.pending():
+            await asyncio.sleep(0.01)
+    asyncio.run(scenario())
+
+
+def test_ticket_header_escapes_name():
+    header = bot1.ticket_header(7, USER)
+    assert "&lt;Аня &amp; Co&gt;" in header
+    assert "@a&lt;b" in header
+
+
+def test_text_with_markup_characters_reaches_operator():
+    bot = FakeBot()
+    forward(bot, "цена <100 & доставка")
+    [post] = bot.sent
+    assert post.parse_mode == "HTML"
+    assert "цена &lt;100 &amp; доставка" in post.text
+
+
+def test_rejected_markup_falls_back_to_plain_text():
+    bot = FakeBot(fail_html=True)
+    forward(bot, "цена <100")
+    [post] = bot.sent
+    assert post.parse_mode is None
+    assert "цена <100" in post.text
+    assert "<Аня & Co>" in post.text
+
+
+def test_customer_is_told_when_post_is_lost():
+    bot = FakeBot(fail_all=True)
+    forward(bot, "где заказ")
+    [notice] = bot.sent
+    assert notice.chat_id == USER.id
+    assert "ещё раз" in notice.text
@@ -0,0 +1,126 @@
+import asyncio
+from types import SimpleNamespace
+
+from ordering import (
+    _PENDING, _SLOT, SerialTasks, _PendingUpdate, _UpdateSlot, defer_update_done, released_update_slot
+)
+
+
+def fake_application():
+    return SimpleNamespace(create_task=lambda coroutine: asyncio.get_running_loop().create_task(coroutine))
+
+
+def test_released_update_slot_lets_other_updates_run():
+    async def scenario():
+        semaphore = asyncio.BoundedSemaphore(1)
+        slot = _UpdateSlot(semaphore)
+        await slot.acquire()
+        _SLOT.set(slot)
+        async with released_update_slot():
+            assert not semaphore.locked()
+            async with semaphore:
+                pass
+        assert slot.held and semaphore.locked()
+        slot.release()
+        assert not semaphore.locked()
+    asyncio.run(scenario())
+
+
+def test_released_update_slot_ignores_other_tasks():
+    async def scenario():
+        semaphore = asyncio.BoundedSemaphore(1)
+        slot = _UpdateSlot(semaphore)
+        await slot.acquire()
+        _SLOT.set(slot)
+
+        async def background():
+            async with released_update_slot():
+                return semaphore.locked()
+        # Фоновая задача наследует контекст, но слот ей не принадлежит.
+        assert await asyncio.create_task(background())
+    asyncio.run(scenario())
+
+
+def test_serial_tasks_keep_order_per_key():
+    async def scenario():
+        tasks = SerialTasks()
+        application = fake_application()
+        log = []
+
+        async def job(name, delay):
+            await asyncio.sleep(delay)
+            log.append(name)
+
+        tasks.submit(application, 1, job("a1", 0.03))
+        tasks.submit(application, 1, job("a2", 0))
+        tasks.submit(application, 2, job("b1", 0.01))
+        assert tasks.pending() == 3
+        while tasks.pending():
+            await asyncio.sleep(0.01)
+        return log
+    assert asyncio.run(scenario()) == ["b1", "a1", "a2"]
+
+
+def test_serial_tasks_continue_after_error():
+    async def scenario():
+        tasks = SerialTasks()
+        application = fake_application()
+        log = []
+
+        async def failing():
+            raise RuntimeError("boom")
+
+        async def job():
+            log.append("ok")
+
+        tasks.submit(application, 1, failing())
+        await tasks.submit(application, 1, job())
+        return log
+    assert asyncio.run(scenario()) == ["ok"]
+
+
+class FakeDedupe:
+    def __init__(self):
+        self.done_ids = []
+
+    def done(self, update_id):
+        self.done_ids.append(update_id)
+
+
+def test_update_done_after_background_posts():
+    async def scenario():
+        dedupe = FakeDedupe()
+        pending = _PendingUpdate(dedupe, 10)
+        _PENDING.set(pending)
+        release = asyncio.Event()
+        tasks = SerialTasks()
+        application = fake_application()
+
+        async def post():
+            await release.wait()
+
+        task = tasks.submit(application, 1, post())
+        defer_update_done(task)  # так делает ChatOrderedApplication.create_task
+        pending.release()  # обработчик завершился
+        await asyncio.sleep(0)
+        assert dedupe.done_ids == []
+        release.set()
+        await task
+        await asyncio.sleep(0)
+        assert dedupe.done_ids == [10]
+    asyncio.run(scenario())
+
+
+def test_cancelled_background_task_leaves_update_unfinished():
+    async def scenario():
+        dedupe = FakeDedupe()
+        pending = _PendingUpdate(dedupe, 10)
+        task = asyncio.create_task(asyncio.sleep(10))
+        _PENDING.set(pending)
+        defer_update_done(task)
+        pending.release()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert dedupe.done_ids == []
+    asyncio.run(scenario())
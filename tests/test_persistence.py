@@ -0,0 +1,39 @@
+import asyncio
+import time
+
+from persistence import SQLitePersistence
+
+
+def test_flush_waits_for_background_write(tmp_path, monkeypatch):
+    # Фоновая запись ещё идёт в потоке, когда Application зовёт flush при остановке:
+    # база должна закрыться только после неё, иначе изменения теряются.
+    path = str(tmp_path / "state.sqlite3")
+    write = SQLitePersistence._write
+
+    def slow_write(self, dirty):
+        time.sleep(0.05)
+        write(self, dirty)
+
+    monkeypatch.setattr(SQLitePersistence, "_write", slow_write)
+
+    async def scenario():
+        persistence = SQLitePersistence(path)
+        await persistence.update_user_data(1, {"faq_question": "где заказ"})
+        await persistence.update_conversation("main", (1, 1), 1)
+        for _ in range(3):
+            await asyncio.sleep(0)
+        await persistence.flush()
+
+    asyncio.run(scenario())
+    monkeypatch.undo()
+
+    async def reload():
+        persistence = SQLitePersistence(path)
+        try:
+            return await persistence.get_user_data(), await persistence.get_conversations("main")
+        finally:
+            await persistence.flush()
+
+    user_data, conversations = asyncio.run(reload())
+    assert user_data == {1: {"faq_question": "где заказ"}}
+    assert conversations == {(1, 1): 1}
@@ -0,0 +1,143 @@
+import asyncio
+import contextlib
+import time
+
+from ratelimit import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, PriorityRateLimiter, TokenBucket
+
+
+def request(limiter, log, name, endpoint="sendMessage", chat_id=1, priority=None):
+    async def callback():
+        log.append(name)
+        return name
+    return limiter.process_request(callback, (), {}, endpoint, {"chat_id": chat_id}, priority)
+
+
+def test_token_bucket_burst_then_rate():
+    bucket = TokenBucket(rate=2, capacity=3)
+    now = time.monotonic()
+    for _ in range(3):
+        assert bucket.delay(now) == 0
+        bucket.take()
+    assert 0.4 < bucket.delay(now) <= 0.5
+
+
+def test_token_bucket_pause():
+    bucket = TokenBucket(rate=100, capacity=1)
+    bucket.pause(5)
+    assert bucket.delay(time.monotonic()) > 4
+
+
+def test_chat_burst_is_not_delayed():
+    async def scenario():
+        limiter = PriorityRateLimiter(chat_rate=1, chat_burst=5)
+        log = []
+        started = time.monotonic()
+        await asyncio.gather(*(request(limiter, log, i) for i in range(5)))
+        return time.monotonic() - started, log
+    elapsed, log = asyncio.run(scenario())
+    assert elapsed < 0.1
+    assert log == [0, 1, 2, 3, 4]
+
+
+def test_chat_queue_ordered_by_priority():
+    async def scenario():
+        limiter = PriorityRateLimiter(chat_rate=20, chat_burst=1)
+        log = []
+        first = asyncio.create_task(request(limiter, log, "first"))
+        await asyncio.sleep(0)
+        low = [asyncio.create_task(request(limiter, log, f"low{i}", priority=PRIORITY_LOW)) for i in range(2)]
+        await asyncio.sleep(0)
+        normal = asyncio.create_task(request(limiter, log, "normal", priority=PRIORITY_NORMAL))
+        high = asyncio.create_task(request(limiter, log, "high", priority=PRIORITY_HIGH))
+        await asyncio.gather(first, normal, high, *low)
+        return log
+    assert asyncio.run(scenario()) == ["first", "high", "normal", "low0", "low1"]
+
+
+def test_other_chats_are_not_blocked():
+    async def scenario():
+        limiter = PriorityRateLimiter(chat_rate=1, chat_burst=1)
+        log = []
+        await request(limiter, log, "operator")
+        waiting = asyncio.create_task(request(limiter, log, "operator again"))
+        started = time.monotonic()
+        await request(limiter, log, "user", chat_id=2)
+        elapsed = time.monotonic() - started
+        waiting.cancel()
+        return elapsed, log
+    elapsed, log = asyncio.run(scenario())
+    assert elapsed < 0.1
+    assert log == ["operator", "user"]
+
+
+def test_callback_answers_and_edits_skip_chat_budget():
+    async def scenario():
+        limiter = PriorityRateLimiter(chat_rate=1, chat_burst=1)
+        log = []
+        await request(limiter, log, "message")
+        started = time.monotonic()
+        await request(limiter, log, "edit", endpoint="editMessageText")
+        await request(limiter, log, "delete", endpoint="deleteMessage")
+        return time.monotonic() - started
+    assert asyncio.run(scenario()) < 0.1
+
+
+def test_wait_context_wraps_only_real_waits():
+    entered = []
+
+    @contextlib.asynccontextmanager
+    async def wait_context():
+        entered.append(True)
+        yield
+
+    async def scenario():
+        limiter = PriorityRateLimiter(chat_rate=50, chat_burst=1, wait_context=wait_context)
+        log = []
+        await request(limiter, log, "immediate")
+        assert entered == []
+        await request(limiter, log, "delayed")
+        assert entered == [True]
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def scenario():
+        limiter = PriorityRateLimiter(chat_rate=20, chat_burst=1)
+        log = []
+        await request(limiter, log, "first")
+        cancelled = asyncio.create_task(request(limiter, log, "cancelled", priority=PRIORITY_HIGH))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await request(limiter, log, "next")
+        return log, limiter._chat_waiters[1]
+    log, waiters = asyncio.run(scenario())
+    assert log == ["first", "next"]
+    assert waiters == []
+
+
+def test_overall_limit_served_by_priority():
+    async def scenario():
+        limiter = PriorityRateLimiter(overall_rate=20, chat_rate=1000, chat_burst=1000)
+        await limiter.initialize()
+        limiter._overall.tokens = 0
+        log = []
+        tasks = [asyncio.create_task(request(limiter, log, "low", chat_id=None, priority=PRIORITY_LOW))]
+        tasks.append(asyncio.create_task(request(limiter, log, "high", chat_id=None, priority=PRIORITY_HIGH)))
+        await asyncio.gather(*tasks)
+        await limiter.shutdown()
+        return log
+    assert asyncio.run(scenario()) == ["high", "low"]
+
+
+def test_initialize_twice_keeps_one_dispatcher():
+    # ExtBot.initialize вызывают и Application, и Updater: второй вызов не должен запускать ещё один диспетчер.
+    async def scenario():
+        limiter = PriorityRateLimiter()
+        await limiter.initialize()
+        dispatcher = limiter._dispatcher
+        await limiter.initialize()
+        same = limiter._dispatcher is dispatcher
+        others = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        await limiter.shutdown()
+        return same, len(others), dispatcher.done()
+    assert asyncio.run(scenario()) == (True, 1, True)
@@ -0,0 +1,170 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram import File
+from telegram.error import BadRequest
+
+from relay import MEDIA_KINDS, Transfer
+from spool import MemoryBudget
+
+DOCUMENT = next(kind for kind in MEDIA_KINDS if kind.name == "document")
+
+
+class FakeFile:
+    def __init__(self, data: bytes, file_path: str = "https://api.telegram.org/file/bot1/documents/a.pdf"):
+        self.data = data
+        self.file_size = len(data)
+        self.file_path = file_path
+        self.request = SimpleNamespace(retrieve=self.retrieve)
+        self.retrieved = []
+
+    def get_bot(self):
+        return SimpleNamespace(request=self.request)
+
+    def _get_encoded_url(self):
+        return self.file_path
+
+    async def retrieve(self, url):
+        self.retrieved.append(url)
+        return self.data
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_document(self, chat_id, document, **kwargs):
+        if isinstance(document, str):
+            raise BadRequest("Wrong file identifier/http url specified")
+        self.sent.append(document)
+        return document
+
+
+class NoSpool:
+    def download(self, file):
+        raise AssertionError("небольшой файл не должен уходить в спул")
+
+
+def media(file):
+    async def get_file():
+        return file
+    return SimpleNamespace(file_id="stale", file_unique_id="u1", file_name="a.pdf",
+                           file_size=file.file_size, get_file=get_file)
+
+
+def test_small_file_waits_for_budget_and_stays_in_memory():
+    modes = []
+    memory = MemoryBudget(100)
+    transfer = Transfer(NoSpool(), memory, memory_threshold=50,
+                        on_bytes=lambda kind, mode, amount: modes.append(mode))
+    bot = FakeBot()
+    file = FakeFile(b"x" * 40)
+
+    async def scenario():
+        async with memory.hold(90):  # лимит почти исчерпан другой пересылкой
+            task = asyncio.create_task(transfer.send(bot, 7, DOCUMENT, media(file)))
+            await asyncio.sleep(0.01)
+            assert not task.done() and bot.sent == []
+        await asyncio.wait_for(task, 1)
+
+    asyncio.run(scenario())
+    assert modes == ["memory"]
+    assert bot.sent[0].input_file_content == file.data
+    assert memory.waits_total == 1
+    assert memory.in_use == 0
+
+
+def real_file(file_path: str, retrieved: list):
+    async def retrieve(url):
+        retrieved.append(url)
+        return b"data"
+
+    file = File("id", "uid", file_size=4, file_path=file_path)
+    file.set_bot(SimpleNamespace(request=SimpleNamespace(retrieve=retrieve)))
+    return file
+
+
+def test_download_bytes_uses_encoded_url():
+    retrieved = []
+    file = real_file("https://api.telegram.org/file/bot1/documents/счёт за май.pdf", retrieved)
+    assert asyncio.run(Transfer.download_bytes(file)) == b"data"
+    assert retrieved == [file._get_encoded_url()]
+    assert " " not in retrieved[0] and "счёт" not in retrieved[0]
+
+
+def test_download_bytes_reads_local_file(tmp_path):
+    path = tmp_path / "счёт за май.pdf"
+    path.write_bytes(b"local")
+    retrieved = []
+    assert asyncio.run(Transfer.download_bytes(real_file(str(path), retrieved))) == b"local"
+    assert retrieved == []
+
+
+class PipelineBot:
+    def __init__(self):
+        self.replies = []
+        self.documents = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.replies.append(text)
+
+    async def send_document(self, chat_id, document, **kwargs):
+        self.documents.append((chat_id, document))
+
+
+def pipeline_context(bot):
+    return SimpleNamespace(bot=bot, application=SimpleNamespace(
+        create_task=lambda coroutine: asyncio.get_running_loop().create_task(coroutine)
+    ))
+
+
+def document_message(message_id, sender_id, size=10, unique_id=None, media_group_id=None):
+    document = SimpleNamespace(file_id=f"f{message_id}", file_unique_id=unique_id or f"u{message_id}",
+                               file_size=size, file_name="a.pdf")
+    fields = dict.fromkeys(("photo", "video", "animation", "voice", "video_note", "audio"))
+    return SimpleNamespace(message_id=message_id, chat_id=sender_id, media_group_id=media_group_id,
+                           from_user=SimpleNamespace(id=sender_id), caption=None, document=document, **fields)
+
+
+def test_album_quota_counts_every_item(monkeypatch):
+    import bot1
+    from albums import MediaGroupCollector
+    from relay import RelayJob
+
+    monkeypatch.setattr(bot1, "TICKET_QUOTA", bot1.TicketQuota(max_files=2))
+    monkeypatch.setattr(bot1, "ALBUMS", MediaGroupCollector(bot1.relay_album, window=10))
+    bot = PipelineBot()
+
+    async def scenario():
+        context = pipeline_context(bot)
+        statuses = []
+        for message_id in (1, 2, 3):
+            job = await bot1.ALBUM_ITEM_RELAY.run(
+                RelayJob(context, document_message(message_id, 9001, media_group_id="g"))
+            )
+            statuses.append(job.status)
+        assert len(bot1.ALBUMS.collected(9001)) == 2
+        return statuses
+
+    assert asyncio.run(scenario()) == [None, None, "quota"]
+    assert bot.replies == [bot1.QUOTA_TEXT]
+
+
+def test_operator_reply_runs_duplicate_and_size_checks(monkeypatch):
+    import bot1
+    from relay import RelayJob
+
+    operator_id = bot1.OPERATORS.operator_ids[0]
+    monkeypatch.setattr(bot1, "ATTACHMENT_MAX_SIZE", 100)
+    bot = PipelineBot()
+
+    async def relay(message_id, user_id, size=10, unique_id="same"):
+        message = document_message(message_id, operator_id, size=size, unique_id=unique_id)
+        job = await bot1.OPERATOR_REPLY_RELAY.run(RelayJob(pipeline_context(bot), message, chat_id=user_id))
+        return job.status
+
+    assert asyncio.run(relay(1, 501)) is None
+    assert asyncio.run(relay(2, 501)) == "duplicate"
+    assert asyncio.run(relay(3, 502)) is None  # тот же файл другому пользователю — не повтор
+    assert asyncio.run(relay(4, 501, size=1000, unique_id="big")) == "too_large"
+    assert [chat_id for chat_id, _ in bot.documents] == [501, 502]
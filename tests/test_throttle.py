@@ -0,0 +1,101 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram.ext import ApplicationHandlerStop
+
+import bot1
+import throttle
+from throttle import MUTE_START, MUTED, RATE, RATE_FIRST, TicketQuota, UserThrottle
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(throttle.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_burst_then_rate_first_then_rate(clock):
+    limiter = UserThrottle(rate=1, burst=3, mute_after=0)
+    assert [limiter.check(1) for _ in range(5)] == [None, None, None, RATE_FIRST, RATE]
+    assert limiter.check(2) is None  # у другого пользователя свой запас
+    clock[0] += 1
+    assert limiter.check(1) is None
+    assert limiter.throttled_total[RATE] == 2
+
+
+def test_album_spends_one_token(clock):
+    limiter = UserThrottle(rate=1, burst=2, mute_after=0)
+    assert [limiter.check(1, "album") for _ in range(10)] == [None] * 10
+    assert limiter.check(1) is None
+    assert limiter.check(1) == RATE_FIRST
+
+
+def test_mute_after_strikes_and_unmute(clock):
+    limiter = UserThrottle(rate=1, burst=1, mute_after=3, mute_for=60)
+    assert [limiter.check(1) for _ in range(4)] == [None, RATE_FIRST, RATE, MUTE_START]
+    assert limiter.check(1) == MUTED
+    assert set(limiter.muted()) == {1}
+    assert limiter.unmute(1)
+    assert limiter.check(1) is None
+    limiter.mute(1, 60)
+    clock[0] += 61
+    assert limiter.check(1) is None
+    assert limiter.mutes_total == 2
+
+
+def test_disabled_throttle_still_honours_manual_mute(clock):
+    limiter = UserThrottle(rate=0, burst=0)
+    assert [limiter.check(1) for _ in range(100)] == [None] * 100
+    limiter.mute(1, 60)
+    assert limiter.check(1) == MUTED
+
+
+def test_ticket_quota_files_and_bytes():
+    quota = TicketQuota(max_files=2, max_bytes=100)
+    assert quota.check(7, 60) is None
+    quota.charge(7, 60)
+    assert quota.check(7, 50) == "bytes"
+    assert quota.check(7, 40) is None
+    quota.charge(7, 40)
+    assert quota.check(7, 0) == "files"
+    assert quota.check(8, 10) is None
+    assert quota.check(None, 101) == "bytes"  # обращения ещё нет — лимит на один файл всё равно действует
+    assert quota.rejected_total == {"files": 1, "bytes": 2}
+
+
+def test_ticket_quota_checks_several_files_at_once():
+    quota = TicketQuota(max_files=3)
+    quota.charge(7)
+    assert quota.check(7, files=2) is None
+    assert quota.check(7, files=3) == "files"
+
+
+def test_ticket_quota_evicts_oldest_ticket():
+    quota = TicketQuota(max_files=1, capacity=2)
+    for ticket_id in (1, 2, 3):
+        quota.charge(ticket_id)
+    assert quota.check(1) is None
+    assert quota.check(3) == "files"
+
+
+def test_throttled_callback_query_is_answered(clock, monkeypatch):
+    monkeypatch.setattr(bot1, "THROTTLE", UserThrottle(rate=1, burst=1, mute_after=0))
+    answers = []
+
+    async def answer(text=None, show_alert=None):
+        answers.append((text, show_alert))
+
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=42), message=None,
+                             callback_query=SimpleNamespace(answer=answer))
+
+    async def press():
+        try:
+            await bot1.throttle_guard(update, None)
+        except ApplicationHandlerStop:
+            return "stopped"
+
+    assert [asyncio.run(press()) for _ in range(3)] == [None, "stopped", "stopped"]
+    assert answers[0][1] is True  # первое предупреждение — окном
+    assert answers[1] == (bot1.THROTTLE_QUERY_NOTICES[RATE], None)
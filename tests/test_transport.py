@@ -0,0 +1,30 @@
+import asyncio
+
+import httpx
+
+from transport import PoolRequest
+
+
+def test_pool_builds_one_client_with_its_limits(monkeypatch):
+    built = []
+
+    class CountingClient(httpx.AsyncClient):
+        def __init__(self, **kwargs):
+            built.append(kwargs)
+            super().__init__(**kwargs)
+
+    monkeypatch.setattr(httpx, "AsyncClient", CountingClient)
+    timeout = httpx.Timeout(5.0, read=30.0, write=30.0, pool=10.0)
+    pool = PoolRequest("files", 8, timeout, keepalive_expiry=90.0)
+
+    assert len(built) == 1
+    limits = built[0]["limits"]
+    assert (limits.max_connections, limits.max_keepalive_connections, limits.keepalive_expiry) == (8, 8, 90.0)
+    assert built[0]["timeout"] == timeout
+
+    async def restart():
+        await pool.shutdown()
+        await pool.initialize()
+    asyncio.run(restart())
+    assert len(built) == 2
+    assert built[1]["limits"].keepalive_expiry == 90.0
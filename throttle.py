@@ -0,0 +1,138 @@
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Итог проверки UserThrottle.check (None — сообщение пропускается).
+RATE = "rate"              # сверх лимита, пользователь уже предупреждён
+RATE_FIRST = "rate_first"  # первое сообщение сверх лимита — пора предупредить
+MUTED = "muted"            # пользователь в списке заглушённых
+MUTE_START = "mute_start"  # этим сообщением пользователь заглушён автоматически — пора сообщить
+
+
+class _UserState:
+    __slots__ = ("tokens", "updated", "strikes", "group")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        self.strikes = 0    # сообщений сверх лимита подряд
+        self.group = None   # media_group_id последнего альбома: альбом расходует один токен
+
+
+class UserThrottle:
+    """
+    Лимит входящих сообщений и нажатий кнопок на пользователя — до скачивания файлов и постов оператору.
+
+    - Token bucket: rate сообщений в секунду, запас burst. Альбом считается одним сообщением.
+    - Сообщения сверх лимита отбрасываются; после mute_after таких сообщений подряд пользователь
+      заглушается на mute_for секунд. Операторы могут заглушить и вернуть пользователя вручную.
+    - Состояние — в OrderedDict не больше чем на capacity пользователей (LRU), проверка — O(1).
+    throttled_total — отброшенные сообщения по причине (rate, muted), чтобы подбирать лимиты.
+    """
+
+    def __init__(self, rate: float, burst: float, mute_after: int = 20, mute_for: float = 600,
+                 capacity: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.mute_after = mute_after
+        self.mute_for = mute_for
+        self.capacity = capacity
+        self._users = OrderedDict()  # user_id -> _UserState
+        self._mutes = {}             # user_id -> time.monotonic(), до которого пользователь заглушён
+        self.throttled_total = {RATE: 0, MUTED: 0}
+        self.mutes_total = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def check(self, user_id: int, media_group_id: str = None):
+        """Проверяет очередное сообщение пользователя; None — пропустить, иначе причина отказа."""
+        now = time.monotonic()
+        until = self._mutes.get(user_id)
+        if until is not None:
+            if now < until:
+                self.throttled_total[MUTED] += 1
+                return MUTED
+            del self._mutes[user_id]
+        if not self.enabled:
+            return None
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserState(self.burst, now)
+            if len(self._users) > self.capacity:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        if media_group_id is not None and media_group_id == state.group:
+            return None
+        state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+        state.updated = now
+        if state.tokens >= 1:
+            state.tokens -= 1
+            state.strikes = 0
+            state.group = media_group_id
+            return None
+        state.strikes += 1
+        self.throttled_total[RATE] += 1
+        if self.mute_after and state.strikes >= self.mute_after:
+            state.strikes = 0
+            self.mute(user_id, self.mute_for)
+            logger.warning(f"Пользователь {user_id} заглушён на {self.mute_for:.0f} с за флуд")
+            return MUTE_START
+        return RATE_FIRST if state.strikes == 1 else RATE
+
+    def mute(self, user_id: int, seconds: float):
+        self._mutes[user_id] = time.monotonic() + seconds
+        self.mutes_total += 1
+
+    def unmute(self, user_id: int) -> bool:
+        self._users.pop(user_id, None)  # после разглушения — полный запас токенов
+        return self._mutes.pop(user_id, None) is not None
+
+    def muted(self) -> dict:
+        """Заглушённые сейчас пользователи: {user_id: осталось секунд}."""
+        now = time.monotonic()
+        for user_id in [u for u, until in self._mutes.items() if until <= now]:
+            del self._mutes[user_id]
+        return {user_id: until - now for user_id, until in self._mutes.items()}
+
+
+class TicketQuota:
+    """
+    Лимит вложений в одном обращении: не больше max_files файлов и max_bytes байт (0 — без лимита).
+    Счётчики — в OrderedDict на capacity последних обращений; check и charge — O(1).
+    """
+
+    def __init__(self, max_files: int = 0, max_bytes: int = 0, capacity: int = 10000):
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.capacity = capacity
+        self._tickets = OrderedDict()  # ticket_id -> [файлов, байт]
+        self.rejected_total = {"files": 0, "bytes": 0}
+
+    def check(self, ticket_id, size: int = 0, files: int = 1):
+        """None, если files вложений общим размером size помещаются в лимит обращения; иначе причина: files или bytes."""
+        entry = self._tickets.get(ticket_id) if ticket_id is not None else None
+        charged, total = (entry[0], entry[1]) if entry else (0, 0)
+        if self.max_files and charged + files > self.max_files:
+            reason = "files"
+        elif self.max_bytes and total + size > self.max_bytes:
+            reason = "bytes"
+        else:
+            return None
+        self.rejected_total[reason] += 1
+        return reason
+
+    def charge(self, ticket_id: int, size: int = 0, files: int = 1):
+        entry = self._tickets.get(ticket_id)
+        if entry is None:
+            entry = self._tickets[ticket_id] = [0, 0]
+            if len(self._tickets) > self.capacity:
+                self._tickets.popitem(last=False)
+        else:
+            self._tickets.move_to_end(ticket_id)
+        entry[0] += files
+        entry[1] += size
@@ -0,0 +1,250 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from persistence import open_db
+
+logger = logging.getLogger(__name__)
+
+# Статусы обращения
+OPEN = "open"            # ждёт ответа оператора
+ANSWERED = "answered"    # оператор ответил, ждём пользователя
+CLOSED = "closed"        # закрыто оператором
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (
+    id            INTEGER PRIMARY KEY,
+    user_id       INTEGER NOT NULL,
+    user_name     TEXT NOT NULL,
+    status        TEXT NOT NULL,
+    created_at    REAL NOT NULL,
+    updated_at    REAL NOT NULL,
+    waiting_since REAL,
+    assignee      INTEGER,
+    assigned_at   REAL
+);
+CREATE INDEX IF NOT EXISTS tickets_by_user ON tickets (user_id, status);
+CREATE INDEX IF NOT EXISTS tickets_by_status ON tickets (status, waiting_since);
+CREATE TABLE IF NOT EXISTS ticket_messages (
+    id         INTEGER PRIMARY KEY,
+    ticket_id  INTEGER NOT NULL,
+    direction  TEXT NOT NULL,
+    kind       TEXT NOT NULL,
+    text       TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ticket_messages_by_ticket ON ticket_messages (ticket_id, id);
+"""
+
+# Колонки, добавленные после первой версии схемы: (имя, тип).
+MIGRATIONS = (
+    ("assignee", "INTEGER"),
+    ("assigned_at", "REAL"),
+)
+
+
+class TicketStore:
+    """
+    Обращения пользователей и переписка по ним в SQLite (та же база, что и у SQLitePersistence).
+
+    У пользователя не больше одного незакрытого обращения: новые сообщения дописываются в него.
+    Все выборки идут по индексам: по пользователю (user_id, status), по очереди (status, waiting_since)
+    и по переписке (ticket_id, id), поэтому каждая операция — несколько обращений к B-дереву
+    и выполняется прямо в обработчике без заметной задержки.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @property
+    def db(self):
+        if self._conn is None:
+            self._conn = open_db(self.path)
+            self._conn.executescript(SCHEMA)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(tickets)")}
+            for name, column_type in MIGRATIONS:
+                if name not in columns:
+                    self._conn.execute(f"ALTER TABLE tickets ADD COLUMN {name} {column_type}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS tickets_by_assignee ON tickets (assignee, status)")
+        return self._conn
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self.db.execute("BEGIN")
+            try:
+                yield
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def _active_ticket(self, user_id: int):
+        return self.db.execute(
+            "SELECT id, status FROM tickets WHERE user_id = ? AND status IN (?, ?) ORDER BY id DESC LIMIT 1",
+            (user_id, OPEN, ANSWERED)
+        ).fetchone()
+
+    def active_ticket_id(self, user_id: int):
+        """ID незакрытого обращения пользователя или None."""
+        row = self._active_ticket(user_id)
+        return row[0] if row else None
+
+    def add_user_message(self, user, kind: str, text: str = None) -> int:
+        """Записывает сообщение пользователя; открывает обращение, если открытого нет. Возвращает ID обращения."""
+        now = time.time()
+        name = " ".join(filter(None, [user.first_name, user.last_name]))
+        with self._transaction():
+            row = self._active_ticket(user.id)
+            if row is None:
+                ticket_id = self.db.execute(
+                    "INSERT INTO tickets (user_id, user_name, status, created_at, updated_at, waiting_since) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (user.id, name, OPEN, now, now, now)
+                ).lastrowid
+            else:
+                ticket_id, status = row
+                if status == OPEN:
+                    self.db.execute("UPDATE tickets SET updated_at = ? WHERE id = ?", (now, ticket_id))
+                else:
+                    self.db.execute(
+                        "UPDATE tickets SET status = ?, updated_at = ?, waiting_since = ? WHERE id = ?",
+                        (OPEN, now, now, ticket_id)
+                    )
+            self.db.execute(
+                "INSERT INTO ticket_messages (ticket_id, direction, kind, text, created_at) VALUES (?, 'user', ?, ?, ?)",
+                (ticket_id, kind, text, now)
+            )
+        return ticket_id
+
+    def add_operator_message(self, user_id: int, kind: str, text: str = None, operator_id: int = None):
+        """
+        Записывает ответ оператора в текущее обращение пользователя и помечает его отвеченным.
+        Ответивший оператор становится исполнителем обращения.
+        """
+        now = time.time()
+        with self._transaction():
+            row = self._active_ticket(user_id)
+            if row is None:
+                return None
+            ticket_id = row[0]
+            self.db.execute(
+                "UPDATE tickets SET status = ?, updated_at = ?, waiting_since = NULL, "
+                "assignee = COALESCE(?, assignee), assigned_at = CASE WHEN ? IS NULL THEN assigned_at ELSE ? END "
+                "WHERE id = ?",
+                (ANSWERED, now, operator_id, operator_id, now, ticket_id)
+            )
+            self.db.execute(
+                "INSERT INTO ticket_messages (ticket_id, direction, kind, text, created_at) "
+                "VALUES (?, 'operator', ?, ?, ?)",
+                (ticket_id, kind, text, now)
+            )
+        return ticket_id
+
+    def close(self, user_id: int):
+        """Закрывает текущее обращение пользователя. Возвращает его ID или None."""
+        with self._transaction():
+            row = self._active_ticket(user_id)
+            if row is None:
+                return None
+            self.db.execute(
+                "UPDATE tickets SET status = ?, updated_at = ?, waiting_since = NULL WHERE id = ?",
+                (CLOSED, time.time(), row[0])
+            )
+        return row[0]
+
+    def open_queue(self, limit: int = 20, assignee: int = None):
+        """
+        Обращения, ждущие ответа, — сначала самые давние: [(id, user_id, user_name, waiting_since)].
+        assignee — только обращения этого оператора.
+        """
+        if assignee is None:
+            return self.db.execute(
+                "SELECT id, user_id, user_name, waiting_since FROM tickets "
+                "WHERE status = ? ORDER BY waiting_since LIMIT ?",
+                (OPEN, limit)
+            ).fetchall()
+        return self.db.execute(
+            "SELECT id, user_id, user_name, waiting_since FROM tickets "
+            "WHERE assignee = ? AND status = ? ORDER BY waiting_since LIMIT ?",
+            (assignee, OPEN, limit)
+        ).fetchall()
+
+    def count_open(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM tickets WHERE status = ?", (OPEN,)).fetchone()[0]
+
+    def thread(self, user_id: int, limit: int = 30):
+        """Последние сообщения всех обращений пользователя в хронологическом порядке."""
+        rows = self.db.execute(
+            "SELECT m.ticket_id, m.direction, m.kind, m.text, m.created_at "
+            "FROM tickets t JOIN ticket_messages m ON m.ticket_id = t.id "
+            "WHERE t.user_id = ? ORDER BY m.id DESC LIMIT ?",
+            (user_id, limit)
+        ).fetchall()
+        rows.reverse()
+        return rows
+
+    def answered(self, limit: int = 5000, ticket_id: int = None):
+        """
+        Отвеченные обращения для подсказок: [(id, текст сообщений пользователя, последний текстовый ответ
+        оператора)] — сначала новые. ticket_id — только это обращение, в любом статусе.
+        """
+        if ticket_id is None:
+            where, params = "t.status IN (?, ?)", (ANSWERED, CLOSED)
+        else:
+            where, params = "t.id = ?", (ticket_id,)
+        return self.db.execute(
+            "SELECT t.id, "
+            "(SELECT group_concat(text, ' ') FROM ticket_messages "
+            " WHERE ticket_id = t.id AND direction = 'user' AND text IS NOT NULL), "
+            "(SELECT text FROM ticket_messages "
+            " WHERE ticket_id = t.id AND direction = 'operator' AND kind = 'text' ORDER BY id DESC LIMIT 1) "
+            f"FROM tickets t WHERE {where} ORDER BY t.id DESC LIMIT ?",
+            params + (limit,)
+        ).fetchall()
+
+    # ---------------------------------------------
+    # ASSIGNMENT
+    # ---------------------------------------------
+    def assignee(self, ticket_id: int):
+        row = self.db.execute("SELECT assignee FROM tickets WHERE id = ?", (ticket_id,)).fetchone()
+        return row[0] if row else None
+
+    def assign(self, ticket_id: int, operator_id: int):
+        with self._transaction():
+            self.db.execute(
+                "UPDATE tickets SET assignee = ?, assigned_at = ? WHERE id = ?",
+                (operator_id, time.time(), ticket_id)
+            )
+
+    def last_assignee(self, user_id: int):
+        """Исполнитель последнего обращения пользователя (для закрепления за оператором)."""
+        row = self.db.execute(
+            "SELECT assignee FROM tickets WHERE user_id = ? AND assignee IS NOT NULL ORDER BY id DESC LIMIT 1",
+            (user_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def active_counts(self) -> dict:
+        """Число незакрытых обращений по исполнителям: {operator_id: count}."""
+        return dict(self.db.execute(
+            "SELECT assignee, COUNT(*) FROM tickets WHERE status IN (?, ?) AND assignee IS NOT NULL "
+            "GROUP BY assignee",
+            (OPEN, ANSWERED)
+        ).fetchall())
+
+    def overdue(self, older_than: float):
+        """
+        Обращения, которые ждут ответа дольше older_than секунд с момента назначения текущему исполнителю:
+        [(id, user_id, user_name, assignee, waiting_since)].
+        """
+        deadline = time.time() - older_than
+        return self.db.execute(
+            "SELECT id, user_id, user_name, assignee, waiting_since FROM tickets "
+            "WHERE status = ? AND waiting_since < ? AND (assigned_at IS NULL OR assigned_at < ?) "
+            "ORDER BY waiting_since",
+            (OPEN, deadline, deadline)
+        ).fetchall()
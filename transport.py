@@ -0,0 +1,144 @@
+import asyncio
+import importlib.util
+import logging
+
+import httpx
+from telegram.error import TimedOut
+from telegram.request import BaseRequest, HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 в httpx требует пакет h2 (python-telegram-bot[http2]).
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def choose_http_version(requested: str = "") -> str:
+    """Версия HTTP для пула: requested ("1.1" / "2"), по умолчанию — 2, если установлен h2."""
+    if requested == "2" and not HTTP2_AVAILABLE:
+        logger.warning("HTTP/2 недоступен (нет пакета h2), используется HTTP/1.1")
+        return "1.1"
+    return requested or ("2" if HTTP2_AVAILABLE else "1.1")
+
+
+def _at_least(value, default: float):
+    """Явный таймаут из PTB (например, 20 с на загрузку) не должен быть меньше таймаута пула."""
+    if isinstance(value, (int, float)) and default is not None:
+        return max(value, default)
+    return value
+
+
+class PoolRequest(HTTPXRequest):
+    """
+    HTTPXRequest одного пула: keep-alive на keepalive_expiry секунд (в httpx по умолчанию 5 с —
+    после паузы в разговоре каждый ответ платил бы за новое TLS-соединение) и счётчики занятости.
+    saturated_total — запросы, которым не хватило свободного соединения (HTTP/1.1) и пришлось ждать.
+    """
+
+    __slots__ = ("name", "size", "timeout", "keepalive_expiry", "in_flight", "in_flight_max", "requests_total",
+                 "saturated_total", "pool_timeouts_total")
+
+    def __init__(self, name: str, size: int, timeout: httpx.Timeout, keepalive_expiry: float = 60.0,
+                 http_version: str = "1.1"):
+        self.name = name
+        self.size = size
+        self.timeout = timeout
+        self.keepalive_expiry = keepalive_expiry
+        super().__init__(
+            connection_pool_size=size,
+            connect_timeout=timeout.connect,
+            read_timeout=timeout.read,
+            write_timeout=timeout.write,
+            pool_timeout=timeout.pool,
+            http_version=http_version
+        )
+        self.in_flight = 0
+        self.in_flight_max = 0
+        self.requests_total = 0
+        self.saturated_total = 0
+        self.pool_timeouts_total = 0
+
+    def _build_client(self) -> httpx.AsyncClient:
+        # HTTPXRequest не принимает keepalive_expiry и строит клиент прямо в конструкторе (и заново
+        # в initialize() после shutdown()) — limits подставляются здесь, чтобы клиент создавался один раз.
+        self._client_kwargs["limits"] = httpx.Limits(
+            max_connections=self.size, max_keepalive_connections=self.size, keepalive_expiry=self.keepalive_expiry
+        )
+        return super()._build_client()
+
+    async def do_request(self, url: str, method: str, request_data=None,
+                         read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE, pool_timeout=BaseRequest.DEFAULT_NONE):
+        self.requests_total += 1
+        if self.in_flight >= self.size and self.http_version == "1.1":
+            self.saturated_total += 1
+        self.in_flight += 1
+        self.in_flight_max = max(self.in_flight_max, self.in_flight)
+        try:
+            return await super().do_request(
+                url, method, request_data,
+                read_timeout=_at_least(read_timeout, self.timeout.read),
+                write_timeout=_at_least(write_timeout, self.timeout.write),
+                connect_timeout=_at_least(connect_timeout, self.timeout.connect),
+                pool_timeout=_at_least(pool_timeout, self.timeout.pool)
+            )
+        except TimedOut as e:
+            if isinstance(e.__cause__, httpx.PoolTimeout):
+                self.pool_timeouts_total += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "http_version": self.http_version,
+            "in_flight": self.in_flight,
+            "in_flight_max": self.in_flight_max,
+            "requests_total": self.requests_total,
+            "saturated_total": self.saturated_total,
+            "pool_timeouts_total": self.pool_timeouts_total,
+        }
+
+
+class RoutedRequest(BaseRequest):
+    """
+    Запросы бота через два пула соединений:
+    - fast — обычные методы Bot API (кнопки, сообщения, отправка по file_id);
+    - files — скачивание файлов (GET на base_file_url) и загрузки multipart.
+    Многомегабайтная загрузка занимает соединение files и не задерживает answerCallbackQuery.
+    """
+
+    __slots__ = ("fast", "files")
+
+    def __init__(self, fast: PoolRequest, files: PoolRequest):
+        self.fast = fast
+        self.files = files
+
+    @property
+    def pools(self):
+        return self.fast, self.files
+
+    async def initialize(self) -> None:
+        await asyncio.gather(self.fast.initialize(), self.files.initialize())
+
+    async def shutdown(self) -> None:
+        await asyncio.gather(self.fast.shutdown(), self.files.shutdown())
+
+    def route(self, method: str, request_data=None) -> PoolRequest:
+        if method == "GET" or (request_data is not None and request_data.contains_files):
+            return self.files
+        return self.fast
+
+    async def do_request(self, url: str, method: str, request_data=None,
+                         read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE, pool_timeout=BaseRequest.DEFAULT_NONE):
+        return await self.route(method, request_data).do_request(
+            url, method, request_data,
+            read_timeout=read_timeout,
+            write_timeout=write_timeout,
+            connect_timeout=connect_timeout,
+            pool_timeout=pool_timeout
+        )
+
+    def stats(self) -> dict:
+        return {pool.name: pool.stats() for pool in self.pools}